@@ -4,8 +4,9 @@ The application entry point with multi-page Streamlit interface.
 
 from typing import Dict, Type
 import streamlit as st
-from app_config import ConfigLoader, LogLoader
-from page_renderers import StreamlitPage, HomePage, UploadPage, QueryPage
+from loguru._logger import Logger
+from app_config import DEFAULT_CONFIG_FILE, ConfigLoader, LogLoader
+from page_renderers import StreamlitPage, HomePage, UploadPage, QueryPage, DiagnosticsPage
 from utils.page_manager import PageManager
 
 
@@ -14,10 +15,19 @@ def get_pages() -> Dict[str, Type[StreamlitPage]]:
     Get the mapping of page names to their class implementations.
     Returns a dictionary of the application's pages.
     """
-    pages = [HomePage, UploadPage, QueryPage]
+    pages = [HomePage, UploadPage, QueryPage, DiagnosticsPage]
     return {page_class().page_name: page_class for page_class in pages}
 
 
+@st.cache_resource
+def configure_logger(_logger_configurator: LogLoader, log_name: str, log_format: str, log_level: str) -> Logger:
+    """
+    Configures the logger once per process rather than on every Streamlit rerun,
+    and again only when the logger settings change.
+    """
+    return _logger_configurator.configure_logger(log_name, log_format, log_level)
+
+
 def setup_streamlit_interface() -> None:
     """
     Sets up the basic Streamlit interface.
@@ -32,13 +42,15 @@ def main(cfg_: Dict[str, any], logger_configurator_: LogLoader, page_manager_: P
     param page_manager: The object to manage the pages.
     """
 
-    logger =logger_configurator_.configure_logger(
+    logger = configure_logger(
+        logger_configurator_,
         cfg_["logger"]["log_name"],
         cfg_["logger"]["format"],
         cfg_["logger"]["level"],
     )
 
     setup_streamlit_interface()
+
     # Sidebar navigation
     selected_page = page_manager_.set_global_sidebar_widgets()
     st.session_state.current_page = selected_page
@@ -46,10 +58,18 @@ def main(cfg_: Dict[str, any], logger_configurator_: LogLoader, page_manager_: P
     # Display selected page
     page_manager_.display_page(selected_page, cfg_)
 
+    # Load the shared embedding model once the first page is shown rather than before,
+    # so the first render does not wait for torch; it is cached across reruns and sessions
+    if cfg_["embeddings"]["warm_up"]:
+        from utils.model_registry import get_embedding_model  # pylint: disable=import-outside-toplevel
+        get_embedding_model(
+            cfg_["embeddings"]["model_name"], cfg_["embeddings"]["device"], cfg_["embeddings"]["backend"], cfg_["onnx"]
+        )
+
 
 if __name__ == "__main__":
     # Dependency Injection in action!
-    config_loader = ConfigLoader("config/config.toml")
+    config_loader = ConfigLoader(DEFAULT_CONFIG_FILE)
     cfg = config_loader.load_config()
 
     logger_configurator = LogLoader()
@@ -2,13 +2,22 @@
 Handles application configuration.
 """
 
+import copy
+import os
 import sys
+import threading
 from pathlib import Path
-from typing import Dict
+from typing import Dict, TextIO, Tuple
 import toml
 from loguru import logger
 from loguru._logger import Logger
 
+DEFAULT_CONFIG_FILE = "config/config.toml"
+
+# Parsed configs by absolute path, with the modification time and size they were parsed at
+_CONFIG_CACHE: Dict[str, Tuple[Tuple[int, int], Dict[str, any]]] = {}
+_CONFIG_LOCK = threading.Lock()
+
 
 class ConfigLoader:
     """
@@ -19,8 +28,20 @@ class ConfigLoader:
         self.config_file = config_file
 
     def load_config(self) -> Dict[str, any]:
-        """Loads config from file"""
-        return toml.load(self.config_file)
+        """
+        Loads config from file. The parsed file is cached until it changes on disk,
+        so Streamlit reruns do not parse it again. Each call returns its own copy,
+        which the caller may modify.
+        """
+        path = os.path.abspath(self.config_file)
+        stat = os.stat(path)
+        version = (stat.st_mtime_ns, stat.st_size)
+        with _CONFIG_LOCK:
+            cached = _CONFIG_CACHE.get(path)
+            if cached is None or cached[0] != version:
+                cached = (version, toml.load(path))
+                _CONFIG_CACHE[path] = cached
+        return copy.deepcopy(cached[1])
 
 
 class LogLoader:
@@ -59,12 +80,13 @@ class LogLoader:
 
         return level.upper() in valid_levels
 
-    def configure_logger(self, log_file: str, log_format: str, log_level: str) -> Logger:
+    def configure_logger(self, log_file: str, log_format: str, log_level: str, stream: TextIO = sys.stdout) -> Logger:
         """
         Configures logging for the application.
         param log_file (str): The log file name.
         param log_format (str): The log format.
         param log_level (str): The log level.
+        param stream (TextIO): The console stream to log to.
         Returns: Logger: Configured logger instance.
         Raises: ValueError: If the provided log level is invalid.
         """
@@ -85,6 +107,6 @@ class LogLoader:
             diagnose=True,
         )
 
-        # Add stdout handler
-        logger.add(sys.stdout, format=log_format, level=log_level.upper())
+        # Add console handler
+        logger.add(stream, format=log_format, level=log_level.upper())
         return logger
@@ -0,0 +1,435 @@
+"""
+Command-line entry point for running the RAG Document System without the Streamlit UI.
+
+Usage:
+    python cli.py ingest --folder /path/to/pdfs
+    python cli.py ingest --folder /path/to/pdfs --background
+    python cli.py query --queries questions.txt --output results.jsonl
+    python cli.py stats
+    python cli.py serve
+    python cli.py compression-report --rerank 50
+    python cli.py benchmark --model hash:384 --sizes 20,200 --output benchmark.json
+    python cli.py import-budget
+    python cli.py embedding-agreement --sample 500
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+from pathlib import Path
+from typing import Dict, List
+import numpy as np
+from app_config import DEFAULT_CONFIG_FILE, ConfigLoader, LogLoader
+from utils.benchmark import compare_results, format_results, run_benchmark, write_results
+from utils.compression_report import compression_report, database_vectors, format_report, storage_options
+from utils.embeddings import DocumentEmbedder
+from utils.index_factory import IndexSpec
+from utils.generations import GenerationStore
+from utils.import_budget import check_import_budget, format_budget_report
+from utils.index_registry import get_index_registry
+from utils.jobs import JobManager, JobReporter
+from utils.manifest import IndexManifest
+from utils.model_registry import EMBEDDING_BACKENDS, get_embedding_model
+from utils.onnx_embeddings import embedding_agreement, format_agreement
+from utils.pdf_parsing import parse_pdfs
+from utils.query_matching import QueryMatcher
+from utils.query_service import MicroBatcher, QueryService
+from utils.search_filter import SearchFilter
+from utils.sharding import ShardLayout
+
+
+def read_queries(query_file: str) -> List[str]:
+    """
+    Read queries from a file, one per line, or '-' for stdin.
+    Lines that are JSON objects use their 'query' field. Blank lines are skipped.
+    param query_file: Path to the query file.
+    Returns: The queries in file order.
+    """
+    handle = sys.stdin if query_file == "-" else open(query_file, "r", encoding="utf-8")
+    with handle:
+        lines = [line.strip() for line in handle]
+    return [json.loads(line)["query"] if line.startswith("{") else line for line in lines if line]
+
+
+def run_ingest(args: argparse.Namespace, cfg_: Dict[str, any]) -> None:
+    """
+    Build or update the FAISS database from a folder of PDFs, either in this
+    process or as a background job.
+    param args: The parsed command-line arguments.
+    param cfg_: The application configuration.
+    """
+    folder_path = args.folder or cfg_["pdf-details"]["pdf_folder"]
+    db_folder = args.db or cfg_["databases"]["db_folder"]
+    model_name = args.model or cfg_["embeddings"]["model_name"]
+
+    if args.background:
+        if args.shards is not None:
+            raise SystemExit("--shards cannot be combined with --background")
+        job_id = JobManager(cfg_["jobs"]["folder"], args.config).submit(
+            folder_path, db_folder, args.chunk_size, args.chunk_overlap, model_name, incremental=not args.full
+        )
+        print(job_id)
+        return
+
+    reporter = JobReporter(cfg_["jobs"]["folder"], args.job_id) if args.job_id else None
+    if reporter is not None:
+        reporter.start()
+    try:
+        embedder = DocumentEmbedder(
+            chunk_size=args.chunk_size,
+            chunk_overlap=args.chunk_overlap,
+            model_name=model_name,
+            cfg=cfg_,
+            device=cfg_["embeddings"]["device"]
+        )
+        embedder.create_faiss_db(
+            folder_path,
+            db_folder,
+            incremental=not args.full,
+            progress=reporter.progress if reporter is not None else None,
+            shards=args.shards
+        )
+    except Exception as e:
+        if reporter is not None:
+            reporter.fail(str(e))
+        raise
+    if reporter is not None:
+        reporter.succeed()
+
+
+def run_stats(args: argparse.Namespace, cfg_: Dict[str, any]) -> None:
+    """
+    Print statistics about the FAISS database as JSON.
+    param args: The parsed command-line arguments.
+    param cfg_: The application configuration.
+    """
+    db_folder = Path(args.db or cfg_["databases"]["db_folder"])
+    shards = get_index_registry().get_shards(str(db_folder))
+    generation = GenerationStore(str(db_folder)).current()
+    generation_dir = generation or db_folder
+    layout = ShardLayout.load(str(generation_dir))
+    manifests = [
+        IndexManifest.load(shard_dir / cfg_["databases"]["manifest"]) for shard_dir in layout.shard_dirs()
+    ]
+    manifests = [manifest for manifest in manifests if manifest is not None]
+    stats = {
+        "db_path": str(db_folder.resolve()),
+        "generation": generation.name if generation is not None else None,
+        "index_type": shards[0].spec.index_type if shards else None,
+        "shards": layout.shard_count,
+        "vectors": sum(int(shard.index.ntotal) for shard in shards),
+        "dimension": int(shards[0].index.d) if shards else None,
+        "chunks": sum(len(shard.store) for shard in shards),
+        "duplicates": sum(shard.store.duplicate_count for shard in shards),
+        "sources": sum(len(shard.store.sources) for shard in shards),
+        "files": sum(len(manifest.files) for manifest in manifests) if manifests else None,
+        "settings": manifests[0].settings if manifests else None,
+        "size_bytes": sum(path.stat().st_size for path in generation_dir.rglob("*") if path.is_file()),
+    }
+    print(json.dumps(stats, indent=2))
+
+
+def run_query(args: argparse.Namespace, cfg_: Dict[str, any]) -> None:
+    """
+    Answer a file of queries with one batched search and write JSON lines.
+    param args: The parsed command-line arguments.
+    param cfg_: The application configuration.
+    """
+    queries = read_queries(args.queries)
+    matcher = QueryMatcher.from_config(cfg_, model_name=args.model, k=args.k, hybrid=args.hybrid or None)
+    db_folder = args.db or cfg_["databases"]["db_folder"]
+    search_filter = SearchFilter.parse(args.filter) if args.filter else None
+    results = matcher.match_queries(
+        queries, db_folder, batch_size=args.batch_size, search_filter=search_filter, with_sources=True
+    )
+
+    output = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    with output:
+        for query, matches in zip(queries, results):
+            record = {
+                "query": query,
+                "results": [
+                    {"text": text, "score": float(score), "sources": sources} for text, score, sources in matches
+                ],
+            }
+            output.write(json.dumps(record) + "\n")
+
+
+def run_serve(args: argparse.Namespace, cfg_: Dict[str, any]) -> None:
+    """
+    Serve queries over HTTP, micro-batching concurrent requests.
+    param args: The parsed command-line arguments.
+    param cfg_: The application configuration.
+    """
+    service_cfg = cfg_["query-service"]
+    matcher = QueryMatcher.from_config(cfg_, model_name=args.model, k=args.k)
+    batcher = MicroBatcher(
+        matcher,
+        args.db or cfg_["databases"]["db_folder"],
+        max_batch_size=service_cfg["max_batch_size"],
+        max_wait_ms=service_cfg["max_wait_ms"]
+    )
+    service = QueryService(batcher, args.host or service_cfg["host"], args.port or service_cfg["port"])
+    try:
+        asyncio.run(service.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+def run_compression_report(args: argparse.Namespace, cfg_: Dict[str, any]) -> None:
+    """
+    Compare recall and memory per vector of the vector storage options on the
+    database's own vectors, and print a table or JSON.
+    param args: The parsed command-line arguments.
+    param cfg_: The application configuration.
+    """
+    db_folder = args.db or cfg_["databases"]["db_folder"]
+    vectors = database_vectors(get_index_registry(), db_folder)
+    if args.queries:
+        model = get_embedding_model(
+            args.model or cfg_["embeddings"]["model_name"], cfg_["embeddings"]["device"],
+            cfg_["embeddings"]["backend"], cfg_["onnx"]
+        )
+        queries = np.asarray(model.embed_documents(read_queries(args.queries)), dtype=np.float32)
+    else:
+        # Without real queries, perturbed corpus vectors stand in for them
+        rng = np.random.default_rng(0)
+        queries = vectors[rng.choice(len(vectors), min(args.sample, len(vectors)), replace=False)]
+        queries = queries + rng.normal(0, queries.std() / 4, queries.shape).astype(np.float32)
+
+    # Compare with the metric the database's vectors were built for
+    metric = get_index_registry().get_shards(db_folder)[0].spec.metric
+    spec = IndexSpec.from_dict({**cfg_["index"], "metric": metric})
+    if args.index_type:
+        spec = IndexSpec.from_dict({**cfg_["index"], "metric": metric, "type": args.index_type, "storage": "float32"})
+    report = compression_report(vectors, queries, storage_options(spec, vectors.shape[1]), args.k, args.rerank)
+    if args.json:
+        print(json.dumps({"vectors": len(vectors), "queries": len(queries), "k": args.k, "results": report}, indent=2))
+    else:
+        print(format_report(report, args.k, len(vectors)))
+
+
+def run_benchmark_command(args: argparse.Namespace, cfg_: Dict[str, any]) -> None:
+    """
+    Benchmark ingest throughput and query latency on synthetic PDFs, write the
+    results as JSON and print them, compared with a baseline when one is given.
+    param args: The parsed command-line arguments.
+    param cfg_: The application configuration.
+    """
+    if args.backend:
+        cfg_["embeddings"]["backend"] = args.backend
+    results = run_benchmark(
+        cfg_,
+        args.workdir,
+        sizes=args.sizes,
+        index_types=args.index_types or [cfg_["index"]["type"]],
+        model_name=args.model or cfg_["embeddings"]["model_name"],
+        pages_per_document=args.pages,
+        query_count=args.queries,
+        k=args.k,
+        seed=args.seed,
+        pdf_backends=args.pdf_backends
+    )
+    write_results(results, args.output)
+    comparison = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as handle:
+            comparison = compare_results(json.load(handle), results)
+    print(format_results(results, comparison))
+
+
+def run_embedding_agreement(args: argparse.Namespace, cfg_: Dict[str, any]) -> None:
+    """
+    Compare the ONNX Runtime embeddings of a model with its PyTorch embeddings on
+    chunks of the corpus; exits with status 1 when they agree less than required.
+    param args: The parsed command-line arguments.
+    param cfg_: The application configuration.
+    """
+    model_name = args.model or cfg_["embeddings"]["model_name"]
+    folder_path = Path(args.folder or cfg_["pdf-details"]["pdf_folder"])
+    pdf_files = sorted(folder_path.glob(cfg_["pdf-details"]["embed_file_pattern"]))
+    documents = []
+    parsed = parse_pdfs(
+        pdf_files, args.chunk_size, args.chunk_overlap, cfg_["ingest"]["workers"], cfg_["ingest"]["pdf_backend"]
+    )
+    for _, chunks, _, _ in parsed:
+        documents += [chunk.page_content for chunk in chunks]
+        if len(documents) >= args.sample:
+            break
+    documents = documents[:args.sample]
+    if not documents:
+        raise SystemExit(f"No chunks found in {folder_path}")
+    if args.queries:
+        queries = read_queries(args.queries)
+    else:
+        # Without real queries, the opening words of some of the chunks stand in for them
+        queries = [" ".join(text.split()[:12]) for text in documents[::max(1, len(documents) // 50)]]
+
+    device = cfg_["embeddings"]["device"]
+    reference = get_embedding_model(model_name, device, "torch")
+    candidate = get_embedding_model(model_name, device, "onnx", cfg_["onnx"])
+    report = embedding_agreement(reference, candidate, documents, queries, args.k)
+    report["passed"] = report["cosine"]["mean"] >= args.min_cosine and (
+        report["topk_overlap"] is None or report["topk_overlap"] >= args.min_overlap
+    )
+    print(json.dumps(report, indent=2) if args.json else format_agreement(report))
+    if not report["passed"]:
+        sys.exit(1)
+
+
+def run_import_budget(args: argparse.Namespace, cfg_: Dict[str, any]) -> None:
+    """
+    Check that importing the Streamlit entry point stays within its time budget and
+    does not load the ML stack; exits with status 1 when it does not.
+    param args: The parsed command-line arguments.
+    param cfg_: The application configuration.
+    """
+    report = check_import_budget(args.module, args.budget_ms or cfg_["startup"]["import_budget_ms"], args.repeats)
+    print(json.dumps(report, indent=2) if args.json else format_budget_report(report))
+    if not report["passed"]:
+        sys.exit(1)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Returns the command-line parser."""
+    parser = argparse.ArgumentParser(description="RAG Document System command-line interface.")
+    parser.add_argument("--config", default=DEFAULT_CONFIG_FILE, help="Path to the TOML config file.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    ingest = subparsers.add_parser("ingest", help="Build or update the FAISS database from a folder of PDFs.")
+    ingest.add_argument("--folder", help="Folder containing PDFs, defaults to the configured one.")
+    ingest.add_argument("--db", help="FAISS database folder, defaults to the configured one.")
+    ingest.add_argument("--model", help="The model to use for embeddings, defaults to the configured one.")
+    ingest.add_argument("--chunk-size", type=int, default=500, help="Number of characters in each text chunk.")
+    ingest.add_argument("--chunk-overlap", type=int, default=150, help="Characters to overlap between chunks.")
+    ingest.add_argument("--full", action="store_true", help="Rebuild the whole database instead of updating it.")
+    ingest.add_argument("--background", action="store_true", help="Submit a background job and print its id.")
+    ingest.add_argument(
+        "--shards", type=lambda value: [int(shard) for shard in value.split(",")],
+        help="Comma-separated shard numbers to update, defaults to all shards."
+    )
+    ingest.add_argument("--job-id", help=argparse.SUPPRESS)
+    ingest.set_defaults(handler=run_ingest)
+
+    query = subparsers.add_parser("query", help="Match a file of queries against the FAISS database.")
+    query.add_argument("--queries", required=True, help="File with one query per line, or '-' for stdin.")
+    query.add_argument("--output", default="-", help="JSON lines output file, or '-' for stdout.")
+    query.add_argument("--db", help="FAISS database folder, defaults to the configured one.")
+    query.add_argument("--model", help="The model to use for embeddings, defaults to the configured one.")
+    query.add_argument("-k", type=int, default=5, help="Number of matches per query.")
+    query.add_argument("--batch-size", type=int, default=64, help="Queries embedded per model call.")
+    query.add_argument("--hybrid", action="store_true", help="Fuse BM25 keyword and vector matches.")
+    query.add_argument("--filter", help="Filter expression, e.g. 'file:manual*.pdf page:3-10 after:2024-01-01'.")
+    query.set_defaults(handler=run_query)
+
+    stats = subparsers.add_parser("stats", help="Print statistics about the FAISS database.")
+    stats.add_argument("--db", help="FAISS database folder, defaults to the configured one.")
+    stats.set_defaults(handler=run_stats)
+
+    serve = subparsers.add_parser("serve", help="Serve queries over HTTP with micro-batching.")
+    serve.add_argument("--db", help="FAISS database folder, defaults to the configured one.")
+    serve.add_argument("--model", help="The model to use for embeddings, defaults to the configured one.")
+    serve.add_argument("-k", type=int, default=5, help="Most matches returned per query.")
+    serve.add_argument("--host", help="Interface to listen on, defaults to the configured one.")
+    serve.add_argument("--port", type=int, help="Port to listen on, defaults to the configured one.")
+    serve.set_defaults(handler=run_serve)
+
+    compression = subparsers.add_parser(
+        "compression-report", help="Compare recall and memory of the vector storage options."
+    )
+    compression.add_argument("--db", help="FAISS database folder, defaults to the configured one.")
+    compression.add_argument("--index-type", help="Index type to compare, defaults to the configured one.")
+    compression.add_argument("--queries", help="File with one query per line, defaults to sampled chunk vectors.")
+    compression.add_argument("--model", help="The model to embed --queries with, defaults to the configured one.")
+    compression.add_argument("--sample", type=int, default=500, help="Chunk vectors sampled as queries.")
+    compression.add_argument("-k", type=int, default=10, help="Number of neighbours compared with exact search.")
+    compression.add_argument(
+        "--rerank", type=int, default=0, help="Also measure exact re-ranking of this many candidates."
+    )
+    compression.add_argument("--json", action="store_true", help="Print JSON instead of a table.")
+    compression.set_defaults(handler=run_compression_report)
+
+    benchmark = subparsers.add_parser(
+        "benchmark", help="Measure ingest throughput and query latency on synthetic PDFs."
+    )
+    benchmark.add_argument(
+        "--model", help="The model to use for embeddings, e.g. hash:384 to run without a model download."
+    )
+    benchmark.add_argument(
+        "--sizes", type=lambda value: [int(size) for size in value.split(",")], default=[20, 200],
+        help="Comma-separated corpus sizes in documents."
+    )
+    benchmark.add_argument(
+        "--index-types", type=lambda value: value.split(","),
+        help="Comma-separated index types, defaults to the configured one."
+    )
+    benchmark.add_argument(
+        "--pdf-backends", type=lambda value: value.split(","),
+        help="Comma-separated PDF extraction backends to compare, e.g. pypdf,pymupdf,pdfium."
+    )
+    benchmark.add_argument(
+        "--backend", choices=EMBEDDING_BACKENDS, help="The embedding model runtime, defaults to the configured one."
+    )
+    benchmark.add_argument("--pages", type=int, default=5, help="Pages in each generated PDF.")
+    benchmark.add_argument("--queries", type=int, default=200, help="Queries timed against each index.")
+    benchmark.add_argument("-k", type=int, default=5, help="Number of matches per query.")
+    benchmark.add_argument("--seed", type=int, default=0, help="Seed of the generated corpus and queries.")
+    benchmark.add_argument(
+        "--workdir", default="database/benchmark", help="Folder for generated PDFs, reused across runs, and databases."
+    )
+    benchmark.add_argument("--output", default="benchmark.json", help="JSON results file.")
+    benchmark.add_argument("--baseline", help="Earlier JSON results file to compare with.")
+    benchmark.set_defaults(handler=run_benchmark_command)
+
+    agreement = subparsers.add_parser(
+        "embedding-agreement",
+        help="Compare the ONNX Runtime embeddings of the model with its PyTorch embeddings."
+    )
+    agreement.add_argument("--folder", help="Folder containing PDFs, defaults to the configured one.")
+    agreement.add_argument("--model", help="The model to compare, defaults to the configured one.")
+    agreement.add_argument("--queries", help="File of queries, one per line; defaults to openings of chunks.")
+    agreement.add_argument("--sample", type=int, default=500, help="Chunks embedded by both backends.")
+    agreement.add_argument("--chunk-size", type=int, default=500, help="Number of characters in each text chunk.")
+    agreement.add_argument("--chunk-overlap", type=int, default=150, help="Characters to overlap between chunks.")
+    agreement.add_argument("-k", type=int, default=5, help="Matches compared per query.")
+    agreement.add_argument(
+        "--min-cosine", type=float, default=0.99, help="Least mean cosine similarity between the two embeddings."
+    )
+    agreement.add_argument(
+        "--min-overlap", type=float, default=0.9, help="Least share of each query's top-k matches found by both."
+    )
+    agreement.add_argument("--json", action="store_true", help="Print JSON instead of text.")
+    agreement.set_defaults(handler=run_embedding_agreement)
+
+    budget = subparsers.add_parser(
+        "import-budget", help="Check the import time of the Streamlit entry point against its budget."
+    )
+    budget.add_argument("--module", default="app", help="The module to import.")
+    budget.add_argument("--budget-ms", type=float, help="Import time budget, defaults to the configured one.")
+    budget.add_argument("--repeats", type=int, default=3, help="Fresh interpreters to time; the median counts.")
+    budget.add_argument("--json", action="store_true", help="Print JSON instead of text.")
+    budget.set_defaults(handler=run_import_budget)
+    return parser
+
+
+def main(argv: List[str] = None) -> None:
+    """
+    Parse the command line and run the selected command.
+    param argv: The arguments, defaults to sys.argv.
+    """
+    args = build_parser().parse_args(argv)
+    cfg = ConfigLoader(args.config).load_config()
+
+    # Log to stderr so results written to stdout stay machine-readable
+    LogLoader().configure_logger(
+        cfg["logger"]["log_name"],
+        cfg["logger"]["format"],
+        cfg["logger"]["level"],
+        stream=sys.stderr,
+    )
+    args.handler(args, cfg)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,7 @@ from .base_page import StreamlitPage
 from .home_page import HomePage
 from .upload_page import UploadPage
 from .query_page import QueryPage
+from .diagnostics_page import DiagnosticsPage
 
 
-__all__ = ['StreamlitPage', 'HomePage', 'UploadPage', 'QueryPage']
+__all__ = ['StreamlitPage', 'HomePage', 'UploadPage', 'QueryPage', 'DiagnosticsPage']
@@ -0,0 +1,69 @@
+"""
+Diagnostics page implementation
+"""
+import streamlit as st
+from utils.query_cache import get_query_cache
+from utils.telemetry import get_telemetry
+from .base_page import StreamlitPage
+from typing import Dict
+
+
+class DiagnosticsPage(StreamlitPage):
+    """
+    Diagnostics page showing where ingest and query time goes in this process,
+    derives from StreamlitPage.
+    """
+
+    @property
+    def page_name(self) -> str:
+        """
+        Implementation of page_name from the page base class: StreamlitPage.
+        Returns: The name of this page.
+        """
+        return "Diagnostics"
+
+    def render_page(self, cfg_: Dict[str, any]) -> None:
+        st.title("Diagnostics")
+        st.write("Stage timings and counters of the ingest runs and queries served by this process.")
+        telemetry = get_telemetry(**cfg_["telemetry"])
+        snapshot = telemetry.snapshot()
+
+        if not snapshot["events"]:
+            st.info("Nothing has been ingested or queried yet.")
+        else:
+            st.subheader("Operations")
+            st.dataframe([
+                {
+                    "event": event,
+                    "count": totals["count"],
+                    "total s": round(totals["seconds"], 3),
+                    "mean ms": round(1000 * totals["seconds"] / totals["count"], 3),
+                }
+                for event, totals in snapshot["events"].items()
+            ])
+
+            st.subheader("Stages")
+            st.dataframe([
+                {
+                    "event": row["event"],
+                    "stage": row["stage"],
+                    "total s": round(row["seconds"], 3),
+                    "mean ms": round(1000 * row["seconds"] / row["count"], 3),
+                    "max ms": round(1000 * row["max_seconds"], 3),
+                    "share": f"{row['seconds'] / snapshot['events'][row['event']]['seconds']:.0%}"
+                    if snapshot["events"][row["event"]]["seconds"] else "",
+                }
+                for row in sorted(snapshot["stages"], key=lambda row: (row["event"], -row["seconds"]))
+            ])
+
+            st.subheader("Counters")
+            st.dataframe(snapshot["counters"])
+
+        st.subheader("Query cache")
+        st.json(get_query_cache(**cfg_["query-cache"]).stats())
+
+        with st.expander("Prometheus text export"):
+            st.code(telemetry.to_prometheus(), language="text")
+        if st.button("Reset counters"):
+            telemetry.reset()
+            st.rerun()
@@ -2,8 +2,16 @@
 Query page implementation
 """
 import streamlit as st
+from loguru import logger
 from .base_page import StreamlitPage
-from typing import Dict
+from typing import TYPE_CHECKING, Dict, List, Tuple
+
+if TYPE_CHECKING:
+    from utils.search_filter import SearchFilter
+
+# The query modules pull in FAISS and numpy, so they are imported on the first
+# query rather than when the app starts
+# pylint: disable=import-outside-toplevel
 
 class QueryPage(StreamlitPage):
     """
@@ -21,4 +29,68 @@ class QueryPage(StreamlitPage):
     def render_page(self, cfg_: Dict[str, any]) -> None:
         st.title("Query Documents")
         query = st.text_input("Enter your question:")
+        filter_expression = st.text_input(
+            "Filter (optional):",
+            placeholder="file:manual*.pdf page:3-10 after:2024-01-01",
+            help="Only search chunks from matching files, pages or file modification dates."
+        )
         st.write("Ask questions about your documents")
+
+        if query:
+            from utils.search_filter import SearchFilter
+
+            service_url = cfg_["query-service"]["url"]
+            try:
+                search_filter = SearchFilter.parse(filter_expression)
+            except ValueError as e:
+                st.error(str(e))
+                return
+            try:
+                if service_url:
+                    from utils.query_service import QueryServiceClient
+                    results = QueryServiceClient(service_url).match_query(query, filter_expression=filter_expression)
+                else:
+                    results = self.match_locally(query, cfg_, search_filter)
+            except RuntimeError as e:
+                st.error(f"Error querying documents: {str(e)}")
+                logger.error(f"Error during query: {str(e)}")
+                return
+
+            if not results:
+                st.info("No matches scored above the configured threshold.")
+            for i, (chunk_text, score, sources) in enumerate(results, 1):
+                with st.expander(f"Match {i} (score {score:.3f})"):
+                    st.text(chunk_text)
+                    if sources:
+                        st.caption(self.format_sources(sources))
+
+    def match_locally(
+        self,
+        query: str,
+        cfg_: Dict[str, any],
+        search_filter: "SearchFilter" = None
+    ) -> List[Tuple[str, float, List[Dict[str, any]]]]:
+        """
+        Match a query in this process, using the shared model and index.
+        param query: The query string.
+        param cfg_: The application configuration.
+        param search_filter: Only match chunks from these files, pages or dates.
+        Returns: A list of tuples containing (chunk_text, similarity_score, references).
+        """
+        from utils.query_matching import QueryMatcher
+
+        matcher = QueryMatcher.from_config(cfg_)
+        return matcher.match_query(query, cfg_["databases"]["db_folder"], search_filter, with_sources=True)
+
+    @staticmethod
+    def format_sources(sources: List[Dict[str, any]]) -> str:
+        """
+        Describe where a match occurs, including the near-duplicates merged into it.
+        param sources: The references of the matched chunk, see ChunkStore.references.
+        Returns: The sources with 1-based page numbers, e.g. 'Found in: a.pdf, page 3; b.pdf, page 4'.
+        """
+        places = [
+            reference["source"] if reference["page"] is None else f"{reference['source']}, page {reference['page'] + 1}"
+            for reference in sources
+        ]
+        return "Found in: " + "; ".join(dict.fromkeys(places))
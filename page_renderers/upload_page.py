@@ -6,7 +6,7 @@ from typing import Dict
 import streamlit as st
 from loguru import logger
 from utils import count_pdf_files, path_exists
-from utils.embeddings import DocumentEmbedder
+from utils.jobs import ACTIVE_STATES, JobManager
 from .base_page import StreamlitPage
 
 class UploadPage(StreamlitPage):
@@ -31,7 +31,7 @@ class UploadPage(StreamlitPage):
             st.header("Model Parameters")
             model_name = st.text_input(
                 "Embedding Model",
-                value="all-MiniLM-L6-v2",
+                value=cfg_["embeddings"]["model_name"],
                 help="The model to use for embeddings.",
                 disabled=cfg_["pages"]["embedding_model_readonly"]
             )
@@ -54,6 +54,18 @@ class UploadPage(StreamlitPage):
                 help="Number of characters to overlap between chunks"
             )
 
+            incremental = st.checkbox(
+                "Incremental Update",
+                value=True,
+                help="Only embed new or changed files and drop chunks of deleted files"
+            )
+
+            run_in_background = st.checkbox(
+                "Run in Background",
+                value=True,
+                help="Run ingestion as a separate job that keeps going if this browser session ends"
+            )
+
             show_samples = st.checkbox(
                 "Show Sample Chunks",
                 value=False,
@@ -87,13 +99,19 @@ class UploadPage(StreamlitPage):
 
                             st.info(f"Found {pdf_count} PDF file(s) in the folder.")
 
-                            # Create embeddings and FAISS database
-                            embedder = DocumentEmbedder(
-                                chunk_size=chunk_size,
-                                chunk_overlap=chunk_overlap,
-                                model_name=model_name,
-                                cfg=cfg_
-                            )
+                            # Create embeddings and FAISS database. The embedder pulls in FAISS and the
+                            # model stack, which a background job without samples never needs in this process
+                            embedder = None
+                            if show_samples or not run_in_background:
+                                # pylint: disable=import-outside-toplevel
+                                from utils.embeddings import DocumentEmbedder
+                                embedder = DocumentEmbedder(
+                                    chunk_size=chunk_size,
+                                    chunk_overlap=chunk_overlap,
+                                    model_name=model_name,
+                                    cfg=cfg_,
+                                    device=cfg_["embeddings"]["device"]
+                                )
 
                             embed_file_pattern = cfg_["pdf-details"]["embed_file_pattern"]
 
@@ -110,9 +128,15 @@ class UploadPage(StreamlitPage):
                                             st.text(chunk.page_content)
 
                             db_folder = cfg_["databases"]["db_folder"]
-                            embedder.create_faiss_db(folder_path, db_folder)
-
-                            st.success("Successfully created FAISS database!")
+                            if run_in_background:
+                                job_id = JobManager(cfg_["jobs"]["folder"]).submit(
+                                    folder_path, db_folder, chunk_size, chunk_overlap, model_name, incremental
+                                )
+                                st.session_state.ingest_job_id = job_id
+                                st.session_state.pop("ingest_job_status", None)
+                            else:
+                                embedder.create_faiss_db(folder_path, db_folder, incremental=incremental)
+                                st.success("Successfully created FAISS database!")
                         except Exception as e:  # pylint: disable=W0718
                             st.error(f"Error processing documents: {str(e)}")
                             logger.error(f"Error during document processing: {str(e)}")
@@ -123,3 +147,44 @@ class UploadPage(StreamlitPage):
                             "page was clicked but no folder path was provided."
                         )
                     logger.warning(message)
+
+        if "ingest_job_id" in st.session_state:
+            self.render_job_status(cfg_, st.session_state.ingest_job_id)
+        elif "ingest_job_status" in st.session_state:
+            # The job has finished, so its outcome is shown without polling
+            self.show_job_status(st.session_state.ingest_job_status)
+
+    @st.fragment(run_every=2)
+    def render_job_status(self, cfg_: Dict[str, any], job_id: str) -> None:
+        """
+        Shows the progress of a background ingest job, refreshing every few seconds
+        until the job succeeds or fails.
+        param cfg_: The application configuration.
+        param job_id: The job to show.
+        """
+        status = JobManager(cfg_["jobs"]["folder"]).status(job_id)
+        if status["state"] not in ACTIVE_STATES:
+            # Rerun the whole page without this fragment, which stops the polling
+            del st.session_state.ingest_job_id
+            st.session_state.ingest_job_status = status
+            st.rerun()
+        self.show_job_status(status)
+
+    @staticmethod
+    def show_job_status(status: Dict[str, any]) -> None:
+        """
+        Shows the progress or outcome of a background ingest job.
+        param status: The status of the job, as returned by JobManager.status.
+        """
+        st.subheader("Ingest Job")
+        st.caption(f"Job {status['id']} for {status['folder_path']}")
+
+        files_total = status.get("files_total")
+        if status["state"] == "running" and files_total:
+            st.progress(status["files_done"] / files_total, text=f"{status['files_done']} of {files_total} file(s)")
+        elif status["state"] in ("queued", "running"):
+            st.info("The job is running.")
+        elif status["state"] == "succeeded":
+            st.success("Successfully created FAISS database!")
+        else:
+            st.error(f"Error processing documents: {status['error']}")
@@ -0,0 +1,83 @@
+"""
+Tests for the BM25 keyword index and the reciprocal-rank fusion of hybrid search.
+"""
+from types import SimpleNamespace
+import numpy as np
+from utils.bm25_index import BM25Index, build_bm25_index, tokenize
+from utils.chunk_store import ChunkStore, ChunkStoreWriter
+from utils.query_matching import QueryMatcher
+
+TEXTS = [
+    "The pump P-100 is serviced every year.",
+    "Replace the filter of pump P-200 monthly.",
+    "Safety instructions for the control room.",
+    "Pump maintenance: pump seals, pump bearings.",
+]
+
+
+def _index(tmp_path):
+    with ChunkStoreWriter(tmp_path / "chunks") as writer:
+        for chunk_id, text in enumerate(TEXTS):
+            writer.append(chunk_id, text, "manual.pdf", chunk_id)
+    build_bm25_index(ChunkStore(tmp_path / "chunks"), tmp_path / "bm25")
+    return BM25Index(tmp_path / "bm25")
+
+
+def test_tokenize_keeps_identifiers_and_their_parts():
+    assert tokenize("Pump P-100, rev 2.5") == ["pump", "p-100", "p", "100", "rev", "2.5", "2", "5"]
+
+
+def test_search_ranks_by_term_weight(tmp_path):
+    index = _index(tmp_path)
+
+    scores, positions = index.search("pump", 5)
+
+    # Three occurrences outweigh one, and chunks without the term are padding
+    assert positions[0] == 3
+    assert set(positions[1:3].tolist()) == {0, 1}
+    np.testing.assert_array_equal(positions[3:], [-1, -1])
+    assert np.all(np.diff(scores[:3]) <= 0)
+    assert index.search("P-200", 1)[1][0] == 1
+    assert index.search("missing words", 2)[1].tolist() == [-1, -1]
+
+
+def test_search_applies_the_row_mask(tmp_path):
+    index = _index(tmp_path)
+
+    _, positions = index.search("pump", 3, mask=np.array([False, True, True, False]))
+
+    assert positions.tolist() == [1, -1, -1]
+
+
+def test_update_reuses_kept_postings(tmp_path):
+    old = _index(tmp_path)
+    kept = np.array([0, 2])
+    texts = [TEXTS[0], TEXTS[2], "New pump P-300 manual.", "Control room checklist."]
+    with ChunkStoreWriter(tmp_path / "new") as writer:
+        for chunk_id, text in enumerate(texts):
+            writer.append(chunk_id, text, "manual.pdf", chunk_id)
+    store = ChunkStore(tmp_path / "new")
+
+    build_bm25_index(store, tmp_path / "updated", previous=old, kept=kept, batch_size=1)
+    build_bm25_index(store, tmp_path / "rebuilt")
+    updated, rebuilt = BM25Index(tmp_path / "updated"), BM25Index(tmp_path / "rebuilt")
+
+    # Terms only the removed rows used are gone, and the result matches a full rebuild
+    assert "p-200" not in updated.vocabulary()
+    assert updated.vocabulary() == rebuilt.vocabulary()
+    for column in ("postings", "rows", "tf", "doc_len"):
+        np.testing.assert_array_equal(getattr(updated, column), getattr(rebuilt, column))
+    assert updated.avg_doc_len == rebuilt.avg_doc_len
+
+
+def test_fusion_favours_chunks_found_by_both_searches():
+    matcher = SimpleNamespace(k=2, rrf_k=60)
+    shards = np.zeros((1, 3), dtype=np.int64)
+    dense = (None, shards, np.array([[5, 7, 9]]))
+    sparse = (None, shards, np.array([[9, 4, -1]]))
+
+    scores, shard_numbers, positions = QueryMatcher._fuse(matcher, dense, sparse)  # pylint: disable=protected-access
+
+    assert positions.tolist() == [[9, 5]]
+    np.testing.assert_allclose(scores[0], [1 / 63 + 1 / 61, 1 / 61])
+    assert shard_numbers.tolist() == [[0, 0]]
@@ -0,0 +1,158 @@
+"""
+Tests for the memory-mapped chunk store and the conversion of legacy documents.npy files.
+"""
+import json
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+from utils.chunk_store import ChunkStore, ChunkStoreWriter, migrate_documents_npy
+
+
+def _documents():
+    return [
+        Document(page_content="first chunk", metadata={"source": "a.pdf", "page": 0}),
+        Document(page_content="zweiter Abschnitt, ünïcode", metadata={"source": "a.pdf", "page": 1}),
+        Document(page_content="third chunk", metadata={"source": "b.pdf"}),
+    ]
+
+
+def _write_legacy(path, documents):
+    array = np.empty(len(documents), dtype=object)
+    array[:] = documents
+    np.save(str(path), array, allow_pickle=True)
+
+
+def _assert_rows(store, documents, ids):
+    assert len(store) == len(documents)
+    np.testing.assert_array_equal(store.ids, ids)
+    for position, doc in enumerate(documents):
+        assert store.row(position) == {
+            "chunk_id": ids[position],
+            "text": doc.page_content,
+            "source": doc.metadata["source"],
+            "page": doc.metadata.get("page"),
+        }
+
+
+def test_round_trip(tmp_path):
+    documents = _documents()
+    with ChunkStoreWriter(tmp_path / "chunks") as writer:
+        writer.append_documents(documents, [2, 5, 9])
+
+    store = ChunkStore(tmp_path / "chunks")
+
+    _assert_rows(store, documents, [2, 5, 9])
+    assert store.sources == ["a.pdf", "b.pdf"]
+    assert store.vectors is None
+    np.testing.assert_array_equal(store.lookup(np.array([9, 2, 3, -1])), [2, 0, -1, -1])
+
+
+def test_raw_vectors_round_trip(tmp_path):
+    vectors = np.arange(12, dtype=np.float32).reshape(3, 4)
+    with ChunkStoreWriter(tmp_path / "chunks") as writer:
+        writer.append_documents(_documents()[:2], [0, 1], vectors[:2])
+        writer.append_documents(_documents()[2:], [2], vectors[2:])
+        with pytest.raises(ValueError):
+            writer.append(3, "text", "a.pdf", 0)
+
+    np.testing.assert_array_equal(ChunkStore(tmp_path / "chunks").vectors, vectors)
+
+
+def test_ids_must_increase(tmp_path):
+    with ChunkStoreWriter(tmp_path / "chunks") as writer:
+        writer.append(4, "text", "a.pdf", 0)
+        with pytest.raises(ValueError):
+            writer.append(4, "text", "a.pdf", 0)
+
+
+def test_incomplete_store_is_not_opened(tmp_path):
+    writer = ChunkStoreWriter(tmp_path / "chunks")
+    writer.append(0, "text", "a.pdf", 0)
+    # meta.json is only written on close
+    with pytest.raises(FileNotFoundError):
+        ChunkStore(tmp_path / "chunks")
+    writer.close()
+    assert len(ChunkStore(tmp_path / "chunks")) == 1
+
+
+def test_references_list_merged_duplicates(tmp_path):
+    documents = _documents()
+    duplicates = [
+        Document(page_content="first chunk again", metadata={"source": "c.pdf", "page": 3}),
+        Document(page_content="third chunk again", metadata={"source": "a.pdf"}),
+    ]
+    with ChunkStoreWriter(tmp_path / "chunks") as writer:
+        writer.append_documents(documents, [0, 1, 2])
+        writer.append_duplicates(duplicates, [10, 11], [0, 2])
+
+    store = ChunkStore(tmp_path / "chunks")
+
+    assert store.duplicate_count == 2
+    assert store.references(0) == [
+        {"chunk_id": 0, "source": "a.pdf", "page": 0},
+        {"chunk_id": 10, "source": "c.pdf", "page": 3},
+    ]
+    assert store.references(1) == [{"chunk_id": 1, "source": "a.pdf", "page": 1}]
+    assert store.references(2)[1] == {"chunk_id": 11, "source": "a.pdf", "page": None}
+
+
+def test_references_of_duplicates_found_out_of_order(tmp_path):
+    documents = _documents()
+    with ChunkStoreWriter(tmp_path / "chunks") as writer:
+        writer.append_documents(documents, [0, 1, 2])
+        writer.append_duplicates(documents[:2], [10, 11], [2, 0])
+        writer.append_duplicates(documents[2:], [12], [2])
+    expected = [[0, 11], [1], [2, 10, 12]]
+
+    store = ChunkStore(tmp_path / "chunks")
+    assert store.canonical_ids.tolist() == [0, 2, 2]
+    assert [[reference["chunk_id"] for reference in store.references(row)] for row in range(3)] == expected
+
+    # Stores written before the duplicates were sorted on disk are sorted when opened
+    meta = json.loads((tmp_path / "chunks" / "meta.json").read_text())
+    del meta["duplicates_sorted"]
+    (tmp_path / "chunks" / "meta.json").write_text(json.dumps(meta))
+    np.array([2, 0, 2], dtype=np.int64).tofile(tmp_path / "chunks" / "dup_of.bin")
+    np.array([10, 11, 12], dtype=np.int64).tofile(tmp_path / "chunks" / "dup_ids.bin")
+    store = ChunkStore(tmp_path / "chunks")
+    assert [[reference["chunk_id"] for reference in store.references(row)] for row in range(3)] == expected
+
+
+def test_copy_keeps_rows_and_duplicates(tmp_path):
+    with ChunkStoreWriter(tmp_path / "old") as writer:
+        writer.append_documents(_documents(), [0, 1, 2])
+        writer.append_duplicates(_documents()[:1], [10], [2])
+    old = ChunkStore(tmp_path / "old")
+
+    with ChunkStoreWriter(tmp_path / "new") as writer:
+        writer.copy_from(old, np.array([0, 2]))
+        writer.copy_duplicates(old, np.array([True]))
+    new = ChunkStore(tmp_path / "new")
+
+    _assert_rows(new, [_documents()[0], _documents()[2]], [0, 2])
+    assert new.references(1)[1] == {"chunk_id": 10, "source": "a.pdf", "page": 0}
+
+
+def test_migrate_documents_npy(tmp_path):
+    documents = _documents()
+    documents[2].metadata["chunk_id"] = 7
+    _write_legacy(tmp_path / "documents.npy", documents)
+
+    migrate_documents_npy(tmp_path / "documents.npy", tmp_path / "chunks")
+
+    # Documents without a chunk_id keep their position as ID
+    _assert_rows(ChunkStore(tmp_path / "chunks"), documents, [0, 1, 7])
+    assert not (tmp_path / "documents.npy").exists()
+
+
+def test_legacy_documents_are_read_in_place(tmp_path):
+    documents = _documents()
+    _write_legacy(tmp_path / "documents.npy", documents)
+    before = (tmp_path / "documents.npy").read_bytes()
+
+    store = ChunkStore.from_documents_npy(tmp_path / "documents.npy")
+
+    _assert_rows(store, documents, [0, 1, 2])
+    assert store.references(2) == [{"chunk_id": 2, "source": "b.pdf", "page": None}]
+    assert (tmp_path / "documents.npy").read_bytes() == before
+    assert not (tmp_path / "chunks").exists()
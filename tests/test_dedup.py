@@ -0,0 +1,62 @@
+"""
+Tests for MinHash near-duplicate detection.
+"""
+import random
+import pytest
+from utils.dedup import ChunkDeduplicator, lsh_bands
+
+
+def _text(seed, words=300):
+    rng = random.Random(seed)
+    return " ".join(f"w{rng.randrange(5000)}" for _ in range(words))
+
+
+def _edit(text, count, seed=0):
+    """Replace a few words, as a revision of a report would."""
+    rng = random.Random(seed)
+    words = text.split()
+    for _ in range(count):
+        words[rng.randrange(len(words))] = f"edit{rng.randrange(1000)}"
+    return " ".join(words)
+
+
+def test_lsh_bands_divide_the_signature():
+    bands, rows = lsh_bands(64, 0.8)
+    assert bands * rows == 64
+    assert (1 / bands) ** (1 / rows) <= 0.8
+
+
+def test_near_duplicates_are_found_and_distinct_chunks_are_not():
+    deduplicator = ChunkDeduplicator(threshold=0.8, num_perm=64)
+    original = _text(1)
+    deduplicator.insert(10, deduplicator.signature(original))
+    deduplicator.insert(11, deduplicator.signature(_text(2)))
+
+    assert deduplicator.find(deduplicator.signature(original)) == 10
+    assert deduplicator.find(deduplicator.signature(original.upper())) == 10
+    assert deduplicator.find(deduplicator.signature(_edit(original, 3))) == 10
+    assert deduplicator.find(deduplicator.signature(_edit(original, 150))) is None
+    assert deduplicator.find(deduplicator.signature(_text(3))) is None
+
+
+def test_signatures_are_stable_across_instances():
+    text = _text(4)
+    first, second = ChunkDeduplicator(), ChunkDeduplicator()
+
+    second.insert_many([7], first.signature(text)[None, :])
+
+    assert second.find(first.signature(text)) == 7
+
+
+def test_texts_without_words_are_never_duplicates():
+    deduplicator = ChunkDeduplicator()
+    deduplicator.insert(0, deduplicator.signature("..."))
+
+    assert len(deduplicator) == 0
+    assert deduplicator.find(deduplicator.signature("  ")) is None
+
+
+@pytest.mark.parametrize("threshold, num_perm", [(0, 64), (1.5, 64), (0.8, 0)])
+def test_invalid_settings_are_rejected(threshold, num_perm):
+    with pytest.raises(ValueError):
+        ChunkDeduplicator(threshold=threshold, num_perm=num_perm)
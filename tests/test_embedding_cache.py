@@ -0,0 +1,93 @@
+"""
+Tests for the on-disk embedding cache: every cached key must map back to its own vector.
+"""
+import numpy as np
+import pytest
+from utils.embedding_cache import KEY_BYTES, EmbeddingCache, text_digest
+
+
+def _vectors(texts, dimension=8):
+    """Deterministic vectors derived from each text, so a mismatched row is detectable."""
+    return np.stack([
+        np.random.default_rng(int.from_bytes(text_digest(text)[:4], "little")).standard_normal(dimension)
+        for text in texts
+    ]).astype(np.float32)
+
+
+def _assert_consistent(cache_folder, texts):
+    with EmbeddingCache(cache_folder, "model") as cache:
+        positions, vectors = cache.get([text_digest(text) for text in texts])
+        assert len(positions) == len(texts)
+        np.testing.assert_array_equal(vectors, _vectors([texts[position] for position in positions]))
+
+
+def test_round_trip(tmp_path):
+    texts = [f"chunk {i}" for i in range(10)]
+    with EmbeddingCache(tmp_path, "model") as cache:
+        cache.put([text_digest(text) for text in texts], _vectors(texts))
+        # Repeated digests are not appended twice
+        cache.put([text_digest(text) for text in texts[:3]], _vectors(texts[:3]))
+        assert cache.count == 10
+    _assert_consistent(tmp_path, texts)
+
+
+def test_second_writer_is_read_only(tmp_path):
+    first_texts = [f"first {i}" for i in range(20)]
+    second_texts = [f"second {i}" for i in range(15)]
+    with EmbeddingCache(tmp_path, "model") as cache:
+        cache.put([text_digest(text) for text in first_texts[:5]], _vectors(first_texts[:5]))
+
+    first = EmbeddingCache(tmp_path, "model")
+    second = EmbeddingCache(tmp_path, "model")
+    assert not first.read_only
+    assert second.read_only
+    # The read-only cache sees the rows that were complete when it was opened
+    positions, _ = second.get([text_digest(text) for text in first_texts[:5]])
+    assert len(positions) == 5
+
+    # Interleaved writes from both: only the writer's reach the files
+    for start in range(5, 20, 5):
+        first.put([text_digest(text) for text in first_texts[start:start + 5]], _vectors(first_texts[start:start + 5]))
+        second.put([text_digest(text) for text in second_texts[:5]], _vectors(second_texts[:5]))
+    second.close()
+    first.close()
+
+    _assert_consistent(tmp_path, first_texts)
+    with EmbeddingCache(tmp_path, "model") as cache:
+        positions, _ = cache.get([text_digest(text) for text in second_texts])
+        assert len(positions) == 0
+        assert not cache.read_only
+
+
+def test_lock_released_on_close(tmp_path):
+    EmbeddingCache(tmp_path, "model").close()
+    with EmbeddingCache(tmp_path, "model") as cache:
+        assert not cache.read_only
+
+
+def test_interrupted_write_leaves_no_key_without_vector(tmp_path):
+    texts = [f"chunk {i}" for i in range(6)]
+    with EmbeddingCache(tmp_path, "model") as cache:
+        cache.put([text_digest(text) for text in texts], _vectors(texts))
+    cache_dir = tmp_path / "model"
+    # A run that stopped after writing vectors, and half of a key, for one more row
+    with open(cache_dir / "vectors.bin", "ab") as handle:
+        handle.write(_vectors(["extra"]).tobytes())
+    with open(cache_dir / "keys.bin", "ab") as handle:
+        handle.write(text_digest("extra")[:KEY_BYTES // 2])
+
+    _assert_consistent(tmp_path, texts)
+    with EmbeddingCache(tmp_path, "model") as cache:
+        assert cache.count == len(texts)
+        assert (cache_dir / "keys.bin").stat().st_size == len(texts) * KEY_BYTES
+
+
+@pytest.mark.parametrize("max_size_mb", [0.0005])
+def test_eviction_keeps_keys_and_vectors_paired(tmp_path, max_size_mb):
+    texts = [f"chunk {i}" for i in range(40)]
+    with EmbeddingCache(tmp_path, "model", max_size_mb) as cache:
+        cache.put([text_digest(text) for text in texts], _vectors(texts))
+    with EmbeddingCache(tmp_path, "model") as cache:
+        assert 0 < cache.count < len(texts)
+        kept = [text for text in texts if text_digest(text) in cache._rows]  # pylint: disable=protected-access
+    _assert_consistent(tmp_path, kept)
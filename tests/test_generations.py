@@ -0,0 +1,98 @@
+"""
+Tests for publishing, leasing and garbage-collecting database generations.
+"""
+import os
+import pytest
+from utils.generations import GENERATIONS_DIR, GenerationLease, GenerationStore, fcntl
+
+requires_locks = pytest.mark.skipif(fcntl is None, reason="leases need fcntl file locks")
+
+
+def _build(store, content):
+    """Create, fill and publish a generation, as an ingest does."""
+    lease = store.create()
+    current = store.current()
+    if current is not None:
+        store.clone_into(current, lease.generation_dir)
+    # Files cloned from the published generation are replaced, never written through
+    tmp_path = lease.generation_dir / "index.faiss.tmp"
+    tmp_path.write_text(content)
+    os.replace(tmp_path, lease.generation_dir / "index.faiss")
+    store.publish(lease.generation_dir)
+    lease.release()
+    return lease.generation_dir
+
+
+def test_publish_moves_the_pointer(tmp_path):
+    store = GenerationStore(tmp_path / "db")
+    assert store.current() is None
+    assert store.lease_current() is None
+
+    first = _build(store, "first")
+    second = _build(store, "second")
+
+    assert (first.name, second.name) == ("gen-000001", "gen-000002")
+    assert store.current() == second
+    assert store.current_dir() == second
+    assert (second / "index.faiss").read_text() == "second"
+    assert (first / "index.faiss").read_text() == "first"
+
+
+def test_legacy_database_moves_into_the_first_generation(tmp_path):
+    db_path = tmp_path / "db"
+    (db_path / "chunks").mkdir(parents=True)
+    (db_path / "chunks" / "meta.json").write_text("{}")
+    (db_path / "index.faiss").write_text("legacy")
+    store = GenerationStore(db_path)
+    assert store.is_legacy()
+    assert store.current_dir() == db_path
+
+    lease = store.create()
+    store.clone_into(db_path, lease.generation_dir)
+    store.publish(lease.generation_dir)
+
+    assert not store.is_legacy()
+    assert sorted(entry.name for entry in db_path.iterdir()) == ["CURRENT", GENERATIONS_DIR]
+    assert (lease.generation_dir / "index.faiss").read_text() == "legacy"
+    assert (lease.generation_dir / "chunks" / "meta.json").exists()
+
+
+@requires_locks
+def test_garbage_collection_keeps_published_and_leased_generations(tmp_path):
+    store = GenerationStore(tmp_path / "db")
+    first = _build(store, "first")
+    reader = store.lease_current()
+    second = _build(store, "second")
+    third = _build(store, "third")
+
+    # The first generation is still read from; the second is unused
+    assert store.collect_garbage() == [second.name]
+    assert first.exists() and third.exists()
+
+    reader.release()
+    assert store.collect_garbage() == [first.name]
+    assert store.current() == third and third.exists()
+
+
+@requires_locks
+def test_unpublished_generation_is_not_collected_while_building(tmp_path):
+    store = GenerationStore(tmp_path / "db")
+    _build(store, "first")
+    building = store.create()
+
+    assert store.collect_garbage() == []
+
+    store.discard(building)
+    assert not building.generation_dir.exists()
+
+
+@requires_locks
+def test_collected_generation_cannot_be_leased(tmp_path):
+    store = GenerationStore(tmp_path / "db")
+    first = _build(store, "first")
+    _build(store, "second")
+    store.collect_garbage()
+
+    with pytest.raises(FileNotFoundError):
+        GenerationLease(first)
+    assert store.lease_current().generation_dir == store.current()
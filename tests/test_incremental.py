@@ -0,0 +1,141 @@
+"""
+Tests for updating a shard in place: stale chunks are removed, and files whose
+near-duplicates were merged into removed chunks are embedded again.
+"""
+import zlib
+from contextlib import ExitStack
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+from utils.chunk_store import ChunkStore
+from utils.dedup import ChunkDeduplicator
+from utils.embeddings import ShardUpdate
+from utils.generations import GenerationStore
+from utils.index_factory import IndexSpec
+from utils.index_registry import IndexRegistry
+from utils.manifest import IndexManifest
+
+DATABASES = {
+    "faiss_db_index": "index.faiss", "chunk_store": "chunks", "manifest": "manifest.json",
+    "index_spec": "index_spec.json", "bm25": "bm25",
+}
+SETTINGS = {"model_name": "test"}
+
+
+class WordEmbeddings:
+    """Embeds a text as the counts of its words hashed into a few buckets."""
+
+    def __init__(self):
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        vectors = np.zeros((len(texts), 16), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in text.split():
+                vectors[row, zlib.crc32(word.encode()) % 16] += 1
+        return vectors.tolist()
+
+
+def _chunks(path, texts):
+    return [
+        Document(page_content=text, metadata={"source": str(path), "page": page}) for page, text in enumerate(texts)
+    ]
+
+
+def _text(seed):
+    rng = np.random.default_rng(seed)
+    return " ".join(f"w{number}" for number in rng.integers(0, 5000, 120))
+
+
+def _ingest(shard_dir, files, dedup=True):
+    """Bring the shard up to date with the files, as one incremental ingest does."""
+    manifest = IndexManifest.load(shard_dir / "manifest.json") or IndexManifest(SETTINGS)
+    stored = ChunkStore(shard_dir / "chunks") if (shard_dir / "chunks").exists() else None
+    index = faiss.read_index(str(shard_dir / "index.faiss")) if stored is not None else None
+    changes = manifest.diff(sorted(files))
+    update = ShardUpdate(shard_dir, DATABASES, IndexSpec(), manifest, changes, index, stored)
+    embeddings = WordEmbeddings()
+    with ExitStack() as stack:
+        update.open(stack, embeddings, 8, dedup=ChunkDeduplicator() if dedup else None)
+        for path in changes.to_embed:
+            update.add(path, _chunks(path, files[path]))
+        update.finish()
+    update.write_index()
+    update.publish()
+    return changes, embeddings
+
+
+def _sources(store):
+    """The file names each stored chunk stands for, including its merged duplicates."""
+    return [
+        sorted(f"{reference['source'].rsplit('/', 1)[-1]}:{reference['page']}" for reference in store.references(row))
+        for row in range(len(store))
+    ]
+
+
+def _manifest_ids(shard_dir):
+    """The chunk IDs the manifest assigns to its files."""
+    manifest = IndexManifest.load(shard_dir / "manifest.json")
+    return manifest.ids_for(list(manifest.files)).tolist()
+
+
+def test_changed_and_deleted_files_are_replaced(tmp_path):
+    shard_dir = tmp_path / "shard"
+    first, second = tmp_path / "a.pdf", tmp_path / "b.pdf"
+    first.write_bytes(b"a1")
+    second.write_bytes(b"b")
+    _ingest(shard_dir, {first: [_text(1), _text(2)], second: [_text(3)]}, dedup=False)
+
+    first.write_bytes(b"a2, edited")
+    changes, embeddings = _ingest(shard_dir, {first: [_text(4)]}, dedup=False)
+
+    assert changes.changed == [first]
+    assert changes.deleted == [IndexManifest.key(second)]
+    assert embeddings.embedded == [_text(4)]
+    store = ChunkStore(shard_dir / "chunks")
+    assert [store.chunk_text(row) for row in range(len(store))] == [_text(4)]
+    assert _manifest_ids(shard_dir) == store.ids.tolist()
+
+
+def test_deleting_every_file_publishes_an_empty_database(tmp_path):
+    generations = GenerationStore(tmp_path / "db")
+    pdf_file = tmp_path / "a.pdf"
+    pdf_file.write_bytes(b"a")
+    for files in ({pdf_file: [_text(1)]}, {}):
+        lease = generations.create()
+        if generations.current() is not None:
+            generations.clone_into(generations.current(), lease.generation_dir)
+        # A single shard lives in the generation directory itself
+        _ingest(lease.generation_dir, files, dedup=False)
+        generations.publish(lease.generation_dir)
+        lease.release()
+
+    assert generations.current() == lease.generation_dir
+    assert [path.name for path in lease.generation_dir.iterdir()] == [".lease"]
+    assert IndexRegistry().get_shards(str(tmp_path / "db")) == []
+
+
+def test_files_whose_duplicates_lose_their_canonical_chunk_are_reprocessed(tmp_path):
+    shard_dir = tmp_path / "shard"
+    report, revision = tmp_path / "report.pdf", tmp_path / "revision.pdf"
+    report.write_bytes(b"report")
+    revision.write_bytes(b"revision")
+    shared, unique = _text(1), _text(2)
+    _ingest(shard_dir, {report: [shared], revision: [shared, unique]})
+
+    store = ChunkStore(shard_dir / "chunks")
+    assert store.duplicate_count == 1
+    assert _sources(store) == [["report.pdf:0", "revision.pdf:0"], ["revision.pdf:1"]]
+
+    report.unlink()
+    changes, embeddings = _ingest(shard_dir, {revision: [shared, unique]})
+
+    # The revision was unchanged, but its first page only existed as a duplicate of the report
+    assert changes.deleted == [IndexManifest.key(report)]
+    assert changes.changed == [revision]
+    assert embeddings.embedded == [shared, unique]
+    store = ChunkStore(shard_dir / "chunks")
+    assert store.duplicate_count == 0
+    assert _sources(store) == [["revision.pdf:0"], ["revision.pdf:1"]]
+    assert _manifest_ids(shard_dir) == store.ids.tolist()
@@ -0,0 +1,67 @@
+"""
+Tests for removing vectors from every supported index type.
+"""
+import faiss
+import numpy as np
+import pytest
+from utils.index_factory import IndexSpec, build_index, remove_ids
+
+DIMENSION = 16
+COMBINATIONS = [
+    ("flat", "float32"), ("flat", "float16"), ("flat", "int8"), ("flat", "pq"),
+    ("ivf_flat", "float32"), ("ivf_flat", "float16"), ("ivf_flat", "int8"), ("ivf_pq", "float32"),
+    ("hnsw_flat", "float32"), ("hnsw_flat", "float16"), ("hnsw_flat", "int8"),
+]
+
+
+def _index(index_type, storage, count=200):
+    spec = IndexSpec(index_type=index_type, storage=storage, nlist=4, pq_m=4, train_size=count)
+    vectors = np.random.default_rng(0).standard_normal((count, DIMENSION)).astype(np.float32)
+    ids = np.arange(100, 100 + count, dtype=np.int64)
+    index = build_index(spec, DIMENSION, vectors)
+    index.add_with_ids(vectors, ids)
+    return spec, index, ids
+
+
+def _stored_ids(index):
+    """The IDs an index holds, read from its ID map or inverted lists."""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIDMap):
+        return set(faiss.vector_to_array(index.id_map).tolist())
+    lists = index.invlists
+    return {
+        int(chunk_id)
+        for number in range(lists.nlist)
+        for chunk_id in faiss.rev_swig_ptr(lists.get_ids(number), lists.list_size(number))
+    }
+
+
+@pytest.mark.parametrize("index_type, storage", COMBINATIONS)
+def test_remove_some_ids(index_type, storage):
+    spec, index, ids = _index(index_type, storage)
+
+    index = remove_ids(index, ids[::2], spec)
+
+    assert index.ntotal == len(ids) // 2
+    assert _stored_ids(index) == set(ids[1::2].tolist())
+
+
+@pytest.mark.parametrize("index_type, storage", COMBINATIONS)
+def test_remove_every_id(index_type, storage):
+    spec, index, ids = _index(index_type, storage)
+
+    index = remove_ids(index, ids, spec)
+
+    # Indexes that would have to be trained again on nothing are left to the builder
+    if index is None:
+        assert spec.needs_training
+    else:
+        assert index.ntotal == 0
+
+
+def test_remove_unknown_ids_keeps_everything():
+    spec, index, ids = _index("hnsw_flat", "float32")
+
+    index = remove_ids(index, np.array([1, 2, 3], dtype=np.int64), spec)
+
+    assert index.ntotal == len(ids)
@@ -0,0 +1,106 @@
+"""
+Tests for the manifest that drives incremental indexing.
+"""
+import os
+import numpy as np
+from utils.manifest import IndexManifest, file_sha256
+
+SETTINGS = {"model_name": "model", "chunk_size": 1000, "index": {"index_type": "flat", "metric": "l2"}}
+
+
+def _write(path, content):
+    path.write_bytes(content)
+    return path
+
+
+def _manifest(files):
+    """A manifest recording the files as they are now, with three chunk IDs each."""
+    manifest = IndexManifest(SETTINGS)
+    for path in files:
+        manifest.allocate(path, file_sha256(path), 3)
+    return manifest
+
+
+def test_diff_reports_added_changed_deleted_and_unchanged(tmp_path):
+    kept = _write(tmp_path / "kept.pdf", b"kept")
+    edited = _write(tmp_path / "edited.pdf", b"before")
+    removed = _write(tmp_path / "removed.pdf", b"removed")
+    manifest = _manifest([kept, edited, removed])
+
+    _write(edited, b"after, and longer")
+    removed.unlink()
+    added = _write(tmp_path / "added.pdf", b"added")
+    changes = manifest.diff([kept, edited, added])
+
+    assert changes.added == [added]
+    assert changes.changed == [edited]
+    assert changes.deleted == [IndexManifest.key(removed)]
+    assert changes.unchanged == [kept]
+    assert changes.to_embed == [added, edited]
+    assert changes.stale == [IndexManifest.key(edited), IndexManifest.key(removed)]
+    assert changes.has_changes
+    assert changes.hashes[IndexManifest.key(edited)] == file_sha256(edited)
+
+
+def test_touched_file_is_unchanged(tmp_path):
+    touched = _write(tmp_path / "touched.pdf", b"same")
+    manifest = _manifest([touched])
+    stat = os.stat(touched)
+    os.utime(touched, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    changes = manifest.diff([touched])
+
+    assert changes.unchanged == [touched]
+    assert not changes.has_changes
+    # The new mtime is recorded, so the file is not hashed again next time
+    assert manifest.files[IndexManifest.key(touched)]["mtime"] == os.stat(touched).st_mtime_ns
+
+
+def test_ids_and_keys_map_to_each_other(tmp_path):
+    first, second, third = (_write(tmp_path / f"{name}.pdf", name.encode()) for name in ("a", "b", "c"))
+    manifest = _manifest([first, second, third])
+    keys = [IndexManifest.key(path) for path in (first, second, third)]
+
+    np.testing.assert_array_equal(manifest.ids_for(keys[1:]), [3, 4, 5, 6, 7, 8])
+    assert manifest.ids_for(["missing"]).size == 0
+    assert manifest.keys_for(np.array([4, 8])) == keys[1:]
+    assert manifest.keys_for(np.array([9])) == []
+    assert manifest.next_id == 9
+
+
+def test_reprocess_moves_an_unchanged_file_to_changed(tmp_path):
+    kept = _write(tmp_path / "kept.pdf", b"kept")
+    orphan = _write(tmp_path / "orphan.pdf", b"orphan")
+    manifest = _manifest([kept, orphan])
+    changes = manifest.diff([kept, orphan])
+    key = IndexManifest.key(orphan)
+
+    changes.reprocess(key, manifest.files[key]["sha256"])
+
+    assert changes.unchanged == [kept]
+    assert changes.changed == [orphan]
+    assert changes.stale == [key]
+    assert changes.hashes[key] == file_sha256(orphan)
+
+
+def test_save_and_load_round_trip(tmp_path):
+    source = _write(tmp_path / "a.pdf", b"a")
+    manifest = _manifest([source])
+    manifest.save(tmp_path / "manifest.json")
+
+    loaded = IndexManifest.load(tmp_path / "manifest.json")
+
+    assert loaded.files == manifest.files
+    assert loaded.next_id == manifest.next_id
+    assert loaded.matches(SETTINGS)
+    assert IndexManifest.load(tmp_path / "missing.json") is None
+
+
+def test_changed_settings_names_nested_keys():
+    manifest = IndexManifest(SETTINGS)
+    settings = {**SETTINGS, "chunk_size": 500, "index": {**SETTINGS["index"], "metric": "cosine"}, "dedup": None}
+
+    assert manifest.changed_settings(settings) == ["chunk_size", "index.metric"]
+    assert manifest.changed_settings({**settings, "dedup": {"threshold": 0.8}}) == [
+        "chunk_size", "dedup", "index.metric"
+    ]
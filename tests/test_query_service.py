@@ -0,0 +1,99 @@
+"""
+Tests for the micro-batcher that coalesces concurrent queries into match_queries calls.
+"""
+import asyncio
+import json
+import pytest
+from utils.query_service import MicroBatcher, QueryService
+from utils.search_filter import SearchFilter
+
+
+class RecordingMatcher:
+    """Answers each query with its own text and records the batches it is asked for."""
+
+    def __init__(self, fail_on=None):
+        self.calls = []
+        self.fail_on = fail_on
+
+    def match_queries(self, queries, db_path, batch_size, search_filter, with_sources=False):
+        self.calls.append((list(queries), search_filter, with_sources))
+        if self.fail_on in queries:
+            raise RuntimeError("Failed to match query: boom")
+        return [[(query, 1.0, [{"chunk_id": 0, "source": db_path, "page": None}])] for query in queries]
+
+
+def _run(coroutine_function, matcher, **batcher_args):
+    async def main():
+        batcher = MicroBatcher(matcher, "db", **batcher_args)
+        batcher.start()
+        try:
+            return await coroutine_function(batcher)
+        finally:
+            await batcher.stop()
+    return asyncio.run(main())
+
+
+def test_concurrent_queries_share_a_batch():
+    matcher = RecordingMatcher()
+
+    async def ask(batcher):
+        return await asyncio.gather(*(batcher.match(f"q{i}") for i in range(5))), batcher.stats()
+
+    results, stats = _run(ask, matcher, max_batch_size=8, max_wait_ms=50)
+
+    assert [result[0][0] for result in results] == [f"q{i}" for i in range(5)]
+    assert matcher.calls == [([f"q{i}" for i in range(5)], None, True)]
+    assert stats == {"batches": 1, "queries": 5, "mean_batch_size": 5.0}
+
+
+def test_batches_are_split_by_size_and_filter():
+    matcher = RecordingMatcher()
+    manuals = SearchFilter.parse("file:manual*.pdf")
+
+    async def ask(batcher):
+        return await asyncio.gather(
+            batcher.match("a"), batcher.match("b", manuals), batcher.match("c"), batcher.match("d")
+        )
+
+    _run(ask, matcher, max_batch_size=3, max_wait_ms=50)
+
+    batches = [(queries, search_filter) for queries, search_filter, _ in matcher.calls]
+    assert sorted(batches, key=str) == sorted([(["a", "c"], None), (["b"], manuals), (["d"], None)], key=str)
+
+
+def test_errors_reach_every_query_of_the_batch():
+    matcher = RecordingMatcher(fail_on="bad")
+
+    async def ask(batcher):
+        return await asyncio.gather(batcher.match("good"), batcher.match("bad"), return_exceptions=True)
+
+    results = _run(ask, matcher, max_batch_size=8, max_wait_ms=50)
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+def test_service_returns_sources_and_honours_k():
+    matcher = RecordingMatcher()
+
+    async def ask(batcher):
+        service = QueryService(batcher)
+        # pylint: disable=protected-access
+        single = await service._route("POST", "/query", json.dumps({"query": "q", "k": 1}).encode())
+        missing = await service._route("POST", "/query", b"{}")
+        return single, missing
+
+    (status, payload), (missing_status, _) = _run(ask, matcher)
+
+    assert status == 200
+    assert payload == {
+        "results": [{"text": "q", "score": 1.0, "sources": [{"chunk_id": 0, "source": "db", "page": None}]}]
+    }
+    assert missing_status == 400
+
+
+@pytest.mark.parametrize("route", [("GET", "/query"), ("POST", "/nowhere")])
+def test_unknown_routes(route):
+    async def ask(batcher):
+        return await QueryService(batcher)._route(*route, b"")  # pylint: disable=protected-access
+
+    assert _run(ask, RecordingMatcher())[0] == 404
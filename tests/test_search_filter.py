@@ -0,0 +1,67 @@
+"""
+Tests for parsing filter expressions and evaluating them over a chunk store.
+"""
+import os
+from datetime import datetime
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+from utils.chunk_store import ChunkStore, ChunkStoreWriter
+from utils.search_filter import SearchFilter
+
+
+def test_parse_all_terms():
+    search_filter = SearchFilter.parse("file:manual*.pdf,notes.pdf page:3-10 after:2024-01-01 before:2024-06-30")
+
+    assert search_filter.files == ("manual*.pdf", "notes.pdf")
+    assert search_filter.pages == (3, 10)
+    assert search_filter.modified_after == datetime(2024, 1, 1).timestamp()
+    assert search_filter.modified_before == datetime(2024, 6, 30).timestamp()
+
+
+def test_parse_single_page_and_empty_expression():
+    assert SearchFilter.parse("page:4").pages == (4, 4)
+    assert SearchFilter.parse("").is_empty
+    assert SearchFilter.parse("file:a.pdf") == SearchFilter.parse("file:a.pdf")
+
+
+@pytest.mark.parametrize("expression", ["author:me", "page:x", "page:1-y", "after:yesterday", "nofilter"])
+def test_parse_rejects_bad_terms(expression):
+    with pytest.raises(ValueError, match="Invalid filter"):
+        SearchFilter.parse(expression)
+
+
+@pytest.fixture(name="store")
+def fixture_store(tmp_path):
+    """Two pages of an old manual, one page of new notes, and a merged duplicate from a third file."""
+    sources = {"manual.pdf": datetime(2023, 5, 1), "notes.pdf": datetime(2024, 3, 1), "copy.pdf": datetime(2023, 6, 1)}
+    for name, modified in sources.items():
+        (tmp_path / name).write_bytes(b"%PDF")
+        os.utime(tmp_path / name, (modified.timestamp(), modified.timestamp()))
+
+    def document(name, page):
+        return Document(page_content=f"{name} {page}", metadata={"source": str(tmp_path / name), "page": page})
+
+    with ChunkStoreWriter(tmp_path / "chunks") as writer:
+        writer.append_documents(
+            [document("manual.pdf", 0), document("manual.pdf", 1), document("notes.pdf", 0)], [0, 1, 2]
+        )
+        writer.append_duplicates([document("copy.pdf", 5)], [3], [1])
+    return ChunkStore(tmp_path / "chunks")
+
+
+@pytest.mark.parametrize("expression, expected", [
+    ("", [True, True, True]),
+    ("file:notes.pdf", [False, False, True]),
+    ("file:*/manual.pdf", [True, True, False]),
+    ("page:2", [False, True, False]),
+    ("page:1-1", [True, False, True]),
+    ("after:2024-01-01", [False, False, True]),
+    ("before:2024-01-01", [True, True, False]),
+    ("file:manual.pdf page:2 after:2024-01-01", [False, False, False]),
+    # The second manual page stands in for a page of copy.pdf
+    ("file:copy.pdf", [False, True, False]),
+    ("page:6", [False, True, False]),
+])
+def test_row_mask(store, expression, expected):
+    np.testing.assert_array_equal(SearchFilter.parse(expression).row_mask(store), expected)
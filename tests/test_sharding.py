@@ -0,0 +1,29 @@
+"""
+Tests for assigning source files to shards.
+"""
+from pathlib import Path
+import pytest
+from utils.sharding import ShardLayout
+
+
+def test_folder_sharding_keeps_each_folder_together(tmp_path):
+    layout = ShardLayout(tmp_path / "db", 4, "folder")
+    folder = Path("/reports")
+    pdf_files = [folder / name / f"rev{revision}.pdf" for name in ("q1", "q2", "q3", "q4") for revision in range(3)]
+
+    shards = layout.partition(pdf_files, str(folder))
+
+    for name in ("q1", "q2", "q3", "q4"):
+        assert len({layout.shard_of(pdf_file, folder) for pdf_file in pdf_files if pdf_file.parent.name == name}) == 1
+    assert sorted(pdf_file for files in shards.values() for pdf_file in files) == sorted(pdf_files)
+
+
+@pytest.mark.parametrize("shard_count, shard_by, file_pattern, spreads", [
+    (4, "folder", "*.pdf", False),
+    (4, "folder", "**/*.pdf", True),
+    (4, "folder", "*/*.pdf", True),
+    (4, "path_hash", "*.pdf", True),
+    (1, "folder", "*.pdf", True),
+])
+def test_folder_sharding_needs_a_pattern_into_subfolders(tmp_path, shard_count, shard_by, file_pattern, spreads):
+    assert ShardLayout(tmp_path / "db", shard_count, shard_by).spreads(file_pattern) == spreads
@@ -2,7 +2,14 @@
 Utility functions for the RAG Document System
 """
 from .file_utils import count_pdf_files, path_exists
-from .embeddings import DocumentEmbedder
 
 
 __all__ = ['count_pdf_files', 'path_exists', 'DocumentEmbedder']
+
+
+def __getattr__(name: str) -> any:
+    """Import DocumentEmbedder on first use, so importing utils does not load FAISS and the model stack."""
+    if name == "DocumentEmbedder":
+        from .embeddings import DocumentEmbedder  # pylint: disable=import-outside-toplevel
+        return DocumentEmbedder
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
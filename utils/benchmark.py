@@ -0,0 +1,517 @@
+"""
+Benchmarks ingest throughput and query latency on synthetic PDFs, so that
+changes to create_faiss_db and match_query can be compared run against run.
+
+Each corpus size is generated offline, then measured stage by stage:
+    parse   - PDF loading and chunking, in pages/s and chunks/s
+    extract - each PDF extraction backend on the same files, in pages/s and MB/s
+    embed   - the embedding model alone, in embeddings/s
+    ingest  - create_faiss_db end to end, for each index type
+    query   - match_query latency percentiles and QPS, and match_queries QPS
+Results are written as JSON; compare_results reports the change between two runs.
+"""
+import copy
+import json
+import platform
+import random
+import resource
+import shutil
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+import faiss
+import numpy as np
+from loguru import logger
+from utils.embeddings import DocumentEmbedder
+from utils.index_registry import IndexRegistry
+from utils.model_registry import backend_label, get_embedding_model
+from utils.pdf_extraction import get_extractor
+from utils.pdf_parsing import parse_pdfs, split_pages
+from utils.query_cache import QueryCache
+from utils.query_matching import QueryMatcher
+from utils.telemetry import Telemetry
+
+BENCHMARK_VERSION = 1
+# Metrics compared by compare_results, and whether a higher value is better
+COMPARED_METRICS = {
+    "parse.pages_per_s": True,
+    "parse.chunks_per_s": True,
+    "embed.embeddings_per_s": True,
+    "extract.pages_per_s": True,
+    "ingest.chunks_per_s": True,
+    "query.p50_ms": False,
+    "query.p95_ms": False,
+    "query.p99_ms": False,
+    "query.qps": True,
+    "query.batch_qps": True,
+}
+SYLLABLES = ("ka", "lo", "mi", "ne", "ru", "ta", "shi", "vo", "de", "pa", "zu", "fen", "gar", "bel", "tor", "qui")
+
+
+def _escape_pdf_text(text: str) -> str:
+    """Escape a string for a PDF literal string."""
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_synthetic_pdf(pdf_path: Path, pages: List[str], line_width: int = 90) -> None:
+    """
+    Write a minimal PDF with one page of Helvetica text per string, readable by PyPDFLoader.
+    param pdf_path: The file to write.
+    param pages: The text of each page.
+    param line_width: Characters per text line.
+    """
+    font_id = 3 + 2 * len(pages)
+    kids = " ".join(f"{3 + 2 * page} 0 R" for page in range(len(pages)))
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        f"<< /Type /Pages /Kids [{kids}] /Count {len(pages)} >>".encode("ascii"),
+    ]
+    for page, text in enumerate(pages):
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {4 + 2 * page} 0 R "
+            f"/Resources << /Font << /F1 {font_id} 0 R >> >> >>".encode("ascii")
+        )
+        lines, line = [], ""
+        for word in text.split():
+            if line and len(line) + len(word) + 1 > line_width:
+                lines.append(line)
+                line = ""
+            line = f"{line} {word}" if line else word
+        lines.append(line)
+        content = "BT /F1 10 Tf 12 TL 40 760 Td " + " ".join(
+            f"({_escape_pdf_text(line)}) '" for line in lines
+        ) + " ET"
+        stream = content.encode("latin-1", errors="replace")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += f"{number} 0 obj\n".encode("ascii") + body + b"\nendobj\n"
+    xref = len(output)
+    output += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("ascii")
+    output += b"".join(f"{offset:010d} 00000 n \n".encode("ascii") for offset in offsets)
+    output += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("ascii")
+    Path(pdf_path).write_bytes(bytes(output))
+
+
+class SyntheticCorpus:
+    """
+    Generates PDFs and queries from a fixed pseudo-word vocabulary with a
+    Zipf-like word distribution, so every run with the same seed produces the
+    same files and the same queries.
+    """
+
+    def __init__(self, vocabulary_size: int = 5000, seed: int = 0):
+        """
+        Constructor for the SyntheticCorpus class.
+        param vocabulary_size: Number of distinct words.
+        param seed: Seed of the random generator.
+        """
+        self.seed = seed
+        rng = random.Random(seed)
+        words = set()
+        while len(words) < vocabulary_size:
+            words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+        self.vocabulary = sorted(words)
+        self._weights = [1.0 / rank for rank in range(1, vocabulary_size + 1)]
+
+    def _words(self, rng: random.Random, count: int) -> List[str]:
+        """Returns count words drawn from the vocabulary."""
+        return rng.choices(self.vocabulary, weights=self._weights, k=count)
+
+    def generate(self, folder: Path, documents: int, pages_per_document: int, words_per_page: int) -> List[Path]:
+        """
+        Write a corpus of PDFs, reusing files already generated with the same parameters.
+        param folder: The folder to write to, created if needed.
+        param documents: Number of PDFs.
+        param pages_per_document: Pages in each PDF.
+        param words_per_page: Words on each page.
+        Returns: The PDF paths.
+        """
+        folder = Path(folder)
+        folder.mkdir(parents=True, exist_ok=True)
+        pdf_files = []
+        for document in range(documents):
+            pdf_path = folder / f"doc-{document:05d}.pdf"
+            pdf_files.append(pdf_path)
+            if pdf_path.exists():
+                continue
+            rng = random.Random(f"{self.seed}-{document}")
+            pages = []
+            for page in range(pages_per_document):
+                words = self._words(rng, words_per_page)
+                # A unique identifier per page, as part numbers are in real documents
+                words.insert(rng.randrange(len(words) + 1), f"DOC{document}-P{page}")
+                pages.append(" ".join(words))
+            write_synthetic_pdf(pdf_path, pages)
+        return pdf_files
+
+    def queries(self, count: int, words: int = 6) -> List[str]:
+        """
+        Returns count queries of a few words each.
+        param count: Number of queries.
+        param words: Words per query.
+        """
+        rng = random.Random(f"{self.seed}-queries")
+        return [" ".join(self._words(rng, words)) for _ in range(count)]
+
+
+def peak_rss_mb() -> float:
+    """Returns the peak resident set size in MB of this process and its finished child processes."""
+    scale = 1 if sys.platform == "darwin" else 1024  # ru_maxrss is bytes on macOS, KB on Linux
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    return peak * scale / (1024 * 1024)
+
+
+def latency_summary(latencies: List[float]) -> Dict[str, float]:
+    """
+    Summarize per-query latencies.
+    param latencies: The latencies in seconds.
+    Returns: The mean and p50/p95/p99 latencies in milliseconds and the queries per second.
+    """
+    milliseconds = np.asarray(latencies) * 1000
+    return {
+        "queries": len(latencies),
+        "mean_ms": float(milliseconds.mean()),
+        "p50_ms": float(np.percentile(milliseconds, 50)),
+        "p95_ms": float(np.percentile(milliseconds, 95)),
+        "p99_ms": float(np.percentile(milliseconds, 99)),
+        "qps": len(latencies) / float(np.sum(latencies)),
+    }
+
+
+def extraction_throughput(
+    pdf_files: List[Path],
+    backends: List[str],
+    chunk_size: int = 500,
+    chunk_overlap: int = 150
+) -> List[Dict[str, any]]:
+    """
+    Extract and split the same files with each PDF backend in this process, one
+    file at a time, so the backends are compared on equal terms.
+    param pdf_files: The files.
+    param backends: The backends to compare; those not installed are reported with an error.
+    param chunk_size: Size of text chunks.
+    param chunk_overlap: Overlap between chunks.
+    Returns: One row per backend with its pages/s, MB/s and chunks/s.
+    """
+    # pylint: disable=import-outside-toplevel
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    size_mb = sum(Path(pdf_file).stat().st_size for pdf_file in pdf_files) / (1024 * 1024)
+    rows = []
+    for backend in backends:
+        try:
+            extractor = get_extractor(backend)
+        except ImportError as e:
+            rows.append({"backend": backend, "error": str(e)})
+            continue
+        pages, chunks, load_s, split_s = 0, 0, 0.0, 0.0
+        for pdf_file in pdf_files:
+            stats = {}
+            chunks += len(split_pages(extractor, splitter, str(pdf_file), stats))
+            pages += stats["pages"]
+            load_s += stats["load_s"]
+            split_s += stats["split_s"]
+        rows.append({
+            "backend": backend,
+            "pages": pages,
+            "chunks": chunks,
+            "extract_seconds": load_s,
+            "split_seconds": split_s,
+            "pages_per_s": pages / load_s,
+            "mb_per_s": size_mb / load_s,
+            "chunks_per_s": chunks / (load_s + split_s),
+        })
+        logger.info(f"PDF backend {backend}: {pages / load_s:.0f} pages/s")
+    return rows
+
+
+def _directory_bytes(path: Path) -> int:
+    """Returns the total size of the files under a directory."""
+    return sum(file.stat().st_size for file in Path(path).rglob("*") if file.is_file())
+
+
+def run_benchmark(
+    cfg: Dict[str, any],
+    workdir: str,
+    sizes: List[int],
+    index_types: List[str],
+    model_name: str,
+    pages_per_document: int = 5,
+    words_per_page: int = 300,
+    query_count: int = 200,
+    k: int = 5,
+    chunk_size: int = 500,
+    chunk_overlap: int = 150,
+    seed: int = 0,
+    pdf_backends: Optional[List[str]] = None
+) -> Dict[str, any]:
+    """
+    Run the benchmark over every corpus size and index type.
+    The embedding cache and the query cache are disabled so that every run
+    measures the same work.
+    param cfg: The application configuration; its [ingest], [sharding], [index], [onnx] settings
+        and [embeddings] device and backend are used.
+    param workdir: Folder for the generated PDFs and databases; PDFs are reused across runs.
+    param sizes: Corpus sizes, in documents.
+    param index_types: Index types to build for each corpus.
+    param model_name: The embedding model, e.g. hash:384 for the deterministic stand-in.
+    param pages_per_document: Pages in each generated PDF.
+    param words_per_page: Words on each generated page.
+    param query_count: Queries timed against each index.
+    param k: Matches per query.
+    param chunk_size: Size of text chunks.
+    param chunk_overlap: Overlap between chunks.
+    param seed: Seed of the generated corpus and queries.
+    param pdf_backends: PDF extraction backends to compare on each corpus, None to skip.
+    Returns: The results, ready to be written as JSON.
+    """
+    workdir = Path(workdir)
+    corpus = SyntheticCorpus(seed=seed)
+    queries = corpus.queries(query_count)
+    device = cfg["embeddings"]["device"]
+    embeddings = get_embedding_model(model_name, device, cfg["embeddings"]["backend"], cfg["onnx"])
+    batch_size = cfg["ingest"]["embed_batch_size"]
+    cfg = copy.deepcopy(cfg)
+    cfg["embedding-cache"]["enabled"] = False
+    cfg["pdf-details"]["embed_file_pattern"] = "*.pdf"
+
+    runs = []
+    for documents in sizes:
+        folder = workdir / f"corpus-{documents}x{pages_per_document}"
+        logger.info(f"Benchmarking a corpus of {documents} documents in {folder}")
+        pdf_files = corpus.generate(folder, documents, pages_per_document, words_per_page)
+
+        start = time.perf_counter()
+        texts, pages = [], 0
+        parsed = parse_pdfs(
+            pdf_files, chunk_size, chunk_overlap, cfg["ingest"]["workers"], cfg["ingest"]["pdf_backend"]
+        )
+        for pdf_file, chunks, error, stats in parsed:
+            if error:
+                raise RuntimeError(f"Could not parse {pdf_file}: {error}")
+            texts.extend(chunk.page_content for chunk in chunks)
+            pages += stats["pages"]
+        parse_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for position in range(0, len(texts), batch_size):
+            embeddings.embed_documents(texts[position:position + batch_size])
+        embed_s = time.perf_counter() - start
+
+        run = {
+            "documents": documents,
+            "pages": pages,
+            "chunks": len(texts),
+            "parse": {
+                "seconds": parse_s,
+                "pages_per_s": pages / parse_s,
+                "chunks_per_s": len(texts) / parse_s,
+            },
+            "embed": {"seconds": embed_s, "embeddings_per_s": len(texts) / embed_s},
+            "extract": extraction_throughput(pdf_files, pdf_backends or [], chunk_size, chunk_overlap),
+            "indexes": [],
+        }
+        for index_type in index_types:
+            run["indexes"].append(
+                _benchmark_index(
+                    cfg, folder, workdir / f"db-{documents}-{index_type}", index_type, model_name,
+                    queries, k, chunk_size, chunk_overlap, pages, len(texts)
+                )
+            )
+        run["peak_rss_mb"] = peak_rss_mb()
+        runs.append(run)
+
+    return {
+        "version": BENCHMARK_VERSION,
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "faiss": faiss.__version__,
+            "faiss_threads": faiss.omp_get_max_threads(),
+        },
+        "settings": {
+            "model_name": model_name,
+            "embedding_backend": backend_label(model_name, cfg["embeddings"]["backend"], cfg["onnx"]),
+            "pages_per_document": pages_per_document,
+            "words_per_page": words_per_page,
+            "queries": query_count,
+            "k": k,
+            "chunk_size": chunk_size,
+            "chunk_overlap": chunk_overlap,
+            "seed": seed,
+            "workers": cfg["ingest"]["workers"],
+            "pdf_backend": cfg["ingest"]["pdf_backend"],
+            "embed_batch_size": batch_size,
+            "shards": cfg["sharding"]["shards"],
+            "index": cfg["index"],
+            "dedup": cfg["dedup"],
+        },
+        "runs": runs,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def _benchmark_index(
+    cfg: Dict[str, any],
+    folder: Path,
+    db_path: Path,
+    index_type: str,
+    model_name: str,
+    queries: List[str],
+    k: int,
+    chunk_size: int,
+    chunk_overlap: int,
+    page_count: int,
+    chunk_count: int
+) -> Dict[str, any]:
+    """Build one index type from scratch over a corpus and time queries against it."""
+    cfg = copy.deepcopy(cfg)
+    cfg["index"]["type"] = index_type
+    shutil.rmtree(db_path, ignore_errors=True)
+    embedder = DocumentEmbedder(chunk_size, chunk_overlap, model_name, cfg, cfg["embeddings"]["device"])
+    start = time.perf_counter()
+    embedder.create_faiss_db(str(folder), str(db_path), incremental=False)
+    ingest_s = time.perf_counter() - start
+
+    matcher = QueryMatcher.from_config(
+        cfg,
+        model_name=model_name,
+        k=k,
+        registry=IndexRegistry(),
+        query_cache=QueryCache(max_entries=0),
+        telemetry=Telemetry(enabled=False)
+    )
+    # The first query loads the index; it is not part of the measurement
+    matcher.match_query(queries[0], str(db_path))
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        matcher.match_query(query, str(db_path))
+        latencies.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    matcher.match_queries(queries, str(db_path))
+    batch_s = time.perf_counter() - start
+
+    result = {
+        "index_type": index_type,
+        "index_bytes": _directory_bytes(db_path),
+        "ingest": {
+            "seconds": ingest_s,
+            "pages_per_s": page_count / ingest_s,
+            "chunks_per_s": chunk_count / ingest_s,
+        },
+        "query": {**latency_summary(latencies), "batch_qps": len(queries) / batch_s},
+    }
+    logger.info(
+        f"{index_type}: ingest {result['ingest']['chunks_per_s']:.0f} chunks/s, "
+        f"query p50 {result['query']['p50_ms']:.2f} ms p99 {result['query']['p99_ms']:.2f} ms"
+    )
+    return result
+
+
+def _metric_rows(results: Dict[str, any]) -> Dict[tuple, float]:
+    """Flatten results to {(documents, index type or backend or None, metric): value} for the compared metrics."""
+    rows = {}
+    for run in results["runs"]:
+        for metric in COMPARED_METRICS:
+            stage, name = metric.split(".")
+            if stage == "extract":
+                for backend in run.get("extract", []):
+                    if name in backend:
+                        rows[(run["documents"], backend["backend"], metric)] = backend[name]
+            elif stage in run:
+                rows[(run["documents"], None, metric)] = run[stage][name]
+            for index in run["indexes"]:
+                if stage in index:
+                    rows[(run["documents"], index["index_type"], metric)] = index[stage][name]
+    return rows
+
+
+def compare_results(baseline: Dict[str, any], current: Dict[str, any]) -> List[Dict[str, any]]:
+    """
+    Compare two benchmark results on the corpus sizes and index types they share.
+    param baseline: The earlier results.
+    param current: The later results.
+    Returns: One row per metric with both values and the relative change, positive when
+        the current run is better.
+    """
+    baseline_rows, current_rows = _metric_rows(baseline), _metric_rows(current)
+    comparison = []
+    for key, value in current_rows.items():
+        before = baseline_rows.get(key)
+        if before is None or before == 0:
+            continue
+        documents, index_type, metric = key
+        change = (value - before) / before
+        comparison.append({
+            "documents": documents,
+            "index_type": index_type,
+            "metric": metric,
+            "baseline": before,
+            "current": value,
+            "improvement": change if COMPARED_METRICS[metric] else -change,
+        })
+    return comparison
+
+
+def format_results(results: Dict[str, any], comparison: Optional[List[Dict[str, any]]] = None) -> str:
+    """
+    Render results, and optionally their comparison with a baseline, as plain-text tables.
+    param results: Results from run_benchmark.
+    param comparison: Rows from compare_results.
+    """
+    header = (
+        f"{'docs':>6} {'chunks':>7} {'index':<10} {'ingest ch/s':>11} "
+        f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'qps':>8} {'batch qps':>9}"
+    )
+    lines = [header, "-" * len(header)]
+    for run in results["runs"]:
+        lines.append(
+            f"{run['documents']:>6} {run['chunks']:>7} {'(stages)':<10} "
+            f"parse {run['parse']['pages_per_s']:.0f} pages/s, {run['parse']['chunks_per_s']:.0f} chunks/s; "
+            f"embed {run['embed']['embeddings_per_s']:.0f} embeddings/s; peak RSS {run['peak_rss_mb']:.0f} MB"
+        )
+        for backend in run.get("extract", []):
+            summary = backend.get("error") or (
+                f"{backend['pages_per_s']:.0f} pages/s, {backend['mb_per_s']:.2f} MB/s, "
+                f"{backend['chunks_per_s']:.0f} chunks/s"
+            )
+            lines.append(f"{run['documents']:>6} {run['chunks']:>7} {'(extract)':<10} {backend['backend']}: {summary}")
+        for index in run["indexes"]:
+            query = index["query"]
+            lines.append(
+                f"{run['documents']:>6} {run['chunks']:>7} {index['index_type']:<10} "
+                f"{index['ingest']['chunks_per_s']:>11.0f} {query['p50_ms']:>8.2f} {query['p95_ms']:>8.2f} "
+                f"{query['p99_ms']:>8.2f} {query['qps']:>8.0f} {query['batch_qps']:>9.0f}"
+            )
+    if comparison:
+        lines += ["", f"{'docs':>6} {'index':<10} {'metric':<24} {'baseline':>10} {'current':>10} {'change':>8}"]
+        for row in comparison:
+            lines.append(
+                f"{row['documents']:>6} {row['index_type'] or '':<10} {row['metric']:<24} "
+                f"{row['baseline']:>10.2f} {row['current']:>10.2f} {row['improvement']:>+8.1%}"
+            )
+    return "\n".join(lines)
+
+
+def write_results(results: Dict[str, any], output_path: str) -> None:
+    """
+    Write results as JSON.
+    param results: Results from run_benchmark.
+    param output_path: The file to write.
+    """
+    with open(output_path, "w", encoding="utf-8") as handle:
+        json.dump(results, handle, indent=2)
@@ -0,0 +1,228 @@
+"""
+On-disk BM25 inverted index over the chunk texts of a chunk store.
+
+A BM25 index is a directory holding:
+    terms.bin          - the UTF-8 vocabulary in sorted order, concatenated
+    term_offsets.bin   - int64 byte offsets into terms.bin, one more than the term count
+    postings.bin       - int64 offsets into rows.bin and tf.bin, one more than the term count
+    rows.bin           - int32 chunk store positions, grouped by term and ascending within a term
+    tf.bin             - uint16 term frequencies, parallel to rows.bin
+    doc_len.bin        - int32 token count of every chunk
+    meta.json          - chunk count, average length and BM25 parameters, written last
+
+Postings are memory-mapped, so a query only reads the postings of its terms.
+"""
+import json
+import re
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from loguru import logger
+from utils.chunk_store import ChunkStore
+
+BM25_VERSION = 1
+# Words, plus identifiers joined by - . / or _ such as part numbers (AB-1234.5)
+TOKEN_PATTERN = re.compile(r"\w+(?:[-./]\w+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split text into lowercase terms. Compound identifiers are kept whole and
+    also split into their parts, so 'AB-1234' matches 'AB-1234', 'ab' and '1234'.
+    param text: The text to tokenize.
+    """
+    terms = []
+    for match in TOKEN_PATTERN.finditer(text.lower()):
+        token = match.group()
+        terms.append(token)
+        if not token.isalnum():
+            terms.extend(part for part in re.split(r"[-./_]", token) if part)
+    return terms
+
+
+def build_bm25_index(
+    store: ChunkStore,
+    index_dir: Path,
+    k1: float = 1.2,
+    b: float = 0.75,
+    previous: Optional["BM25Index"] = None,
+    kept: Optional[np.ndarray] = None,
+    batch_size: int = 4096
+) -> None:
+    """
+    Write the inverted index of a chunk store. With the index of the store it was updated
+    from, the postings of the rows it kept are reused and only the added rows are tokenized.
+    param store: The chunk store; postings refer to its row positions.
+    param index_dir: Directory to create the index in; it must not exist yet.
+    param k1: BM25 term frequency saturation.
+    param b: BM25 length normalization.
+    param previous: The index of the previous store, or None to tokenize every row.
+    param kept: Ascending positions in the previous store of the rows copied to the start of this one.
+    param batch_size: Number of rows tokenized before their postings are packed into arrays.
+    """
+    index_dir = Path(index_dir)
+    index_dir.mkdir(parents=True)
+    kept = np.zeros(0, dtype=np.int64) if previous is None else np.asarray(kept, dtype=np.int64)
+
+    # Postings of the kept rows, moved to their new positions; removed rows are dropped
+    old_terms = previous.vocabulary() if previous is not None else []
+    if previous is not None and len(previous.rows):
+        moved = np.full(len(previous), -1, dtype=np.int64)
+        moved[kept] = np.arange(len(kept))
+        old_rows = moved[previous.rows]
+        valid = old_rows >= 0
+        old_term_column = np.repeat(np.arange(len(old_terms)), np.diff(previous.postings))[valid]
+        old_rows, old_tf = old_rows[valid], np.asarray(previous.tf)[valid]
+    else:
+        old_term_column, old_rows, old_tf = (np.zeros(0, dtype=np.int64) for _ in range(3))
+    doc_len = np.zeros(len(store), dtype=np.int32)
+    if len(kept):
+        doc_len[:len(kept)] = previous.doc_len[kept]
+
+    # Tokenize the added rows a batch at a time, packing each batch's postings into arrays
+    term_ids: Dict[str, int] = {}
+    batches = []
+    for batch_start in range(len(kept), len(store), batch_size):
+        term_column, row_column, tf_column = [], [], []
+        for position in range(batch_start, min(batch_start + batch_size, len(store))):
+            counts = Counter(tokenize(store.chunk_text(position)))
+            doc_len[position] = sum(counts.values())
+            term_column.extend(term_ids.setdefault(term, len(term_ids)) for term in counts)
+            row_column.extend([position] * len(counts))
+            tf_column.extend(counts.values())
+        batches.append((
+            np.asarray(term_column, dtype=np.int64),
+            np.asarray(row_column, dtype=np.int64),
+            np.minimum(np.asarray(tf_column, dtype=np.int64), np.iinfo(np.uint16).max),
+        ))
+
+    # Renumber old and new terms into one sorted vocabulary
+    terms = sorted(set(old_terms).union(term_ids))
+    sorted_ids = {term: term_id for term_id, term in enumerate(terms)}
+    old_ids = np.array([sorted_ids[term] for term in old_terms], dtype=np.int64)
+    new_ids = np.array([sorted_ids[term] for term in term_ids], dtype=np.int64)
+    term_column = np.concatenate([old_ids[old_term_column]] + [new_ids[batch[0]] for batch in batches])
+    row_column = np.concatenate([old_rows] + [batch[1] for batch in batches])
+    tf_column = np.concatenate([old_tf] + [batch[2] for batch in batches])
+
+    # Drop terms left without postings, then group postings by term; kept rows come first
+    # and every batch is in row order, so rows stay ascending within a term
+    counts = np.bincount(term_column, minlength=len(terms))
+    live = counts > 0
+    terms = [term for term, is_live in zip(terms, live.tolist()) if is_live]
+    term_column = (np.cumsum(live) - 1)[term_column]
+    order = np.argsort(term_column, kind="stable")
+    postings = np.zeros(len(terms) + 1, dtype=np.int64)
+    postings[1:] = np.cumsum(counts[live])
+
+    encoded = [term.encode("utf-8") for term in terms]
+    term_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    term_offsets[1:] = np.cumsum([len(term) for term in encoded])
+    with open(index_dir / "terms.bin", "wb") as handle:
+        handle.write(b"".join(encoded))
+    term_offsets.tofile(index_dir / "term_offsets.bin")
+    postings.tofile(index_dir / "postings.bin")
+    row_column.astype(np.int32)[order].tofile(index_dir / "rows.bin")
+    tf_column.astype(np.uint16)[order].tofile(index_dir / "tf.bin")
+    doc_len.tofile(index_dir / "doc_len.bin")
+
+    meta = {
+        "version": BM25_VERSION,
+        "count": len(store),
+        "terms": len(terms),
+        "avg_doc_len": float(doc_len.mean()) if len(doc_len) else 0.0,
+        "k1": k1,
+        "b": b,
+    }
+    with open(index_dir / "meta.json", "w", encoding="utf-8") as handle:
+        json.dump(meta, handle)
+    logger.info(
+        f"Built BM25 index of {len(terms)} terms over {len(store)} chunks, "
+        f"{len(store) - len(kept)} of them tokenized"
+    )
+
+
+class BM25Index:
+    """Read-only, memory-mapped BM25 index."""
+
+    def __init__(self, index_dir: Path):
+        """
+        Constructor for the BM25Index class.
+        param index_dir: The index directory.
+        Raises: FileNotFoundError: If the index does not exist or is incomplete.
+        """
+        self.index_dir = Path(index_dir)
+        meta_path = self.index_dir / "meta.json"
+        if not meta_path.exists():
+            raise FileNotFoundError(f"BM25 index not found at {self.index_dir}")
+        with open(meta_path, "r", encoding="utf-8") as handle:
+            meta = json.load(handle)
+        if meta.get("version") != BM25_VERSION:
+            raise ValueError(f"Unsupported BM25 index version {meta.get('version')} at {self.index_dir}")
+
+        self.count = meta["count"]
+        self.avg_doc_len = meta["avg_doc_len"]
+        self.k1 = meta["k1"]
+        self.b = meta["b"]
+        term_count = meta["terms"]
+        term_offsets = np.fromfile(self.index_dir / "term_offsets.bin", dtype=np.int64)
+        terms = (self.index_dir / "terms.bin").read_bytes()
+        self._terms = {
+            terms[term_offsets[i]:term_offsets[i + 1]].decode("utf-8"): i for i in range(term_count)
+        }
+        self.postings = np.fromfile(self.index_dir / "postings.bin", dtype=np.int64)
+        postings_count = int(self.postings[-1])
+        self.rows = self._map("rows.bin", np.int32, postings_count)
+        self.tf = self._map("tf.bin", np.uint16, postings_count)
+        self.doc_len = self._map("doc_len.bin", np.int32, self.count)
+
+    def _map(self, name: str, dtype: np.dtype, count: int) -> np.ndarray:
+        """Memory-map a column file; empty columns cannot be mapped."""
+        if count == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(self.index_dir / name, dtype=dtype, mode="r", shape=(count,))
+
+    def __len__(self) -> int:
+        return self.count
+
+    def vocabulary(self) -> List[str]:
+        """Returns the terms of the index in term ID order."""
+        return list(self._terms)
+
+    def search(self, query: str, k: int, mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Score the chunks containing any query term.
+        param query: The query text.
+        param k: Number of results.
+        param mask: Only return chunks whose row is set in this boolean array.
+        Returns: The BM25 scores and chunk store positions of the k best chunks,
+            best first and padded with position -1 when fewer chunks match.
+        """
+        rows, weights = [], []
+        for term in set(tokenize(query)):
+            term_id = self._terms.get(term)
+            if term_id is None:
+                continue
+            start, end = self.postings[term_id], self.postings[term_id + 1]
+            term_rows = np.asarray(self.rows[start:end])
+            tf = np.asarray(self.tf[start:end], dtype=np.float32)
+            idf = np.log(1 + (self.count - (end - start) + 0.5) / ((end - start) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self.doc_len[term_rows] / max(self.avg_doc_len, 1e-9))
+            rows.append(term_rows)
+            weights.append(idf * tf * (self.k1 + 1) / (tf + norm))
+
+        scores = np.full(k, -np.inf, dtype=np.float32)
+        positions = np.full(k, -1, dtype=np.int64)
+        if not rows:
+            return scores, positions
+        # Sum the term scores of each matching chunk without a corpus-sized array
+        matched, inverse = np.unique(np.concatenate(rows), return_inverse=True)
+        totals = np.bincount(inverse, weights=np.concatenate(weights))
+        if mask is not None:
+            allowed = mask[matched]
+            matched, totals = matched[allowed], totals[allowed]
+        top = np.argsort(-totals, kind="stable")[:k]
+        scores[:len(top)] = totals[top]
+        positions[:len(top)] = matched[top]
+        return scores, positions
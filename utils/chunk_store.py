@@ -0,0 +1,475 @@
+"""
+Columnar, memory-mapped storage for the text chunks of a FAISS database.
+
+A chunk store is a directory holding:
+    text.bin     - the UTF-8 text of every chunk, concatenated
+    offsets.bin  - int64 byte offsets into text.bin, one more than the chunk count
+    ids.bin      - int64 chunk IDs in ascending order, matching the FAISS index IDs
+    source.bin   - int32 codes into the source table in meta.json
+    page.bin     - int32 page numbers, -1 when unknown
+    vectors.bin  - optional float32 embeddings, one row per chunk, for exact re-ranking
+    minhash.bin  - optional uint32 MinHash signatures, one row per chunk, for deduplication
+    meta.json    - row count, vector dimension, the source table and the modification
+                   time of each source, written last
+Near-duplicate chunks dropped at ingest are not rows of the store; each is recorded as a
+back-reference to the chunk that stands in for it, in columns of their own:
+    dup_ids.bin    - int64 chunk IDs of the duplicates, in the ID ranges of their files
+    dup_of.bin     - int64 chunk IDs of the rows they were merged into
+    dup_source.bin - int32 codes into the source table
+    dup_page.bin   - int32 page numbers, -1 when unknown
+sorted by the ID they were merged into, so the duplicates of a chunk are one contiguous run.
+
+Columns are opened with np.memmap, so reading k rows costs O(k) and nothing
+is deserialized up front.
+"""
+import json
+import os
+import shutil
+import sys
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+import numpy as np
+from loguru import logger
+
+STORE_VERSION = 1
+COLUMNS = {
+    "offsets": np.int64,
+    "ids": np.int64,
+    "source": np.int32,
+    "page": np.int32,
+}
+DUPLICATE_COLUMNS = {
+    "dup_ids": np.int64,
+    "dup_of": np.int64,
+    "dup_source": np.int32,
+    "dup_page": np.int32,
+}
+
+
+class ChunkStoreWriter:
+    """Appends chunks to a new chunk store, streaming each column to disk."""
+
+    def __init__(self, store_dir: Path):
+        """
+        Constructor for the ChunkStoreWriter class.
+        param store_dir: Directory to create the store in; it must not exist yet.
+        """
+        self.store_dir = Path(store_dir)
+        self.store_dir.mkdir(parents=True)
+        self.count = 0
+        self._last_id = -1
+        self._text_bytes = 0
+        self._sources: Dict[str, int] = {}
+        self._source_mtimes: Dict[str, Optional[float]] = {}
+        self.dimension: Optional[int] = None
+        self._vectors = None
+        self.num_perm: Optional[int] = None
+        self._signatures = None
+        self.duplicate_count = 0
+        self._text = open(self.store_dir / "text.bin", "wb")
+        self._columns = {name: open(self.store_dir / f"{name}.bin", "wb") for name in COLUMNS}
+        self._duplicates = {name: open(self.store_dir / f"{name}.bin", "wb") for name in DUPLICATE_COLUMNS}
+        self._write("offsets", [0])
+
+    def __enter__(self) -> "ChunkStoreWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def _write(self, column: str, values: Iterable) -> None:
+        """Append values to a column file."""
+        self._columns[column].write(np.asarray(values, dtype=COLUMNS[column]).tobytes())
+
+    def _source_code(self, source: str) -> int:
+        """Returns the code of a source, adding it to the source table."""
+        if source not in self._source_mtimes:
+            self._source_mtimes[source] = os.path.getmtime(source) if os.path.exists(source) else None
+        return self._sources.setdefault(source, len(self._sources))
+
+    def append(self, chunk_id: int, text: str, source: str, page: int) -> None:
+        """
+        Append one chunk. Chunk IDs must be strictly increasing.
+        param chunk_id: The ID of the chunk's vector in the FAISS index.
+        param text: The chunk text.
+        param source: The file the chunk came from.
+        param page: The page number the chunk came from.
+        """
+        self.append_batch([chunk_id], [text], [source], [page])
+
+    def append_batch(
+        self,
+        chunk_ids: List[int],
+        texts: List[str],
+        sources: List[str],
+        pages: List[int],
+        vectors: Optional[np.ndarray] = None,
+        signatures: Optional[np.ndarray] = None
+    ) -> None:
+        """
+        Append several chunks. Chunk IDs must be strictly increasing.
+        param chunk_ids: The IDs of the chunks' vectors in the FAISS index.
+        param texts: The chunk texts.
+        param sources: The files the chunks came from.
+        param pages: The page numbers the chunks came from.
+        param vectors: Their float32 embeddings, given for every batch of a store or none.
+        param signatures: Their MinHash signatures, given for every batch of a store or none.
+        """
+        if not chunk_ids:
+            return
+        ids = np.asarray(chunk_ids, dtype=np.int64)
+        if ids[0] <= self._last_id or np.any(np.diff(ids) <= 0):
+            raise ValueError("Chunk IDs must be appended in strictly increasing order")
+        if (vectors is not None) != (self.dimension is not None) and self.count:
+            raise ValueError("Vectors must be appended with every chunk of a store or with none")
+        if vectors is not None:
+            if self._vectors is None:
+                self.dimension = int(vectors.shape[1])
+                self._vectors = open(self.store_dir / "vectors.bin", "wb")
+            self._vectors.write(np.asarray(vectors, dtype=np.float32).tobytes())
+        if (signatures is not None) != (self.num_perm is not None) and self.count:
+            raise ValueError("Signatures must be appended with every chunk of a store or with none")
+        if signatures is not None:
+            if self._signatures is None:
+                self.num_perm = int(signatures.shape[1])
+                self._signatures = open(self.store_dir / "minhash.bin", "wb")
+            self._signatures.write(np.asarray(signatures, dtype=np.uint32).tobytes())
+
+        offsets = []
+        for text in texts:
+            encoded = text.encode("utf-8")
+            self._text.write(encoded)
+            self._text_bytes += len(encoded)
+            offsets.append(self._text_bytes)
+
+        codes = [self._source_code(source) for source in sources]
+        self._write("offsets", offsets)
+        self._write("ids", ids)
+        self._write("source", codes)
+        self._write("page", [-1 if page is None else page for page in pages])
+        self._last_id = int(ids[-1])
+        self.count += len(ids)
+
+    def append_documents(
+        self,
+        documents: List[any],
+        chunk_ids: List[int],
+        vectors: Optional[np.ndarray] = None,
+        signatures: Optional[np.ndarray] = None
+    ) -> None:
+        """
+        Append LangChain documents produced by the PDF splitter.
+        param documents: The documents.
+        param chunk_ids: The IDs of the documents' vectors in the FAISS index.
+        param vectors: Their float32 embeddings, to keep for exact re-ranking.
+        param signatures: Their MinHash signatures, to deduplicate later chunks against.
+        """
+        self.append_batch(
+            list(chunk_ids),
+            [doc.page_content for doc in documents],
+            [str(doc.metadata.get("source", "")) for doc in documents],
+            [doc.metadata.get("page") for doc in documents],
+            vectors,
+            signatures,
+        )
+
+    def append_duplicates(self, documents: List[any], chunk_ids: List[int], canonical_ids: List[int]) -> None:
+        """
+        Record LangChain documents that were merged into other chunks instead of being stored.
+        param documents: The duplicate documents.
+        param chunk_ids: Their IDs, which are never added to the FAISS index.
+        param canonical_ids: The IDs of the chunks each of them was merged into.
+        """
+        self._append_duplicates(
+            chunk_ids,
+            canonical_ids,
+            [self._source_code(str(doc.metadata.get("source", ""))) for doc in documents],
+            [-1 if doc.metadata.get("page") is None else doc.metadata.get("page") for doc in documents],
+        )
+
+    def _append_duplicates(
+        self, chunk_ids: Iterable, canonical_ids: Iterable, codes: Iterable, pages: Iterable
+    ) -> None:
+        """Append rows to the duplicate columns."""
+        values = {"dup_ids": chunk_ids, "dup_of": canonical_ids, "dup_source": codes, "dup_page": pages}
+        for name, column in values.items():
+            column = np.asarray(column, dtype=DUPLICATE_COLUMNS[name])
+            self._duplicates[name].write(column.tobytes())
+        self.duplicate_count += len(column)
+
+    def copy_from(self, store: "ChunkStore", positions: np.ndarray, batch_size: int = 4096) -> None:
+        """
+        Copy rows of an existing store without decoding them to documents.
+        param store: The store to copy from.
+        param positions: Ascending row positions to copy.
+        param batch_size: Number of rows copied per batch.
+        """
+        # Keep the modification times recorded when the rows were first written
+        for code, source in enumerate(store.sources):
+            self._source_mtimes.setdefault(source, store.source_mtimes[code])
+        for start in range(0, len(positions), batch_size):
+            batch = positions[start:start + batch_size]
+            rows = [store.row(position) for position in batch]
+            self.append_batch(
+                [row["chunk_id"] for row in rows],
+                [row["text"] for row in rows],
+                [row["source"] for row in rows],
+                [row["page"] for row in rows],
+                store.vectors[batch] if store.vectors is not None else None,
+                store.minhash[batch] if store.minhash is not None else None,
+            )
+
+    def copy_duplicates(self, store: "ChunkStore", keep: np.ndarray) -> None:
+        """
+        Copy the back-references of an existing store.
+        param store: The store to copy from.
+        param keep: A boolean array selecting the duplicates to copy.
+        """
+        if not store.duplicate_count:
+            return
+        codes = store.duplicate_source_codes[keep]
+        new_codes = {}
+        for code in np.unique(codes).tolist():
+            self._source_mtimes.setdefault(store.sources[code], store.source_mtimes[code])
+            new_codes[code] = self._source_code(store.sources[code])
+        self._append_duplicates(
+            store.duplicate_ids[keep],
+            store.canonical_ids[keep],
+            [new_codes[code] for code in codes.tolist()],
+            store.duplicate_pages[keep],
+        )
+
+    def close(self) -> None:
+        """Flush the columns and write meta.json, which marks the store as complete."""
+        if self._text.closed:
+            return
+        self._text.close()
+        for handle in [*self._columns.values(), *self._duplicates.values()]:
+            handle.close()
+        self._sort_duplicates()
+        if self._vectors is not None:
+            self._vectors.close()
+        if self._signatures is not None:
+            self._signatures.close()
+        sources = sorted(self._sources, key=self._sources.get)
+        meta = {
+            "version": STORE_VERSION,
+            "count": self.count,
+            "dimension": self.dimension,
+            "num_perm": self.num_perm,
+            "duplicates": self.duplicate_count,
+            "duplicates_sorted": True,
+            "sources": sources,
+            "source_mtimes": [self._source_mtimes[source] for source in sources],
+        }
+        with open(self.store_dir / "meta.json", "w", encoding="utf-8") as handle:
+            json.dump(meta, handle)
+
+    def _sort_duplicates(self) -> None:
+        """Rewrite the closed duplicate columns in order of the IDs they were merged into."""
+        if self.duplicate_count < 2:
+            return
+        columns = {
+            name: np.fromfile(self.store_dir / f"{name}.bin", dtype=dtype) for name, dtype in DUPLICATE_COLUMNS.items()
+        }
+        if np.all(columns["dup_of"][:-1] <= columns["dup_of"][1:]):
+            return
+        # A stable sort keeps the duplicates of each chunk in the order they were found
+        order = np.argsort(columns["dup_of"], kind="stable")
+        for name, column in columns.items():
+            column[order].tofile(self.store_dir / f"{name}.bin")
+
+
+class ChunkStore:
+    """Read-only, memory-mapped view of a chunk store."""
+
+    def __init__(self, store_dir: Path):
+        """
+        Constructor for the ChunkStore class.
+        param store_dir: The store directory.
+        Raises: FileNotFoundError: If the store does not exist or is incomplete.
+        """
+        self.store_dir = Path(store_dir)
+        meta_path = self.store_dir / "meta.json"
+        if not meta_path.exists():
+            raise FileNotFoundError(f"Chunk store not found at {self.store_dir}")
+        with open(meta_path, "r", encoding="utf-8") as handle:
+            meta = json.load(handle)
+        if meta.get("version") != STORE_VERSION:
+            raise ValueError(f"Unsupported chunk store version {meta.get('version')} at {self.store_dir}")
+
+        self.count = meta["count"]
+        self.sources: List[str] = meta["sources"]
+        # Stores written before modification times were recorded have none
+        self.source_mtimes: List[Optional[float]] = meta.get("source_mtimes") or [None] * len(self.sources)
+        self.offsets = self._map("offsets.bin", np.int64, self.count + 1)
+        self.ids = self._map("ids.bin", np.int64, self.count)
+        self.source_codes = self._map("source.bin", np.int32, self.count)
+        self.pages = self._map("page.bin", np.int32, self.count)
+        self.text = self._map("text.bin", np.uint8, int(self.offsets[-1]))
+        # Stores written without raw vectors have no dimension
+        self.dimension: Optional[int] = meta.get("dimension")
+        self.vectors: Optional[np.ndarray] = None
+        if self.dimension is not None and self.count:
+            self.vectors = np.memmap(
+                self.store_dir / "vectors.bin", dtype=np.float32, mode="r", shape=(self.count, self.dimension)
+            )
+        # Stores written without deduplication have no signatures and no duplicates
+        self.num_perm: Optional[int] = meta.get("num_perm")
+        self.minhash: Optional[np.ndarray] = None
+        if self.num_perm is not None and self.count:
+            self.minhash = np.memmap(
+                self.store_dir / "minhash.bin", dtype=np.uint32, mode="r", shape=(self.count, self.num_perm)
+            )
+        self.duplicate_count = meta.get("duplicates", 0)
+        self.duplicate_ids = self._map("dup_ids.bin", np.int64, self.duplicate_count)
+        self.canonical_ids = self._map("dup_of.bin", np.int64, self.duplicate_count)
+        self.duplicate_source_codes = self._map("dup_source.bin", np.int32, self.duplicate_count)
+        self.duplicate_pages = self._map("dup_page.bin", np.int32, self.duplicate_count)
+        if self.duplicate_count and not meta.get("duplicates_sorted"):
+            # Stores written before the duplicates were kept sorted are sorted in memory
+            order = np.argsort(self.canonical_ids, kind="stable")
+            self.duplicate_ids = self.duplicate_ids[order]
+            self.canonical_ids = self.canonical_ids[order]
+            self.duplicate_source_codes = self.duplicate_source_codes[order]
+            self.duplicate_pages = self.duplicate_pages[order]
+
+    @classmethod
+    def from_documents_npy(cls, docs_path: Path) -> "ChunkStore":
+        """
+        Read a legacy pickled documents.npy into an in-memory store, leaving the file as it is.
+        Documents without a chunk_id are given their position, as in migrate_documents_npy.
+        Databases are converted on disk by their next ingest or `python -m utils.chunk_store`.
+        param docs_path: Path to the documents.npy file.
+        """
+        documents = np.load(str(docs_path), allow_pickle=True)
+        store = cls.__new__(cls)
+        store.store_dir = Path(docs_path).parent
+        store.count = len(documents)
+        encoded = [doc.page_content.encode("utf-8") for doc in documents]
+        sources = [str(doc.metadata.get("source", "")) for doc in documents]
+        codes: Dict[str, int] = {}
+        store.source_codes = np.array([codes.setdefault(source, len(codes)) for source in sources], dtype=np.int32)
+        store.sources = list(codes)
+        store.source_mtimes = [None] * len(store.sources)
+        store.offsets = np.concatenate([[0], np.cumsum([len(text) for text in encoded])]).astype(np.int64)
+        store.ids = np.array(
+            [doc.metadata.get("chunk_id", position) for position, doc in enumerate(documents)], dtype=np.int64
+        )
+        store.pages = np.array(
+            [-1 if doc.metadata.get("page") is None else doc.metadata["page"] for doc in documents], dtype=np.int32
+        )
+        store.text = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        store.dimension, store.vectors = None, None
+        store.num_perm, store.minhash = None, None
+        store.duplicate_count = 0
+        store.duplicate_ids = np.zeros(0, dtype=np.int64)
+        store.canonical_ids = np.zeros(0, dtype=np.int64)
+        store.duplicate_source_codes = np.zeros(0, dtype=np.int32)
+        store.duplicate_pages = np.zeros(0, dtype=np.int32)
+        return store
+
+    def _map(self, name: str, dtype: np.dtype, count: int) -> np.ndarray:
+        """Memory-map a column file; empty columns cannot be mapped."""
+        if count == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(self.store_dir / name, dtype=dtype, mode="r", shape=(count,))
+
+    def __len__(self) -> int:
+        return self.count
+
+    def lookup(self, ids: np.ndarray) -> np.ndarray:
+        """
+        Map index IDs to row positions.
+        param ids: IDs returned by an index search.
+        Returns: The row positions, with -1 where an ID is unknown.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        if self.count == 0:
+            return np.full(ids.shape, -1, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.ids, ids), self.count - 1)
+        found = (ids >= 0) & (self.ids[positions] == ids)
+        return np.where(found, positions, -1)
+
+    def chunk_text(self, position: int) -> str:
+        """Returns the text of the chunk at a row position."""
+        start, end = self.offsets[position], self.offsets[position + 1]
+        return bytes(self.text[start:end]).decode("utf-8")
+
+    def row(self, position: int) -> Dict[str, any]:
+        """Returns all columns of the chunk at a row position."""
+        page = int(self.pages[position])
+        return {
+            "chunk_id": int(self.ids[position]),
+            "text": self.chunk_text(position),
+            "source": self.sources[self.source_codes[position]],
+            "page": None if page < 0 else page,
+        }
+
+    def references(self, position: int) -> List[Dict[str, any]]:
+        """
+        Returns where the chunk at a row position occurs: its own chunk ID, source and page,
+        followed by those of every near-duplicate that was merged into it.
+        """
+        chunk_id = self.ids[position]
+        duplicates = slice(
+            np.searchsorted(self.canonical_ids, chunk_id, side="left"),
+            np.searchsorted(self.canonical_ids, chunk_id, side="right"),
+        )
+        chunk_ids = [int(self.ids[position])] + self.duplicate_ids[duplicates].tolist()
+        codes = [int(self.source_codes[position])] + self.duplicate_source_codes[duplicates].tolist()
+        pages = [int(self.pages[position])] + self.duplicate_pages[duplicates].tolist()
+        return [
+            {"chunk_id": chunk_id, "source": self.sources[code], "page": None if page < 0 else page}
+            for chunk_id, code, page in zip(chunk_ids, codes, pages)
+        ]
+
+
+def replace_store(tmp_dir: Path, store_dir: Path) -> None:
+    """
+    Move a freshly written store into place, replacing any existing store.
+    Readers that still have the old files mapped keep a valid view of them.
+    param tmp_dir: The directory the new store was written to.
+    param store_dir: The final store directory.
+    """
+    old_dir = Path(f"{store_dir}.old")
+    if old_dir.exists():
+        shutil.rmtree(old_dir)
+    if store_dir.exists():
+        os.replace(store_dir, old_dir)
+    os.replace(tmp_dir, store_dir)
+    if old_dir.exists():
+        shutil.rmtree(old_dir)
+
+
+def migrate_documents_npy(docs_path: Path, store_dir: Path, remove_source: bool = True) -> None:
+    """
+    One-shot conversion of a pickled documents.npy into a chunk store.
+    Documents without a chunk_id are given their position, matching how
+    databases built before chunk IDs were introduced were indexed.
+    param docs_path: Path to the documents.npy file.
+    param store_dir: The chunk store directory to create.
+    param remove_source: Delete documents.npy once the store is written.
+    """
+    docs_path, store_dir = Path(docs_path), Path(store_dir)
+    documents = np.load(str(docs_path), allow_pickle=True)
+    chunk_ids = [doc.metadata.get("chunk_id", position) for position, doc in enumerate(documents)]
+
+    tmp_dir = Path(f"{store_dir}.tmp")
+    if tmp_dir.exists():
+        shutil.rmtree(tmp_dir)
+    with ChunkStoreWriter(tmp_dir) as writer:
+        writer.append_documents(list(documents), chunk_ids)
+    replace_store(tmp_dir, store_dir)
+    logger.info(f"Migrated {len(documents)} document(s) from {docs_path} to {store_dir}")
+
+    if remove_source:
+        docs_path.unlink()
+
+
+if __name__ == "__main__":
+    # Usage: python -m utils.chunk_store <db_folder> [docs_file] [store_dir]
+    db_folder = Path(sys.argv[1] if len(sys.argv) > 1 else "database/faiss_db")
+    docs_file = sys.argv[2] if len(sys.argv) > 2 else "documents.npy"
+    store_name = sys.argv[3] if len(sys.argv) > 3 else "chunks"
+    migrate_documents_npy(db_folder / docs_file, db_folder / store_name)
@@ -0,0 +1,142 @@
+"""
+Measures recall against exact search and memory per vector for each way of storing vectors,
+so the [index] storage, pq_m and rerank settings can be chosen with data.
+"""
+import time
+from dataclasses import replace
+from typing import Dict, List, Optional
+import faiss
+import numpy as np
+from loguru import logger
+from utils.index_factory import IndexSpec, build_index, rerank_exact, search_parameters
+from utils.index_registry import IndexRegistry
+
+
+def database_vectors(registry: IndexRegistry, db_path: str) -> np.ndarray:
+    """
+    Returns the float32 vectors of every shard of a database, from the raw
+    vectors in the chunk store or, failing that, reconstructed from a float32 index.
+    param registry: The index registry.
+    param db_path: Path to the FAISS database directory.
+    Raises: ValueError: If the database is empty or a shard keeps neither raw nor float32 vectors.
+    """
+    vectors = []
+    for shard in registry.get_shards(db_path):
+        if shard.store.vectors is not None:
+            vectors.append(np.asarray(shard.store.vectors))
+        elif shard.spec.storage == "float32" and shard.spec.index_type in ("flat", "hnsw_flat"):
+            vectors.append(shard.index.reconstruct_n(0, shard.index.ntotal))
+        else:
+            raise ValueError(
+                f"The {shard.spec.index_type} index at {db_path} is compressed and has no raw vectors; "
+                "rebuild it with raw_vectors = true"
+            )
+    if not vectors:
+        raise ValueError(f"The database at {db_path} has no vectors")
+    return np.concatenate(vectors)
+
+
+def storage_options(spec: IndexSpec, dimension: int) -> List[IndexSpec]:
+    """
+    Returns the storage variants of a spec worth comparing: float32, float16,
+    int8 and, for flat indexes, PQ with every usual pq_m that divides the dimension.
+    param spec: The spec the variants are derived from.
+    param dimension: The embedding dimension.
+    """
+    if spec.index_type == "ivf_pq":
+        return [replace(spec, pq_m=pq_m) for pq_m in (8, 16, 32, 48, 64) if dimension % pq_m == 0]
+    options = [replace(spec, storage=storage) for storage in ("float32", "float16", "int8")]
+    if spec.index_type == "flat":
+        options += [
+            replace(spec, storage="pq", pq_m=pq_m) for pq_m in (8, 16, 32, 48, 64) if dimension % pq_m == 0
+        ]
+    return options
+
+
+def compression_report(
+    vectors: np.ndarray,
+    queries: np.ndarray,
+    specs: List[IndexSpec],
+    k: int = 10,
+    rerank: int = 0
+) -> List[Dict[str, any]]:
+    """
+    Build each spec over the vectors and compare its top k with exact search.
+    param vectors: The corpus vectors.
+    param queries: The query vectors.
+    param specs: The index specs to compare, all with the metric the vectors were built for.
+    param k: Number of neighbours compared.
+    param rerank: Also measure recall after re-ranking this many candidates exactly, 0 to skip.
+    Returns: One row per spec with its bytes per vector, recall@k and mean query latency.
+    """
+    metric = specs[0].metric
+    if metric == "cosine":
+        queries = queries.copy()
+        faiss.normalize_L2(queries)
+    exact = faiss.IndexFlat(vectors.shape[1], specs[0].faiss_metric)
+    exact.add(vectors)  #pylint: disable=E1120
+    _, truth = exact.search(queries, k)  #pylint: disable=E1120
+
+    def recall(found: np.ndarray) -> float:
+        return float(np.mean([len(set(row) & set(expected)) / k for row, expected in zip(found, truth)]))
+
+    ids = np.arange(len(vectors), dtype=np.int64)
+    rng = np.random.default_rng(0)
+    report = []
+    for spec in specs:
+        training = None
+        if spec.needs_training:
+            training = vectors[rng.choice(len(vectors), min(spec.train_size, len(vectors)), replace=False)]
+        index = build_index(spec, vectors.shape[1], training)
+        index.add_with_ids(vectors, ids)  #pylint: disable=E1120
+        params = search_parameters(spec)
+
+        start = time.perf_counter()
+        _, found = index.search(queries, k, params=params)
+        elapsed = time.perf_counter() - start
+        row = {
+            "index_type": spec.index_type,
+            "storage": spec.storage,
+            "pq_m": spec.pq_m if spec.storage == "pq" or spec.index_type == "ivf_pq" else None,
+            "bytes_per_vector": len(faiss.serialize_index(index)) / len(vectors),
+            "recall": recall(found),
+            "query_ms": 1000 * elapsed / len(queries),
+        }
+        if rerank:
+            start = time.perf_counter()
+            _, candidates = index.search(queries, max(k, rerank), params=params)
+            _, reranked = rerank_exact(vectors, queries, candidates, k, metric)
+            row["rerank"] = rerank
+            row["recall_reranked"] = recall(reranked)
+            row["query_ms_reranked"] = 1000 * (time.perf_counter() - start) / len(queries)
+        logger.info(f"{spec.index_type}/{spec.storage}: recall@{k} {row['recall']:.3f}")
+        report.append(row)
+    return report
+
+
+def format_report(report: List[Dict[str, any]], k: int, vector_count: Optional[int] = None) -> str:
+    """
+    Render a report as a plain-text table.
+    param report: Rows from compression_report.
+    param k: Number of neighbours compared.
+    param vector_count: Corpus size, to project the index size.
+    """
+    header = f"{'index':<10} {'storage':<8} {'pq_m':>4} {'bytes/vec':>9} {'recall@' + str(k):>9}"
+    if vector_count:
+        header += f" {'index MB':>9}"
+    header += f" {'ms/query':>9}"
+    if report and "rerank" in report[0]:
+        header += f" {'reranked':>9} {'ms/query':>9}"
+    lines = [header, "-" * len(header)]
+    for row in report:
+        line = (
+            f"{row['index_type']:<10} {row['storage']:<8} {row['pq_m'] or '':>4} "
+            f"{row['bytes_per_vector']:>9.1f} {row['recall']:>9.3f}"
+        )
+        if vector_count:
+            line += f" {row['bytes_per_vector'] * vector_count / (1024 * 1024):>9.1f}"
+        line += f" {row['query_ms']:>9.3f}"
+        if "rerank" in row:
+            line += f" {row['recall_reranked']:>9.3f} {row['query_ms_reranked']:>9.3f}"
+        lines.append(line)
+    return "\n".join(lines)
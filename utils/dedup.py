@@ -0,0 +1,135 @@
+"""
+Near-duplicate detection for chunks with MinHash signatures and locality-sensitive hashing.
+
+Revisions of the same document produce chunks that differ in a few words. A chunk's text is
+lowercased and cut into overlapping word shingles; its MinHash signature holds, for each of
+num_perm random hash functions, the smallest hash of any shingle, so the fraction of equal
+entries in two signatures estimates the Jaccard similarity of their shingle sets. Signatures
+are cut into bands, and only chunks that share a whole band are compared, so looking up the
+duplicates of a chunk costs O(bands) rather than a pass over every chunk.
+"""
+import re
+import zlib
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+
+# Hashes are reduced modulo a prime below 2**31, so a * x + b cannot overflow 64 bits
+PRIME = (1 << 31) - 1
+# The signature of a text without words; it is never a duplicate of anything
+EMPTY = np.uint32(PRIME)
+SEED = 1
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def lsh_bands(num_perm: int, threshold: float) -> Tuple[int, int]:
+    """
+    Choose how to cut signatures into bands. Two chunks are compared when they share a band,
+    which becomes likely above a similarity of about (1 / bands) ** (1 / rows); the highest
+    such value not above the threshold is chosen, so few duplicates are missed.
+    param num_perm: The signature length.
+    param threshold: The similarity above which chunks are duplicates.
+    Returns: The number of bands and of rows per band.
+    """
+    options = [(bands, num_perm // bands) for bands in range(1, num_perm + 1) if num_perm % bands == 0]
+    below = [option for option in options if (1 / option[0]) ** (1 / option[1]) <= threshold]
+    return max(below, key=lambda option: (1 / option[0]) ** (1 / option[1])) if below else options[-1]
+
+
+class ChunkDeduplicator:
+    """
+    Finds, for each chunk, an earlier chunk it nearly repeats. Chunks that are not
+    duplicates are inserted and become the canonical chunk of later duplicates.
+    """
+
+    def __init__(self, threshold: float = 0.8, num_perm: int = 64, shingle_words: int = 3):
+        """
+        Constructor for the ChunkDeduplicator class.
+        param threshold: Estimated Jaccard similarity of two chunks' shingles above which
+            the later chunk is a duplicate.
+        param num_perm: Number of hash functions, the length of a signature.
+        param shingle_words: Number of words per shingle.
+        Raises: ValueError: If the threshold is not in (0, 1] or num_perm is not positive.
+        """
+        if not 0 < threshold <= 1:
+            raise ValueError(f"The dedup threshold must be in (0, 1], got {threshold}")
+        if num_perm < 1:
+            raise ValueError(f"num_perm must be positive, got {num_perm}")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_words = shingle_words
+        self.bands, self.rows = lsh_bands(num_perm, threshold)
+        # Always the same hash functions, so signatures stored with a database stay comparable
+        rng = np.random.default_rng(SEED)
+        self._a = rng.integers(1, PRIME, size=(num_perm, 1), dtype=np.uint64)
+        self._b = rng.integers(0, PRIME, size=(num_perm, 1), dtype=np.uint64)
+        self._buckets: List[Dict[int, List[int]]] = [{} for _ in range(self.bands)]
+        self._ids: List[int] = []
+        self._signatures: List[np.ndarray] = []
+
+    def settings(self) -> Dict[str, any]:
+        """The parameters that decide which chunks are duplicates."""
+        return {"threshold": self.threshold, "num_perm": self.num_perm, "shingle_words": self.shingle_words}
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def signature(self, text: str) -> np.ndarray:
+        """
+        Compute the MinHash signature of a text.
+        param text: The chunk text.
+        Returns: num_perm uint32 values, all EMPTY for a text without words.
+        """
+        words = WORD_PATTERN.findall(text.lower())
+        if not words:
+            return np.full(self.num_perm, EMPTY, dtype=np.uint32)
+        count = max(len(words) - self.shingle_words + 1, 1)
+        hashes = np.fromiter(
+            (zlib.crc32(" ".join(words[start:start + self.shingle_words]).encode("utf-8")) for start in range(count)),
+            dtype=np.uint64, count=count
+        ) % PRIME
+        return ((self._a * hashes + self._b) % PRIME).min(axis=1).astype(np.uint32)
+
+    def _band_keys(self, signature: np.ndarray) -> List[int]:
+        """Returns the bucket of the signature in each band."""
+        return [hash(signature[band * self.rows:(band + 1) * self.rows].tobytes()) for band in range(self.bands)]
+
+    def find(self, signature: np.ndarray) -> Optional[int]:
+        """
+        Look up the inserted chunk a signature is most similar to.
+        param signature: The signature of a chunk.
+        Returns: The ID of that chunk if it is a duplicate, otherwise None.
+        """
+        if signature[0] == EMPTY:
+            return None
+        candidates = set()
+        for buckets, key in zip(self._buckets, self._band_keys(signature)):
+            candidates.update(buckets.get(key, ()))
+        best, best_similarity = None, self.threshold
+        for row in candidates:
+            similarity = float(np.count_nonzero(self._signatures[row] == signature)) / self.num_perm
+            if similarity >= best_similarity:
+                best, best_similarity = row, similarity
+        return None if best is None else self._ids[best]
+
+    def insert(self, chunk_id: int, signature: np.ndarray) -> None:
+        """
+        Make a chunk a candidate canonical chunk for later ones.
+        param chunk_id: The ID of the chunk.
+        param signature: Its signature.
+        """
+        if signature[0] == EMPTY:
+            return
+        row = len(self._ids)
+        self._ids.append(int(chunk_id))
+        self._signatures.append(signature)
+        for buckets, key in zip(self._buckets, self._band_keys(signature)):
+            buckets.setdefault(key, []).append(row)
+
+    def insert_many(self, chunk_ids: Iterable[int], signatures: np.ndarray) -> None:
+        """
+        Insert the chunks already in a database, from their stored signatures.
+        param chunk_ids: The IDs of the chunks.
+        param signatures: Their signatures, one row per chunk.
+        """
+        for chunk_id, signature in zip(chunk_ids, np.asarray(signatures, dtype=np.uint32)):
+            self.insert(chunk_id, signature)
@@ -0,0 +1,286 @@
+"""
+On-disk cache of chunk embeddings keyed by model name and the SHA-256 of the chunk text.
+
+Each model has its own directory holding:
+    keys.bin       - 32-byte SHA-256 digests, one per row
+    vectors.bin    - float32 embeddings, one row per key, memory-mapped for reads
+    last_used.bin  - int64 session counter of the last run that used each row
+    meta.json      - model name, dimension, row count and session counter
+
+New rows are appended as they are embedded, vectors before their keys, so an
+interrupted run can leave vectors without keys but never keys without vectors.
+When the cache grows past its size limit, the least recently used rows are
+dropped on close.
+
+Several processes may share a cache folder, e.g. an ingest from the Upload page and
+a background job for another database. One of them at a time holds the writer lock
+for the whole run; the others use the cache read-only, as it was when they opened it.
+Opening and rewriting the files is serialized by a second, shared/exclusive lock.
+"""
+import hashlib
+import json
+import os
+import re
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+import numpy as np
+from loguru import logger
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+KEY_BYTES = 32
+# Shrink to this fraction of the limit when evicting, so eviction is not triggered every run
+EVICTION_TARGET = 0.9
+
+
+def text_digest(text: str) -> bytes:
+    """Returns the SHA-256 digest of a chunk text."""
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+
+class EmbeddingCache:
+    """Persistent embedding cache for one model."""
+
+    def __init__(self, cache_folder: str, model_name: str, max_size_mb: float = 0):
+        """
+        Constructor for the EmbeddingCache class.
+        param cache_folder: Folder holding the caches of all models.
+        param model_name: The embedding model the vectors were produced by.
+        param max_size_mb: Size limit of this model's cache, 0 for no limit.
+        """
+        self.model_name = model_name
+        self.cache_dir = Path(cache_folder) / re.sub(r"[^A-Za-z0-9_.-]", "__", model_name)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = int(max_size_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+
+        # Held until close; without it the cache is only read
+        self._writer_lock = open(self.cache_dir / "writer.lock", "ab")  # pylint: disable=consider-using-with
+        self.read_only = not self._try_lock(self._writer_lock)
+        if self.read_only:
+            logger.warning(f"The embedding cache at {self.cache_dir} is being written by another process, "
+                           "using it read-only")
+
+        with self._files_lock(exclusive=not self.read_only):
+            meta = self._read_meta()
+            self.dimension: Optional[int] = meta.get("dimension")
+            self.session = meta.get("session", 0) + 1
+            self.count = self._recover_count()
+
+            self._rows: Dict[bytes, int] = {}
+            self._vectors: Optional[np.ndarray] = None
+            if self.count:
+                keys = np.fromfile(self.cache_dir / "keys.bin", dtype=np.uint8, count=self.count * KEY_BYTES)
+                self._rows = {key.tobytes(): row for row, key in enumerate(keys.reshape(-1, KEY_BYTES))}
+                if self.read_only:
+                    # Mapped now, so a later eviction by the writer cannot pair these keys with other vectors
+                    self._vectors = self._mapped_vectors(self.count)
+
+        # Grown geometrically as rows are appended; only the first count entries are valid
+        self._last_used = np.zeros(self.count, dtype=np.int64)
+        if (self.cache_dir / "last_used.bin").exists():
+            stored = np.fromfile(self.cache_dir / "last_used.bin", dtype=np.int64)[:self.count]
+            self._last_used[:len(stored)] = stored
+
+        self._keys_file = None if self.read_only else open(self.cache_dir / "keys.bin", "ab")
+        self._vectors_file = None if self.read_only else open(self.cache_dir / "vectors.bin", "ab")
+        self._closed = False
+
+    def __enter__(self) -> "EmbeddingCache":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    @staticmethod
+    def _try_lock(handle: any) -> bool:
+        """Take an exclusive lock on a file without waiting; always succeeds without file locks."""
+        if fcntl is None:
+            return True
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            return False
+
+    @contextmanager
+    def _files_lock(self, exclusive: bool) -> Iterator[None]:
+        """Hold a lock that keeps the writer from rewriting the files while a reader opens them."""
+        with open(self.cache_dir / "files.lock", "ab") as handle:
+            if fcntl is not None:
+                fcntl.flock(handle, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+
+    def _read_meta(self) -> Dict[str, any]:
+        """Returns the stored metadata, or an empty dict for a new cache."""
+        meta_path = self.cache_dir / "meta.json"
+        if not meta_path.exists():
+            return {}
+        with open(meta_path, "r", encoding="utf-8") as handle:
+            return json.load(handle)
+
+    def _recover_count(self) -> int:
+        """
+        Returns the number of complete rows. The writer truncates rows left
+        half written by an interrupted run.
+        """
+        if self.dimension is None:
+            if not self.read_only:
+                for name in ("keys.bin", "vectors.bin", "last_used.bin"):
+                    (self.cache_dir / name).unlink(missing_ok=True)
+            return 0
+        keys_path, vectors_path = self.cache_dir / "keys.bin", self.cache_dir / "vectors.bin"
+        key_rows = keys_path.stat().st_size // KEY_BYTES if keys_path.exists() else 0
+        vector_rows = vectors_path.stat().st_size // (4 * self.dimension) if vectors_path.exists() else 0
+        count = min(key_rows, vector_rows)
+        if self.read_only:
+            return count
+        if keys_path.exists():
+            os.truncate(keys_path, count * KEY_BYTES)
+        if vectors_path.exists():
+            os.truncate(vectors_path, count * 4 * self.dimension)
+        return count
+
+    def _mapped_vectors(self, needed_rows: int) -> np.ndarray:
+        """Returns the vectors memory map, remapping it if rows were appended since."""
+        if self._vectors is None or len(self._vectors) < needed_rows:
+            self._vectors = np.memmap(
+                self.cache_dir / "vectors.bin", dtype=np.float32, mode="r", shape=(self.count, self.dimension)
+            )
+        return self._vectors
+
+    def get(self, digests: List[bytes]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Look up embeddings by text digest.
+        param digests: Digests from text_digest.
+        Returns: The positions in digests that were found, and their vectors.
+        """
+        found = [(position, self._rows[digest]) for position, digest in enumerate(digests) if digest in self._rows]
+        self.hits += len(found)
+        self.misses += len(digests) - len(found)
+        if not found:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, self.dimension or 0), dtype=np.float32)
+
+        positions = np.array([position for position, _ in found], dtype=np.int64)
+        rows = np.array([row for _, row in found], dtype=np.int64)
+        self._last_used[rows] = self.session
+        return positions, np.asarray(self._mapped_vectors(int(rows.max()) + 1)[rows])
+
+    def put(self, digests: List[bytes], vectors: np.ndarray) -> None:
+        """
+        Append embeddings to the cache. Digests already cached are skipped, and nothing
+        is written by a read-only cache.
+        param digests: Digests from text_digest.
+        param vectors: The float32 embeddings, one row per digest.
+        """
+        if self.read_only:
+            return
+        if self.dimension is None:
+            self.dimension = int(vectors.shape[1])
+        new_keys, new_rows = [], []
+        for digest, vector in zip(digests, vectors):
+            if digest in self._rows:
+                continue
+            self._rows[digest] = self.count + len(new_rows)
+            new_keys.append(digest)
+            new_rows.append(vector)
+        if not new_rows:
+            return
+        # Vectors reach the file before their keys, so every key read back has its vector
+        self._vectors_file.write(np.asarray(new_rows, dtype=np.float32).tobytes())
+        self._vectors_file.flush()
+        self._keys_file.write(b"".join(new_keys))
+        self._keys_file.flush()
+
+        if len(self._last_used) < self.count + len(new_rows):
+            grown = np.zeros(max(2 * len(self._last_used), self.count + len(new_rows)), dtype=np.int64)
+            grown[:self.count] = self._last_used[:self.count]
+            self._last_used = grown
+        self._last_used[self.count:self.count + len(new_rows)] = self.session
+        self.count += len(new_rows)
+
+    @property
+    def size_bytes(self) -> int:
+        """Bytes used by the cached keys and vectors."""
+        return self.count * (KEY_BYTES + 4 * (self.dimension or 0) + 8)
+
+    def stats(self) -> Dict[str, any]:
+        """Returns the hit and miss counts of this session and the cache size."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": self.count,
+            "size_bytes": self.size_bytes,
+        }
+
+    def evict(self) -> int:
+        """
+        Drop the least recently used rows until the cache fits its size limit.
+        Returns: The number of rows dropped.
+        """
+        if self.read_only or not self.max_bytes or self.size_bytes <= self.max_bytes:
+            return 0
+        row_bytes = self.size_bytes // self.count
+        keep_count = int(self.max_bytes * EVICTION_TARGET) // row_bytes
+        # Most recently used first; the stable sort keeps older rows ahead within a session
+        keep = np.sort(np.argsort(-self._last_used[:self.count], kind="stable")[:keep_count])
+
+        self._keys_file.close()
+        self._vectors_file.close()
+        keys = np.fromfile(self.cache_dir / "keys.bin", dtype=np.uint8).reshape(-1, KEY_BYTES)[keep]
+        vectors = np.asarray(self._mapped_vectors(self.count)[keep])
+        self._vectors = None
+
+        with self._files_lock(exclusive=True):
+            for name, data in (("vectors.bin", vectors), ("keys.bin", keys)):
+                tmp_path = self.cache_dir / f"{name}.tmp"
+                data.tofile(tmp_path)
+                os.replace(tmp_path, self.cache_dir / name)
+
+        dropped = self.count - len(keep)
+        self.count = len(keep)
+        self._last_used = self._last_used[keep]
+        self._rows = {key.tobytes(): row for row, key in enumerate(keys)}
+        self._keys_file = open(self.cache_dir / "keys.bin", "ab")
+        self._vectors_file = open(self.cache_dir / "vectors.bin", "ab")
+        logger.info(f"Evicted {dropped} embedding(s) from the cache at {self.cache_dir}")
+        return dropped
+
+    def close(self) -> None:
+        """
+        Evict if over the size limit, then persist usage and metadata and release the writer lock.
+        A read-only cache only releases its files.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._vectors = None
+        if not self.read_only:
+            self.evict()
+            self._keys_file.close()
+            self._vectors_file.close()
+            with self._files_lock(exclusive=True):
+                self._last_used[:self.count].tofile(self.cache_dir / "last_used.bin")
+                meta = {
+                    "model_name": self.model_name, "dimension": self.dimension,
+                    "count": self.count, "session": self.session,
+                }
+                tmp_path = self.cache_dir / "meta.json.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as handle:
+                    json.dump(meta, handle)
+                os.replace(tmp_path, self.cache_dir / "meta.json")
+        self._writer_lock.close()
+
+        stats = self.stats()
+        logger.info(
+            f"Embedding cache: {stats['hits']} hit(s), {stats['misses']} miss(es) "
+            f"({stats['hit_rate']:.1%} hit rate), {stats['entries']} entries, "
+            f"{stats['size_bytes'] / (1024 * 1024):.1f} MB"
+        )
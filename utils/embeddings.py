@@ -1,16 +1,28 @@
 """
 Utility functions for handling document embeddings and FAISS database operations.
 """
-from typing import List
+from contextlib import ExitStack, nullcontext
+from typing import Callable, ContextManager, Dict, Iterable, List, Optional
 import os
 import shutil
 from pathlib import Path
 import faiss
 import numpy as np
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_community.embeddings import HuggingFaceEmbeddings
 from loguru import logger
+from app_config import DEFAULT_CONFIG_FILE, ConfigLoader
+from utils.bm25_index import BM25Index, build_bm25_index
+from utils.chunk_store import ChunkStore, ChunkStoreWriter, migrate_documents_npy, replace_store
+from utils.dedup import ChunkDeduplicator
+from utils.embedding_cache import EmbeddingCache, text_digest
+from utils.generations import GenerationStore
+from utils.index_factory import IndexSpec, build_index, remove_ids
+from utils.manifest import IndexManifest, ManifestDiff
+from utils.model_registry import backend_label, get_embedding_model, model_key
+from utils.pdf_extraction import get_extractor
+from utils.pdf_parsing import parse_pdfs, split_pages
+from utils.sharding import ShardLayout
+from utils.telemetry import Trace, get_telemetry
 
 class DocumentEmbedder:
     """Handles document embedding and FAISS database operations."""
@@ -20,7 +32,10 @@ class DocumentEmbedder:
         chunk_size: int = 1000,
         chunk_overlap: int = 200,
         model_name: str = "all-MiniLM-L6-v2",
-        cfg: dict[str, any] = None
+        cfg: dict[str, any] = None,
+        device: str = "cpu",
+        pdf_backend: Optional[str] = None,
+        backend: Optional[str] = None
     ):
         """
         Initialize the document embedder.
@@ -29,17 +44,32 @@ class DocumentEmbedder:
             chunk_size: Size of text chunks
             chunk_overlap: Overlap between chunks
             model_name: HuggingFace model name for embeddings
+            cfg: The application configuration, defaults to the one in config/config.toml
+            device: The device to run the embedding model on
+            pdf_backend: PDF text extraction backend, defaults to [ingest] pdf_backend
+            backend: The runtime of the embedding model, 'torch' or 'onnx', defaults to [embeddings] backend
         """
+        if cfg is None:
+            cfg = ConfigLoader(DEFAULT_CONFIG_FILE).load_config()
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name=model_name,
-            model_kwargs={'device': 'cpu'}
-        )
+        self.model_name = model_name
+        self.backend = backend or cfg["embeddings"]["backend"]
+        self.embeddings = get_embedding_model(model_name, device, self.backend, cfg["onnx"])
+        self.model_key = model_key(model_name, self.backend, cfg["onnx"])
 
         self.cfg = cfg
+        self.telemetry = get_telemetry(**cfg["telemetry"])
+        self.pdf_backend = pdf_backend or cfg["ingest"]["pdf_backend"]
+        self.extractor = get_extractor(self.pdf_backend)
+        # Fails early on invalid [dedup] settings
+        self.new_deduplicator()
         logger.info(f"The model being used to create embeddings is {model_name}.")
-        logger.info("The device being used to create embeddings is cpu.")       
+        logger.info(f"The device being used to create embeddings is {device}.")
+        logger.info(f"The runtime being used to create embeddings is {self.backend}.")
+        logger.info(f"The backend being used to extract PDF text is {self.pdf_backend}.")
+        if self.cfg["dedup"]["enabled"]:
+            logger.info(f"Near-duplicate chunks are merged above a similarity of {self.cfg['dedup']['threshold']}.")
 
         self.text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=chunk_size,
@@ -52,57 +82,615 @@ class DocumentEmbedder:
         pdf_path: Path to the PDF file   
         Returns: List of text chunks
         """
-        loader = PyPDFLoader(pdf_path)
-        pages = loader.load()
-        return self.text_splitter.split_documents(pages)
+        return split_pages(self.extractor, self.text_splitter, pdf_path)
 
-    def create_faiss_db(self, folder_path: str, db_path: str) -> None:
+    def index_settings(self) -> dict[str, any]:
+        """
+        The settings that determine the contents of the index.
+        A database built with different settings cannot be updated incrementally.
         """
-        Create a FAISS database from PDFs in a folder.
+        dedup = self.new_deduplicator()
+        return {
+            "model_name": self.model_name,
+            "chunk_size": self.chunk_size,
+            "chunk_overlap": self.chunk_overlap,
+            "pdf_backend": self.pdf_backend,
+            "embedding_backend": backend_label(self.model_name, self.backend, self.cfg["onnx"]),
+            "index": self.index_spec().build_params(),
+            "dedup": dedup.settings() if dedup is not None else None,
+        }
+
+    def new_deduplicator(self) -> Optional[ChunkDeduplicator]:
+        """Returns an empty near-duplicate detector from the [dedup] config section, or None if it is disabled."""
+        dedup_cfg = self.cfg["dedup"]
+        if not dedup_cfg["enabled"]:
+            return None
+        return ChunkDeduplicator(dedup_cfg["threshold"], dedup_cfg["num_perm"], dedup_cfg["shingle_words"])
+
+    def index_spec(self) -> IndexSpec:
+        """The kind of FAISS index to build, from the [index] config section."""
+        return IndexSpec.from_dict(self.cfg["index"])
+
+    def _open_embedding_cache(self) -> ContextManager[Optional[EmbeddingCache]]:
+        """Opens the on-disk embedding cache for this model, or a no-op if it is disabled."""
+        cache_cfg = self.cfg["embedding-cache"]
+        if not cache_cfg["enabled"]:
+            return nullcontext()
+        return EmbeddingCache(cache_cfg["folder"], self.model_key, cache_cfg["max_size_mb"])
+
+    def create_faiss_db(
+        self,
+        folder_path: str,
+        db_path: str,
+        incremental: bool = False,
+        progress: Callable[[int, int], None] = None,
+        shards: Optional[List[int]] = None
+    ) -> None:
+        """
+        Create or update a FAISS database from PDFs in a folder.
+        Chunks are embedded and written in fixed-size batches, so peak memory is
+        bounded by the batch size rather than the size of the corpus. With more
+        than one shard in the [sharding] config section, each shard has its own
+        index, chunk store and manifest and is updated independently. The update is
+        written to a new generation of the database, which replaces the published one
+        atomically once it is complete, so queries are served throughout. Stage timings
+        and counters are recorded as an 'ingest' trace, plus one 'ingest_file' per file.
         param folder_path: Path to folder containing PDFs
         param db_path: Path where FAISS database will be stored
+        param incremental: Only embed new or changed files and remove the chunks of
+            deleted or changed files, instead of rebuilding the whole database.
+        param progress: Called with (files processed, files to process) after each file.
+        param shards: Only update these shards, or None to update all of them.
         """
-        # Remove existing database if it exists
-        if os.path.exists(db_path):
-            shutil.rmtree(db_path)
-            logger.info(f"Removed existing database at {db_path}")
+        with self.telemetry.trace("ingest", db_path=str(db_path), incremental=incremental) as trace:
+            generations = GenerationStore(db_path)
+            staging = generations.create()
+            published = False
+            try:
+                if self._build_generation(
+                    generations, staging.generation_dir, folder_path, incremental, progress, shards, trace
+                ):
+                    with trace.span("publish"):
+                        generations.publish(staging.generation_dir)
+                    published = True
+            finally:
+                if published:
+                    staging.release()
+                else:
+                    generations.discard(staging)
+            if not published:
+                logger.info(f"FAISS database at {db_path} is up to date")
+                return
 
-        all_chunks = []
+            with trace.span("gc"):
+                trace.count("generations_removed", len(generations.collect_garbage()))
+            logger.info(f"Created FAISS database at {db_path}")
+
+    def _build_generation(
+        self,
+        generations: GenerationStore,
+        generation_dir: Path,
+        folder_path: str,
+        incremental: bool,
+        progress: Optional[Callable[[int, int], None]],
+        shards: Optional[List[int]],
+        trace: Trace
+    ) -> bool:
+        """
+        Write a new generation of the database for create_faiss_db. Incremental and
+        per-shard updates start from hard links to the files of the published generation.
+        param generations: The generations of the database.
+        param generation_dir: The new, unpublished generation.
+        Returns: False if the published generation is already up to date.
+        """
+        layout = ShardLayout(generation_dir, self.cfg["sharding"]["shards"], self.cfg["sharding"]["shard_by"])
         embed_file_pattern = self.cfg["pdf-details"]["embed_file_pattern"]
-        pdf_files = Path(folder_path).glob(embed_file_pattern)
+        if not layout.spreads(embed_file_pattern):
+            logger.warning(
+                f"shard_by = 'folder' with embed_file_pattern = '{embed_file_pattern}' puts every file in one "
+                "shard; use a recursive pattern such as '**/*.pdf'"
+            )
+        source = generations.lease_current()
+        source_dir = source.generation_dir if source is not None else generations.db_path
+        try:
+            has_database = source is not None or generations.is_legacy()
+            if has_database and not ShardLayout.load(source_dir).matches(layout):
+                # Files would move between shards, so every shard has to be rebuilt
+                logger.info(f"The shard layout of {generations.db_path} changed, rebuilding the database")
+                incremental, shards = False, None
+            elif has_database and (incremental or shards is not None):
+                with trace.span("clone"):
+                    generations.clone_into(source_dir, generation_dir)
+        finally:
+            if source is not None:
+                source.release()
+        selected = range(layout.shard_count) if shards is None else sorted(set(shards))
+        for shard in selected:
+            if not 0 <= shard < layout.shard_count:
+                raise ValueError(f"Shard {shard} does not exist, the database has {layout.shard_count} shard(s)")
 
-        for pdf_file in pdf_files:
-            try:
-                chunks = self.process_pdf(str(pdf_file))
-                all_chunks.extend(chunks)
+        with trace.span("plan"):
+            files_by_shard = layout.partition(sorted(Path(folder_path).glob(embed_file_pattern)), folder_path)
+            updates = []
+            for shard in selected:
+                update = self._plan_shard(layout.shard_dir(shard), files_by_shard[shard], incremental)
+                if update is not None:
+                    updates.append(update)
+        if not updates:
+            return False
+
+        to_embed = [(update, pdf_file) for update in updates for pdf_file in update.changes.to_embed]
+        with ExitStack() as stack:
+            cache = stack.enter_context(self._open_embedding_cache())
+            batch_size = self.cfg["ingest"]["embed_batch_size"]
+            for update in updates:
+                update.open(stack, self.embeddings, batch_size, cache, trace, self.new_deduplicator())
+
+            workers = self.cfg["ingest"]["workers"]
+            pdf_files = [pdf_file for _, pdf_file in to_embed]
+            parsed = parse_pdfs(pdf_files, self.chunk_size, self.chunk_overlap, workers, self.pdf_backend)
+            for files_done, ((update, _), (pdf_file, chunks, error, stats)) in enumerate(zip(to_embed, parsed), 1):
+                if progress is not None:
+                    progress(files_done, len(to_embed))
+                self._record_file(trace, pdf_file, chunks, error, stats)
+                if error is not None:
+                    logger.error(f"Error processing {pdf_file}: {error}")
+                    continue
+                update.add(pdf_file, chunks)
                 logger.info(f"Processed {pdf_file}")
-            except Exception as e: # pylint: disable=W0718
-                logger.error(f"Error processing {pdf_file}: {str(e)}")
-
-        if not all_chunks:
-            logger.error("No valid chunks were generated from the PDFs")
-            raise ValueError("No valid chunks were generated from the PDFs")
-
-        # Create directory if it doesn't exist   
-        db_folder = self.cfg["databases"]["db_folder"]
-        log_dir = Path(db_folder)
-        log_dir.mkdir(exist_ok=True, parents=True)
-
-        # Create embeddings using the correct method
-        texts = [chunk.page_content for chunk in all_chunks]
-        embeddings = self.embeddings.embed_documents(texts)
-        embeddings_array = np.array(embeddings, dtype=np.float32)
-
-        # Initialize FAISS index
-        dimension = len(embeddings[0])
-        index = faiss.IndexFlatL2(dimension)
-        index.add(embeddings_array)  #pylint: disable=E1120
-        
-        faiss_index = self.cfg["databases"]["faiss_db_index"]
-        
-        faiss.write_index(index, str(Path(db_path) / faiss_index))
 
-        # Save the documents for later retrieval
-        docs = self.cfg["databases"]["docs"]
-        np.save(str(Path(db_path) / docs), all_chunks)
-        logger.info(f"Created FAISS database at {db_path}")
+            for update in updates:
+                update.finish()
+        self._record_savings(trace)
+
+        if sum(update.chunk_count for update in updates) == 0 and len(updates) == layout.shard_count:
+            if not any(update.changes.deleted for update in updates):
+                logger.error("No valid chunks were generated from the PDFs")
+                raise ValueError("No valid chunks were generated from the PDFs")
+            # Every file of the database was deleted; an empty generation replaces the stale one
+            logger.warning(f"No chunks are left in {generations.db_path}, publishing an empty database")
+        for update in updates:
+            update.write_index()
+        for update in updates:
+            update.publish()
+        layout.save()
+        trace.count("shards_updated", len(updates))
+        return True
+
+    @staticmethod
+    def _record_savings(trace: Trace) -> None:
+        """
+        Report the near-duplicate chunks that were not embedded, and estimate the
+        embedding time saved from the average time of the chunks that were.
+        """
+        duplicates = trace.counters.get("duplicates", 0)
+        if not duplicates:
+            return
+        chunks = trace.counters.get("chunks", 0)
+        message = (
+            f"Merged {duplicates} near-duplicate chunk(s) of {chunks} ({100 * duplicates / max(chunks, 1):.1f}%) "
+            "into chunks already indexed"
+        )
+        embedded = trace.counters.get("embedded", 0)
+        if embedded:
+            saved_s = duplicates * trace.stages.get("embed", 0.0) / embedded
+            trace.count("embed_saved_s", saved_s)
+            message += f", saving an estimated {saved_s:.1f}s of embedding"
+        logger.info(message)
+
+    def _record_file(
+        self,
+        trace: Trace,
+        pdf_file: Path,
+        chunks: List[any],
+        error: Optional[str],
+        stats: Dict[str, float]
+    ) -> None:
+        """
+        Add a parsed file to the ingest trace and record it as its own ingest_file event.
+        Loading and splitting run in worker processes, so their stage times add up
+        the time of every worker rather than wall-clock time.
+        """
+        trace.add_time("load", stats["load_s"])
+        trace.add_time("split", stats["split_s"])
+        trace.count("files")
+        trace.count("failed_files", int(error is not None))
+        trace.count("bytes", stats["bytes"])
+        trace.count("pages", stats["pages"])
+        trace.count("chunks", len(chunks))
+        file_trace = self.telemetry.trace("ingest_file", file=str(pdf_file))
+        file_trace.add_time("load", stats["load_s"])
+        file_trace.add_time("split", stats["split_s"])
+        file_trace.count("bytes", stats["bytes"])
+        file_trace.count("pages", stats["pages"])
+        file_trace.count("chunks", len(chunks))
+        file_trace.end(**({"error": error} if error is not None else {}))
+
+    def _plan_shard(self, shard_dir: Path, pdf_files: List[Path], incremental: bool) -> Optional["ShardUpdate"]:
+        """
+        Load a shard and work out which of its files changed.
+        param shard_dir: The directory of the shard.
+        param pdf_files: The source files that belong to the shard.
+        param incremental: Update the shard in place instead of rebuilding it.
+        Returns: The pending update, or None if the shard is up to date.
+        """
+        databases = self.cfg["databases"]
+        index_path = shard_dir / databases["faiss_db_index"]
+        docs_path = shard_dir / databases["docs"]
+        store_dir = shard_dir / databases["chunk_store"]
+        manifest_path = shard_dir / databases["manifest"]
+        settings = self.index_settings()
+
+        manifest = IndexManifest.load(manifest_path) if incremental else None
+        if manifest is not None and "index" in manifest.settings:
+            # Databases recorded before a build parameter existed were built with its default
+            manifest.settings["index"] = IndexSpec.from_dict(manifest.settings["index"]).build_params()
+        if manifest is not None:
+            manifest.settings.setdefault("pdf_backend", "pypdf")
+            manifest.settings.setdefault("embedding_backend", "torch")
+            manifest.settings.setdefault("dedup", None)
+        if manifest is not None and docs_path.exists() and not store_dir.exists():
+            migrate_documents_npy(docs_path, store_dir)
+
+        if manifest is not None and manifest.matches(settings) and index_path.exists() and store_dir.exists():
+            index = faiss.read_index(str(index_path))
+            stored = ChunkStore(store_dir)
+            logger.info(f"Updating existing database at {shard_dir}")
+        else:
+            if incremental and manifest is None:
+                logger.info(f"No manifest at {manifest_path}, rebuilding the database")
+            elif incremental:
+                changed = manifest.changed_settings(settings)
+                reason = f"settings changed ({', '.join(changed)})" if changed else "its files are missing"
+                logger.info(f"Cannot update {shard_dir}, {reason}; rebuilding the database")
+            # Remove the files cloned from the published generation. A single shard lives
+            # in the generation directory itself, which has to keep its lease file
+            for path in (index_path, docs_path, manifest_path, shard_dir / databases["index_spec"]):
+                path.unlink(missing_ok=True)
+            for path in (store_dir, shard_dir / databases["bm25"]):
+                shutil.rmtree(path, ignore_errors=True)
+            manifest = IndexManifest(settings)
+            index = None
+            stored = None
+
+        changes = manifest.diff(pdf_files)
+        if not changes.has_changes:
+            return None
+
+        logger.info(
+            f"{shard_dir}: {len(changes.added)} new, {len(changes.changed)} changed, "
+            f"{len(changes.deleted)} deleted and {len(changes.unchanged)} unchanged file(s)"
+        )
+        return ShardUpdate(shard_dir, databases, self.index_spec(), manifest, changes, index, stored)
+
+
+class ShardUpdate:
+    """
+    The pending update of one shard: its stale chunks are dropped, the chunks
+    it keeps are copied to a new chunk store and new chunks are streamed in.
+    Nothing replaces the shard's files in the new generation until publish.
+    Near-duplicates are only detected within a shard.
+    """
+
+    def __init__(
+        self,
+        shard_dir: Path,
+        databases: dict[str, any],
+        spec: IndexSpec,
+        manifest: IndexManifest,
+        changes: ManifestDiff,
+        index: faiss.Index = None,
+        stored: ChunkStore = None
+    ):
+        """
+        Constructor for the ShardUpdate class.
+        param shard_dir: The directory of the shard.
+        param databases: The [databases] config section, naming the files of the shard.
+        param spec: The kind of index to create when index is None.
+        param manifest: The manifest of the shard.
+        param changes: The difference between the manifest and the shard's files.
+        param index: The existing index, or None when the shard is rebuilt.
+        param stored: The existing chunk store, or None when the shard is rebuilt.
+        """
+        self.shard_dir = shard_dir
+        self.index_path = shard_dir / databases["faiss_db_index"]
+        self.store_dir = shard_dir / databases["chunk_store"]
+        self.manifest_path = shard_dir / databases["manifest"]
+        self.spec_path = shard_dir / databases["index_spec"]
+        self.bm25_dir = shard_dir / databases["bm25"]
+        self.spec = spec
+        self.manifest = manifest
+        self.changes = changes
+        self.index = index
+        self.stored = stored
+        self.chunk_count = 0
+        self.builder: StreamingIndexBuilder = None
+        self.trace = Trace(None, "ingest")
+
+        # Write to temporary files and rename them into place: the shard's current files
+        # may be hard links to those of the published generation, which must not change
+        self.store_tmp_dir = Path(f"{self.store_dir}.tmp")
+        self.index_tmp_path = Path(f"{self.index_path}.tmp")
+        self.bm25_tmp_dir = Path(f"{self.bm25_dir}.tmp")
+
+        if stored is not None and stored.duplicate_count:
+            self._reprocess_orphans()
+        # Drop the chunks of changed and deleted files
+        self.stale_ids = manifest.ids_for(changes.stale)
+        self.keep_positions = np.arange(len(stored) if stored is not None else 0)
+        if self.stale_ids.size:
+            self.index = remove_ids(self.index, self.stale_ids, spec)
+            self.keep_positions = np.flatnonzero(~np.isin(stored.ids, self.stale_ids))
+            logger.info(f"Removed {self.stale_ids.size} stale chunk(s) from {shard_dir}")
+        for key in changes.stale:
+            manifest.remove(key)
+
+    def _reprocess_orphans(self) -> None:
+        """
+        Unchanged files whose near-duplicate chunks were merged into chunks of a changed
+        or deleted file lose them along with that file, so they are re-embedded as well.
+        Their own chunks may stand in for duplicates in yet other files, hence the loop.
+        """
+        duplicate_ids, canonical_ids = self.stored.duplicate_ids, self.stored.canonical_ids
+        reprocessed = 0
+        while True:
+            stale_ids = self.manifest.ids_for(self.changes.stale)
+            orphaned = np.isin(canonical_ids, stale_ids) & ~np.isin(duplicate_ids, stale_ids)
+            if not orphaned.any():
+                break
+            for key in self.manifest.keys_for(duplicate_ids[orphaned]):
+                self.changes.reprocess(key, self.manifest.files[key]["sha256"])
+                reprocessed += 1
+        if reprocessed:
+            logger.info(f"Re-embedding {reprocessed} file(s) of {self.shard_dir} whose duplicate chunks were removed")
+
+    def open(
+        self,
+        stack: ExitStack,
+        embeddings: any,
+        batch_size: int,
+        cache: EmbeddingCache = None,
+        trace: Optional[Trace] = None,
+        dedup: Optional[ChunkDeduplicator] = None
+    ) -> None:
+        """
+        Start the new chunk store, copying the chunks that were kept.
+        param stack: Closes the chunk store writer.
+        param embeddings: The LangChain embeddings model.
+        param batch_size: Number of chunks embedded per call to the model.
+        param cache: Embedding cache consulted before calling the model.
+        param trace: Records the time spent in each stage of the update.
+        param dedup: Drops near-duplicate chunks before they are embedded, or None to keep every chunk.
+        """
+        self.trace = trace or self.trace
+        # Create directory if it doesn't exist
+        self.shard_dir.mkdir(exist_ok=True, parents=True)
+        if self.store_tmp_dir.exists():
+            shutil.rmtree(self.store_tmp_dir)
+        writer = stack.enter_context(ChunkStoreWriter(self.store_tmp_dir))
+        if self.stored is not None:
+            with self.trace.span("copy_kept"):
+                writer.copy_from(self.stored, self.keep_positions)
+                writer.copy_duplicates(self.stored, ~np.isin(self.stored.duplicate_ids, self.stale_ids))
+            if dedup is not None and self.stored.minhash is not None:
+                with self.trace.span("dedup"):
+                    dedup.insert_many(self.stored.ids[self.keep_positions], self.stored.minhash[self.keep_positions])
+        self.builder = StreamingIndexBuilder(
+            embeddings, writer, self.spec, self.index, batch_size, cache, self.trace, dedup
+        )
+
+    def add(self, pdf_file: Path, chunks: List[any]) -> None:
+        """
+        Assign IDs to the chunks of a file and queue them for embedding.
+        param pdf_file: The source file.
+        param chunks: Its LangChain documents.
+        """
+        sha = self.changes.hashes[IndexManifest.key(pdf_file)]
+        id_start = self.manifest.allocate(pdf_file, sha, len(chunks))
+        self.builder.add(chunks, range(id_start, id_start + len(chunks)))
+
+    def finish(self) -> None:
+        """Embed any remaining chunks."""
+        self.index = self.builder.finish()
+        self.chunk_count = self.builder.writer.count
+
+    def write_index(self) -> None:
+        """Write the FAISS and BM25 indexes next to their final paths."""
+        if self.chunk_count:
+            with self.trace.span("write_index"):
+                faiss.write_index(self.index, str(self.index_tmp_path))
+            if self.bm25_tmp_dir.exists():
+                shutil.rmtree(self.bm25_tmp_dir)
+            # The kept chunks lead the new store, so their postings are carried over as they are
+            previous = None
+            if self.stored is not None and (self.bm25_dir / "meta.json").exists():
+                previous = BM25Index(self.bm25_dir)
+                if len(previous) != len(self.stored):
+                    previous = None
+            with self.trace.span("bm25"):
+                build_bm25_index(
+                    ChunkStore(self.store_tmp_dir), self.bm25_tmp_dir, previous=previous, kept=self.keep_positions
+                )
+
+    def publish(self) -> None:
+        """Move the new files into place. A shard left without chunks is removed."""
+        if self.chunk_count == 0:
+            # A single shard lives in the generation directory itself, which has to keep its lease file
+            for path in (self.index_path, self.index_tmp_path, self.spec_path, self.manifest_path):
+                path.unlink(missing_ok=True)
+            for path in (self.store_dir, self.store_tmp_dir, self.bm25_dir, self.bm25_tmp_dir):
+                shutil.rmtree(path, ignore_errors=True)
+            if self.shard_dir.exists() and not any(self.shard_dir.iterdir()):
+                self.shard_dir.rmdir()
+            logger.info(f"Removed empty shard at {self.shard_dir}")
+            return
+        os.replace(self.index_tmp_path, self.index_path)
+        replace_store(self.store_tmp_dir, self.store_dir)
+        replace_store(self.bm25_tmp_dir, self.bm25_dir)
+        self.spec.save(self.spec_path)
+        self.manifest.save(self.manifest_path)
+
+
+class StreamingIndexBuilder:
+    """
+    Embeds chunks in fixed-size batches into a preallocated float32 buffer,
+    adding each batch to the index and the chunk store as soon as it is ready.
+    Index types that need training hold back the first spec.train_size vectors
+    as the training sample. With a deduplicator, chunks that nearly repeat an earlier
+    chunk are recorded as back-references to it instead of being embedded.
+    """
+
+    def __init__(
+        self,
+        embeddings: any,
+        writer: ChunkStoreWriter,
+        spec: IndexSpec,
+        index: faiss.Index = None,
+        batch_size: int = 256,
+        cache: EmbeddingCache = None,
+        trace: Optional[Trace] = None,
+        dedup: Optional[ChunkDeduplicator] = None
+    ):
+        """
+        Constructor for the StreamingIndexBuilder class.
+        param embeddings: The LangChain embeddings model.
+        param writer: The chunk store the chunks are appended to.
+        param spec: The kind of index to create when index is None.
+        param index: The index to add to, or None to create one from the first vectors.
+        param batch_size: Number of chunks embedded per call to the model.
+        param cache: Embedding cache consulted before calling the model.
+        param trace: Records the time spent embedding, adding to the index and writing chunks.
+        param dedup: Drops near-duplicate chunks before they are embedded, or None to keep every chunk.
+        """
+        self.embeddings = embeddings
+        self.writer = writer
+        self.spec = spec
+        self.index = index
+        self.batch_size = batch_size
+        self.cache = cache
+        self.trace = trace or Trace(None, "ingest")
+        self.dedup = dedup
+        self.buffer: np.ndarray = None
+        self._pending_chunks: List[any] = []
+        self._pending_ids: List[int] = []
+        self._pending_signatures: List[np.ndarray] = []
+        self._training_vectors: List[np.ndarray] = []
+        self._training_ids: List[np.ndarray] = []
+
+    def add(self, chunks: List[any], chunk_ids: Iterable[int]) -> None:
+        """
+        Queue chunks for embedding, embedding every full batch.
+        param chunks: LangChain documents to embed.
+        param chunk_ids: Their IDs, increasing and above any ID already added.
+        """
+        if self.dedup is not None:
+            chunks, chunk_ids = self._drop_duplicates(chunks, chunk_ids)
+        self._pending_chunks.extend(chunks)
+        self._pending_ids.extend(chunk_ids)
+        while len(self._pending_chunks) >= self.batch_size:
+            self._flush(self.batch_size)
+
+    def _drop_duplicates(self, chunks: List[any], chunk_ids: Iterable[int]) -> tuple:
+        """
+        Record the chunks that nearly repeat a chunk already added as duplicates of it.
+        Returns: The other chunks and their IDs.
+        """
+        kept_chunks, kept_ids, duplicates, duplicate_ids, canonical_ids = [], [], [], [], []
+        with self.trace.span("dedup"):
+            for chunk, chunk_id in zip(chunks, chunk_ids):
+                signature = self.dedup.signature(chunk.page_content)
+                canonical_id = self.dedup.find(signature)
+                if canonical_id is None:
+                    self.dedup.insert(chunk_id, signature)
+                    kept_chunks.append(chunk)
+                    kept_ids.append(chunk_id)
+                    self._pending_signatures.append(signature)
+                else:
+                    duplicates.append(chunk)
+                    duplicate_ids.append(chunk_id)
+                    canonical_ids.append(canonical_id)
+            self.writer.append_duplicates(duplicates, duplicate_ids, canonical_ids)
+        self.trace.count("duplicates", len(duplicates))
+        return kept_chunks, kept_ids
+
+    def finish(self) -> faiss.Index:
+        """
+        Embed any remaining chunks.
+        Returns: The index, or None if nothing was ever added to it.
+        """
+        if self._pending_chunks:
+            self._flush(len(self._pending_chunks))
+        if self._training_vectors:
+            self._train()
+        return self.index
+
+    def _flush(self, count: int) -> None:
+        """Embed the first count pending chunks and add them to the index and store."""
+        chunks = self._pending_chunks[:count]
+        ids = np.array(self._pending_ids[:count], dtype=np.int64)
+        signatures = np.stack(self._pending_signatures[:count]) if self.dedup is not None else None
+        del self._pending_chunks[:count]
+        del self._pending_ids[:count]
+        del self._pending_signatures[:count]
+
+        self._embed([chunk.page_content for chunk in chunks])
+        if self.spec.metric == "cosine":
+            # Unit vectors, so inner product search ranks by cosine similarity
+            faiss.normalize_L2(self.buffer[:len(chunks)])
+
+        if self.index is None and not self.spec.needs_training:
+            # Initialize an ID-aware FAISS index so chunks can be removed later
+            self.index = build_index(self.spec, self.buffer.shape[1])
+
+        if self.index is None:
+            self._training_vectors.append(self.buffer[:len(chunks)].copy())
+            self._training_ids.append(ids)
+            if sum(len(vectors) for vectors in self._training_vectors) >= self.spec.train_size:
+                self._train()
+        else:
+            with self.trace.span("index_add"):
+                self.index.add_with_ids(self.buffer[:len(chunks)], ids)  #pylint: disable=E1120
+        with self.trace.span("store_write"):
+            self.writer.append_documents(
+                chunks, ids, self.buffer[:len(chunks)] if self.spec.raw_vectors else None, signatures
+            )
+
+    def _embed(self, texts: List[str]) -> None:
+        """Fill the first len(texts) rows of the buffer, from the cache where possible."""
+        missing = list(range(len(texts)))
+        hit_positions, hit_vectors = [], None
+        if self.cache is not None:
+            with self.trace.span("cache"):
+                digests = [text_digest(text) for text in texts]
+                hit_positions, hit_vectors = self.cache.get(digests)
+            hit_set = set(hit_positions.tolist())
+            missing = [position for position in missing if position not in hit_set]
+            self.trace.count("cache_hits", len(hit_positions))
+            self.trace.count("cache_misses", len(missing))
+
+        vectors = []
+        if missing:
+            with self.trace.span("embed"):
+                vectors = self.embeddings.embed_documents([texts[position] for position in missing])
+            self.trace.count("embedded", len(missing))
+        if self.buffer is None:
+            dimension = len(vectors[0]) if vectors else hit_vectors.shape[1]
+            self.buffer = np.empty((self.batch_size, dimension), dtype=np.float32)
+
+        if len(hit_positions):
+            self.buffer[hit_positions] = hit_vectors
+        for position, vector in zip(missing, vectors):
+            self.buffer[position] = vector
+        if self.cache is not None and missing:
+            with self.trace.span("cache"):
+                self.cache.put([digests[position] for position in missing], self.buffer[missing])
+
+    def _train(self) -> None:
+        """Create and train the index on the held-back vectors, then add them."""
+        vectors = np.concatenate(self._training_vectors)
+        ids = np.concatenate(self._training_ids)
+        self._training_vectors, self._training_ids = [], []
+        with self.trace.span("train"):
+            self.index = build_index(self.spec, vectors.shape[1], vectors)
+        with self.trace.span("index_add"):
+            self.index.add_with_ids(vectors, ids)  #pylint: disable=E1120
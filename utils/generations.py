@@ -0,0 +1,248 @@
+"""
+Versioned generations of a FAISS database, so queries keep being served while it is rebuilt.
+
+A database directory holds numbered generations and a pointer to the published one:
+    faiss_db/CURRENT                   {"generation": "gen-000003"}
+    faiss_db/generations/gen-000003/   the layout, shards, indexes and chunk stores of one build
+An ingest builds a new generation next to the published one, starting from hard links to
+its files, and publishes it by atomically replacing CURRENT. Published generations are
+never modified, so a reader that resolved CURRENT sees a consistent set of files for as
+long as it uses them. Readers and builders hold a shared lock on a generation's lease
+file; generations other than the published one are deleted once nobody holds it.
+
+Databases built before generations keep their files directly in the database directory.
+They are read in place, and the next ingest moves them into a generation.
+"""
+import json
+import os
+import re
+import shutil
+import tempfile
+from pathlib import Path
+from typing import List, Optional
+from loguru import logger
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+POINTER_FILE = "CURRENT"
+GENERATIONS_DIR = "generations"
+LEASE_FILE = ".lease"
+GENERATION_PATTERN = re.compile(r"gen-(\d+)")
+# Without file locks there is no telling whether a reader still uses an old generation,
+# so this many of the most recent ones are kept
+UNLOCKED_KEEP = 1
+
+
+class GenerationLease:
+    """
+    A shared lock on the lease file of a generation. The generation is not garbage-collected
+    while the lease is held; it is released by release() or when the lease is garbage-collected.
+    """
+
+    def __init__(self, generation_dir: Path):
+        """
+        Constructor for the GenerationLease class.
+        param generation_dir: The generation directory.
+        Raises: FileNotFoundError: If the generation has been deleted.
+            BlockingIOError: If the generation is being deleted.
+        """
+        self.generation_dir = Path(generation_dir)
+        self._handle = None
+        # Opened read-only so a generation that is being deleted never gets a new lease file
+        self._handle = open(self.generation_dir / LEASE_FILE, "rb")  # pylint: disable=consider-using-with
+        if fcntl is not None:
+            try:
+                fcntl.flock(self._handle, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            except OSError:
+                self._handle.close()
+                raise
+
+    def release(self) -> None:
+        """Release the lease."""
+        if self._handle is not None and not self._handle.closed:
+            self._handle.close()
+
+    def __del__(self):
+        self.release()
+
+
+class GenerationStore:
+    """Resolves, creates, publishes and garbage-collects the generations of one database."""
+
+    def __init__(self, db_path: str):
+        """
+        Constructor for the GenerationStore class.
+        param db_path: Path to the FAISS database directory.
+        """
+        self.db_path = Path(db_path)
+        self.generations_dir = self.db_path / GENERATIONS_DIR
+        self.pointer_path = self.db_path / POINTER_FILE
+
+    def current(self) -> Optional[Path]:
+        """Returns the directory of the published generation, or None if there is none."""
+        try:
+            with open(self.pointer_path, "r", encoding="utf-8") as handle:
+                return self.generations_dir / json.load(handle)["generation"]
+        except FileNotFoundError:
+            return None
+
+    def current_dir(self) -> Path:
+        """Returns the directory the database files are read from: the published generation, if any."""
+        return self.current() or self.db_path
+
+    def is_legacy(self) -> bool:
+        """True when the database files are kept directly in the database directory."""
+        return self.current() is None and self.db_path.exists() and any(
+            entry.name != GENERATIONS_DIR for entry in self.db_path.iterdir()
+        )
+
+    def lease_current(self) -> Optional[GenerationLease]:
+        """
+        Lease the published generation, retrying if it is replaced while the lease is taken.
+        Returns: The lease, or None for a database without generations.
+        """
+        while True:
+            generation_dir = self.current()
+            if generation_dir is None:
+                return None
+            try:
+                lease = GenerationLease(generation_dir)
+            except (FileNotFoundError, BlockingIOError):
+                continue
+            # The published generation is never collected, so once it is leased it is safe to read
+            if self.current() == generation_dir:
+                return lease
+            lease.release()
+
+    def create(self) -> GenerationLease:
+        """
+        Create an empty generation to build into, numbered after every existing one.
+        Returns: A lease on it, held until the generation is published or discarded.
+        """
+        self.generations_dir.mkdir(parents=True, exist_ok=True)
+        # Leased under a name garbage collection ignores, then renamed, so it is never collected
+        tmp_dir = Path(tempfile.mkdtemp(prefix="gen-", suffix=".tmp", dir=self.generations_dir))
+        (tmp_dir / LEASE_FILE).touch()
+        lease = GenerationLease(tmp_dir)
+        number = max((number for number, _ in self._generations()), default=0) + 1
+        while True:
+            generation_dir = self.generations_dir / f"gen-{number:06d}"
+            try:
+                os.rename(tmp_dir, generation_dir)
+                break
+            except OSError:
+                if not generation_dir.exists():
+                    raise
+                number += 1
+        lease.generation_dir = generation_dir
+        return lease
+
+    def clone_into(self, source_dir: Path, generation_dir: Path) -> None:
+        """
+        Fill a new generation with the files of another one. Files are hard-linked where
+        the file system allows it, which is safe because published files are never
+        modified, only replaced.
+        param source_dir: The generation, or legacy database directory, to copy.
+        param generation_dir: The new generation.
+        """
+        def link_or_copy(src: str, dst: str) -> None:
+            try:
+                os.link(src, dst)
+            except OSError:
+                shutil.copy2(src, dst)
+
+        ignored = {POINTER_FILE, GENERATIONS_DIR, LEASE_FILE}
+        for entry in source_dir.iterdir():
+            if entry.name in ignored or entry.name.endswith((".tmp", ".old")):
+                continue
+            if entry.is_dir():
+                shutil.copytree(entry, generation_dir / entry.name, copy_function=link_or_copy)
+            else:
+                link_or_copy(str(entry), str(generation_dir / entry.name))
+
+    def publish(self, generation_dir: Path) -> None:
+        """
+        Atomically make a generation the one readers load.
+        param generation_dir: The generation, fully written.
+        """
+        legacy = self.is_legacy()
+        tmp_path = Path(f"{self.pointer_path}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as handle:
+            json.dump({"generation": generation_dir.name}, handle)
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(tmp_path, self.pointer_path)
+        logger.info(f"Published generation {generation_dir.name} of {self.db_path}")
+        if legacy:
+            # Readers that have the legacy files mapped keep a valid view of them
+            for entry in self.db_path.iterdir():
+                if entry.name in (POINTER_FILE, GENERATIONS_DIR):
+                    continue
+                if entry.is_dir():
+                    shutil.rmtree(entry)
+                else:
+                    entry.unlink()
+            logger.info(f"Moved the legacy database at {self.db_path} into generation {generation_dir.name}")
+
+    def discard(self, lease: GenerationLease) -> None:
+        """
+        Delete a generation that was never published.
+        param lease: The lease returned by create.
+        """
+        lease.release()
+        shutil.rmtree(lease.generation_dir, ignore_errors=True)
+
+    def collect_garbage(self) -> List[str]:
+        """
+        Delete the generations that are neither published nor leased, including
+        those left behind by ingests that crashed.
+        Returns: The names of the deleted generations.
+        """
+        current = self.current()
+        candidates = [path for _, path in sorted(self._generations()) if path != current]
+        if fcntl is None:
+            candidates = candidates[:-UNLOCKED_KEEP] if UNLOCKED_KEEP else candidates
+        elif self.generations_dir.exists():
+            # Generations whose creation was interrupted before they were numbered
+            candidates += [path for path in self.generations_dir.glob("gen-*.tmp") if (path / LEASE_FILE).exists()]
+        removed = []
+        for generation_dir in candidates:
+            if self._remove_unleased(generation_dir):
+                removed.append(generation_dir.name)
+        if removed:
+            logger.info(f"Removed unused generation(s) {', '.join(removed)} of {self.db_path}")
+        return removed
+
+    def _generations(self) -> List[tuple]:
+        """Returns the (number, directory) of every generation on disk."""
+        if not self.generations_dir.exists():
+            return []
+        return [
+            (int(match.group(1)), entry) for entry in self.generations_dir.iterdir()
+            if (match := GENERATION_PATTERN.fullmatch(entry.name))
+        ]
+
+    @staticmethod
+    def _remove_unleased(generation_dir: Path) -> bool:
+        """Delete a generation unless it is leased, holding an exclusive lock while it is deleted."""
+        try:
+            handle = open(generation_dir / LEASE_FILE, "rb")  # pylint: disable=consider-using-with
+        except FileNotFoundError:
+            handle = None
+        try:
+            if handle is not None and fcntl is not None:
+                try:
+                    fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return False
+            shutil.rmtree(generation_dir)
+            return True
+        except OSError as e:
+            logger.warning(f"Could not remove generation {generation_dir}: {e}")
+            return False
+        finally:
+            if handle is not None:
+                handle.close()
@@ -0,0 +1,72 @@
+"""
+A deterministic stand-in for an embedding model, so ingest and query can be
+exercised and benchmarked without downloading a model.
+"""
+import hashlib
+import re
+from typing import List
+import numpy as np
+
+# Model names of the form hash:<dimension>, e.g. hash:384
+HASH_MODEL_PREFIX = "hash:"
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def is_hash_model(model_name: str) -> bool:
+    """True when a model name selects the hashing stand-in."""
+    return model_name.startswith(HASH_MODEL_PREFIX)
+
+
+class HashEmbeddings:
+    """
+    Embeds text as a signed bag of hashed words, L2 normalized. Texts sharing
+    words get similar vectors, which is enough for retrieval to behave like it
+    does with a real model, and the vectors are the same on every host and run.
+    Implements the embed_documents and embed_query methods of LangChain embeddings.
+    """
+
+    def __init__(self, dimension: int = 384):
+        """
+        Constructor for the HashEmbeddings class.
+        param dimension: The embedding dimension.
+        """
+        if dimension < 1:
+            raise ValueError(f"The embedding dimension must be at least 1, got {dimension}")
+        self.dimension = dimension
+
+    @classmethod
+    def from_model_name(cls, model_name: str) -> "HashEmbeddings":
+        """
+        Create the stand-in selected by a model name.
+        param model_name: A name of the form hash:<dimension>.
+        Raises: ValueError: If the dimension is not an integer.
+        """
+        dimension = model_name[len(HASH_MODEL_PREFIX):]
+        if not dimension.isdigit():
+            raise ValueError(f"Invalid hash model name {model_name}, expected hash:<dimension>")
+        return cls(int(dimension))
+
+    def _embed(self, text: str) -> List[float]:
+        """Returns the embedding of one text."""
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for word in WORD_PATTERN.findall(text.lower()):
+            digest = int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little")
+            vector[digest % self.dimension] += 1.0 if digest >> 63 else -1.0
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed a batch of texts.
+        param texts: The texts to embed.
+        """
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        """
+        Embed a query.
+        param text: The query text.
+        """
+        return self._embed(text)
@@ -0,0 +1,112 @@
+"""
+Checks how long importing the Streamlit entry point takes in a fresh interpreter,
+and that it does not pull in the ML stack, which pages import on first use.
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List
+
+# Modules that take seconds to import and must not be loaded before a page needs them
+HEAVY_MODULES = (
+    "faiss",
+    "torch",
+    "transformers",
+    "sentence_transformers",
+    "langchain",
+    "langchain_community",
+    "langchain_huggingface",
+    "langchain_text_splitters",
+    "pypdf",
+)
+_MEASURE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "modules": sorted(sys.modules)}}))
+"""
+
+
+def _parse_importtime(stderr: str, module: str, top: int) -> List[Dict[str, any]]:
+    """
+    Returns the imports made directly by a module with the largest cumulative times,
+    from -X importtime output, which lists each module's imports before the module itself.
+    """
+    children, imports = [], []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Each nesting level indents the name by two more spaces
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            children.append({"module": name.strip(), "ms": int(cumulative) / 1000})
+        elif depth == 0:
+            if name.strip() == module:
+                imports = children
+            children = []
+    return sorted(imports, key=lambda row: -row["ms"])[:top]
+
+
+def measure_import(module: str = "app", repeats: int = 3, cwd: str = None) -> Dict[str, any]:
+    """
+    Import a module in fresh interpreters and time it.
+    param module: The module to import.
+    param repeats: Number of interpreters started; the median time is reported.
+    param cwd: Directory the interpreters run in, defaults to the current one.
+    Returns: The median import time in ms, the heavy modules it loaded and its slowest imports.
+    Raises: RuntimeError: If the module cannot be imported.
+    """
+    times, modules, slowest = [], [], []
+    env = {**os.environ, "PYTHONDONTWRITEBYTECODE": "1"}
+    for _ in range(repeats):
+        completed = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", _MEASURE.format(module=module)],
+            capture_output=True, text=True, cwd=cwd, env=env, check=False
+        )
+        if completed.returncode != 0:
+            raise RuntimeError(f"Could not import {module}: {completed.stderr.strip().splitlines()[-1]}")
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        times.append(1000 * result["seconds"])
+        modules = result["modules"]
+        slowest = _parse_importtime(completed.stderr, module, 10)
+    return {
+        "module": module,
+        "import_ms": statistics.median(times),
+        "heavy_modules": [name for name in HEAVY_MODULES if name in modules],
+        "slowest_imports": slowest,
+    }
+
+
+def check_import_budget(module: str = "app", budget_ms: float = 1500, repeats: int = 3) -> Dict[str, any]:
+    """
+    Check a module's import time against a budget.
+    param module: The module to import.
+    param budget_ms: The most the import may take.
+    param repeats: Number of interpreters started; the median time is compared.
+    Returns: The measurement, with the budget and whether it passed. It fails when the
+        import is over budget or loads any of HEAVY_MODULES.
+    """
+    report = measure_import(module, repeats)
+    report["budget_ms"] = budget_ms
+    report["passed"] = report["import_ms"] <= budget_ms and not report["heavy_modules"]
+    return report
+
+
+def format_budget_report(report: Dict[str, any]) -> str:
+    """
+    Render a budget check as plain text.
+    param report: The result of check_import_budget.
+    """
+    lines = [
+        f"import {report['module']}: {report['import_ms']:.0f} ms (budget {report['budget_ms']:.0f} ms) "
+        f"{'PASS' if report['passed'] else 'FAIL'}"
+    ]
+    if report["heavy_modules"]:
+        lines.append(f"heavy modules imported at startup: {', '.join(report['heavy_modules'])}")
+    lines.append("slowest imports:")
+    lines += [f"  {row['ms']:>8.1f} ms  {row['module']}" for row in report["slowest_imports"]]
+    return "\n".join(lines)
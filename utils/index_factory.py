@@ -0,0 +1,287 @@
+"""
+Builds the FAISS index described by the [index] section of config.toml.
+
+Supported index types:
+    flat      - exact brute-force search (IndexFlatL2)
+    ivf_flat  - inverted lists over full vectors (IndexIVFFlat), tuned with nprobe
+    hnsw_flat - graph search over full vectors (IndexHNSWFlat), tuned with ef_search
+    ivf_pq    - inverted lists over product-quantized vectors (IndexIVFPQ), tuned with nprobe
+
+The flat, ivf_flat and hnsw_flat types can store compressed vectors instead of float32:
+    float16   - half-precision scalar quantizer, 2 bytes per dimension
+    int8      - 8-bit scalar quantizer trained on the value range, 1 byte per dimension
+    pq        - product quantizer with pq_m codes of pq_nbits each (flat only)
+
+With metric = 'cosine', vectors are L2-normalized at ingest and query time and
+searched by inner product, so scores are cosine similarities in [-1, 1].
+Databases built before the metric was recorded use L2 distances.
+
+With raw_vectors set, the float32 vectors are also kept in the chunk store on
+disk, so the top rerank candidates of a compressed index can be re-scored exactly.
+"""
+import json
+import math
+import os
+from dataclasses import asdict, dataclass, fields
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+import faiss
+import numpy as np
+from loguru import logger
+
+INDEX_TYPES = ("flat", "ivf_flat", "hnsw_flat", "ivf_pq")
+STORAGE_TYPES = ("float32", "float16", "int8", "pq")
+METRICS = {"l2": faiss.METRIC_L2, "cosine": faiss.METRIC_INNER_PRODUCT}
+SCALAR_QUANTIZERS = {
+    "float16": faiss.ScalarQuantizer.QT_fp16,
+    "int8": faiss.ScalarQuantizer.QT_8bit,
+}
+
+# Query-time parameters, which can change without rebuilding the index
+SEARCH_FIELDS = ("nprobe", "ef_search", "rerank")
+
+# FAISS warns when there are fewer training points than this per centroid
+MIN_POINTS_PER_CENTROID = 39
+
+
+@dataclass
+class IndexSpec:
+    """Describes how an index is built and searched."""
+
+    index_type: str = "flat"
+    metric: str = "l2"
+    nlist: int = 1024
+    hnsw_m: int = 32
+    ef_construction: int = 200
+    pq_m: int = 16
+    pq_nbits: int = 8
+    train_size: int = 50000
+    storage: str = "float32"
+    raw_vectors: bool = False
+    nprobe: int = 16
+    ef_search: int = 64
+    rerank: int = 0
+
+    def __post_init__(self):
+        if self.index_type not in INDEX_TYPES:
+            raise ValueError(f"Unsupported index type {self.index_type}, expected one of {INDEX_TYPES}")
+        if self.metric not in METRICS:
+            raise ValueError(f"Unsupported metric {self.metric}, expected one of {tuple(METRICS)}")
+        if self.storage not in STORAGE_TYPES:
+            raise ValueError(f"Unsupported storage {self.storage}, expected one of {STORAGE_TYPES}")
+        if self.index_type == "ivf_pq" and self.storage != "float32":
+            raise ValueError("ivf_pq already stores product-quantized vectors, leave storage as float32")
+        if self.storage == "pq" and self.index_type != "flat":
+            raise ValueError("pq storage is only supported by the flat index type, use ivf_pq instead")
+
+    @classmethod
+    def from_dict(cls, values: Dict[str, any]) -> "IndexSpec":
+        """
+        Create a spec from a config section or a saved spec, ignoring unknown keys.
+        param values: The spec values; the config section names the type 'type'.
+        """
+        values = dict(values)
+        if "type" in values:
+            values["index_type"] = values.pop("type")
+        names = {field.name for field in fields(cls)}
+        return cls(**{key: value for key, value in values.items() if key in names})
+
+    @classmethod
+    def load(cls, spec_path: Path) -> "IndexSpec":
+        """
+        Load the spec recorded in a database directory.
+        Databases built before specs were recorded use a flat index.
+        param spec_path: Path to the spec file.
+        """
+        if not Path(spec_path).exists():
+            return cls()
+        with open(spec_path, "r", encoding="utf-8") as handle:
+            return cls.from_dict(json.load(handle))
+
+    def save(self, spec_path: Path) -> None:
+        """
+        Atomically write the spec to a database directory.
+        param spec_path: Path to the spec file.
+        """
+        tmp_path = Path(f"{spec_path}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as handle:
+            json.dump(asdict(self), handle, indent=2)
+        os.replace(tmp_path, spec_path)
+
+    def build_params(self) -> Dict[str, any]:
+        """The parameters that determine the index contents; changing one needs a rebuild."""
+        return {key: value for key, value in asdict(self).items() if key not in SEARCH_FIELDS}
+
+    @property
+    def needs_training(self) -> bool:
+        """True when vectors must be trained on before they can be added."""
+        return self.index_type in ("ivf_flat", "ivf_pq") or self.storage in ("int8", "pq")
+
+    @property
+    def faiss_metric(self) -> int:
+        """The FAISS metric type the index is searched with."""
+        return METRICS[self.metric]
+
+    @property
+    def supports_selector(self) -> bool:
+        """True when searches can be restricted to a set of IDs; FAISS's IndexPQ cannot."""
+        return self.storage != "pq"
+
+    @property
+    def is_ivf(self) -> bool:
+        """True for inverted-list indexes, which are tuned with nprobe."""
+        return self.index_type in ("ivf_flat", "ivf_pq")
+
+
+def _pq_nbits(spec: IndexSpec, training_count: int) -> int:
+    """Bits per PQ code, fewer than configured when the sample is too small to train them."""
+    nbits = max(1, min(spec.pq_nbits, int(math.log2(training_count))))
+    if nbits < spec.pq_nbits:
+        logger.warning(f"Only {training_count} training vectors, using pq_nbits={nbits}")
+    return nbits
+
+
+def build_index(spec: IndexSpec, dimension: int, training_vectors: Optional[np.ndarray] = None) -> faiss.Index:
+    """
+    Create an empty, ID-aware index, trained when the index type needs it.
+    param spec: The index spec.
+    param dimension: The embedding dimension.
+    param training_vectors: Sample vectors to train on, required when spec.needs_training.
+    Returns: An index that supports add_with_ids.
+    """
+    if spec.needs_training and (training_vectors is None or len(training_vectors) == 0):
+        raise ValueError(f"Index type {spec.index_type} with {spec.storage} storage needs training vectors")
+
+    metric = spec.faiss_metric
+    if spec.index_type == "flat":
+        if spec.storage == "float32":
+            index = faiss.IndexFlat(dimension, metric)
+        elif spec.storage == "pq":
+            index = faiss.IndexPQ(dimension, spec.pq_m, _pq_nbits(spec, len(training_vectors)), metric)
+        else:
+            index = faiss.IndexScalarQuantizer(dimension, SCALAR_QUANTIZERS[spec.storage], metric)
+    elif spec.index_type == "hnsw_flat":
+        if spec.storage == "float32":
+            index = faiss.IndexHNSWFlat(dimension, spec.hnsw_m, metric)
+        else:
+            index = faiss.IndexHNSWSQ(dimension, SCALAR_QUANTIZERS[spec.storage], spec.hnsw_m, metric)
+        index.hnsw.efConstruction = spec.ef_construction
+    else:
+        # Fewer centroids than configured when the sample is too small to train them
+        nlist = max(1, min(spec.nlist, len(training_vectors) // MIN_POINTS_PER_CENTROID))
+        if nlist < spec.nlist:
+            logger.warning(
+                f"Only {len(training_vectors)} training vectors, using nlist={nlist} instead of {spec.nlist}"
+            )
+
+        quantizer = faiss.IndexFlat(dimension, metric)
+        if spec.index_type == "ivf_pq":
+            index = faiss.IndexIVFPQ(
+                quantizer, dimension, nlist, spec.pq_m, _pq_nbits(spec, len(training_vectors)), metric
+            )
+        elif spec.storage == "float32":
+            index = faiss.IndexIVFFlat(quantizer, dimension, nlist, metric)
+        else:
+            index = faiss.IndexIVFScalarQuantizer(
+                quantizer, dimension, nlist, SCALAR_QUANTIZERS[spec.storage], metric
+            )
+
+    if spec.needs_training:
+        index.train(training_vectors)  #pylint: disable=E1120
+        logger.info(f"Trained {spec.index_type} index ({spec.storage}) on {len(training_vectors)} vectors")
+    # IVF indexes store IDs themselves; the others are wrapped so chunks can be removed by ID
+    return index if spec.is_ivf else faiss.IndexIDMap2(index)
+
+
+def remove_ids(index: faiss.Index, ids: np.ndarray, spec: IndexSpec) -> Optional[faiss.Index]:
+    """
+    Remove vectors by ID. Index types that cannot delete in place, such as
+    HNSW, are rebuilt from the vectors that remain.
+    param index: The index.
+    param ids: The IDs to remove.
+    param spec: The spec the index was built with.
+    Returns: The index with the IDs removed, which may be a new object, or None when
+        no vectors remain to train a rebuilt index on; StreamingIndexBuilder then
+        creates and trains the index from the next vectors added.
+    """
+    try:
+        index.remove_ids(ids)
+        return index
+    except RuntimeError:
+        logger.info(f"{spec.index_type} index does not support removal, rebuilding it")
+
+    id_map = faiss.downcast_index(index)
+    all_ids = faiss.vector_to_array(id_map.id_map)
+    keep = ~np.isin(all_ids, ids)
+    if spec.needs_training and not keep.any():
+        return None
+    vectors = id_map.index.reconstruct_n(0, index.ntotal)[keep]
+    rebuilt = build_index(spec, index.d, vectors)
+    rebuilt.add_with_ids(vectors, all_ids[keep])  #pylint: disable=E1120
+    return rebuilt
+
+
+def search_parameters(
+    spec: IndexSpec,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    selector: Optional[faiss.IDSelector] = None
+) -> Optional[faiss.SearchParameters]:
+    """
+    Per-search parameters for an index. Passing these to index.search leaves
+    the shared index untouched, so concurrent queries can use different settings.
+    param spec: The spec the index was built with.
+    param nprobe: Inverted lists probed by IVF indexes, defaults to the spec.
+    param ef_search: Candidate list size for HNSW indexes, defaults to the spec.
+    param selector: Restricts the search to these IDs; see IndexSpec.supports_selector.
+    Returns: The search parameters, or None for an unfiltered flat index.
+    """
+    if spec.is_ivf:
+        return faiss.SearchParametersIVF(nprobe=nprobe or spec.nprobe, sel=selector)
+    if spec.index_type == "hnsw_flat":
+        return faiss.SearchParametersHNSW(efSearch=ef_search or spec.ef_search, sel=selector)
+    if selector is not None:
+        return faiss.SearchParameters(sel=selector)
+    return None
+
+
+def similarity_scores(spec: IndexSpec, distances: np.ndarray) -> np.ndarray:
+    """
+    Convert the distances returned by a search to scores where higher is better.
+    Cosine indexes return the cosine similarity itself; L2 indexes keep the
+    1 - distance score of databases built before the metric was recorded.
+    param spec: The spec the index was built with.
+    param distances: Distances from index.search.
+    """
+    return distances if spec.metric == "cosine" else 1 - distances
+
+
+def rerank_exact(
+    vectors: np.ndarray,
+    queries: np.ndarray,
+    positions: np.ndarray,
+    k: int,
+    metric: str = "l2"
+) -> Tuple[np.ndarray, ...]:
+    """
+    Re-score search candidates by their exact distance to the queries.
+    param vectors: The raw float32 vectors by chunk store position, usually memory-mapped,
+        so only the candidate rows are read from disk.
+    param queries: A float32 matrix with one row per query.
+    param positions: Chunk store positions of the candidates, -1 where there is none.
+    param k: Number of candidates kept per query.
+    param metric: 'l2' for squared L2 distances, 'cosine' for inner products of normalized vectors.
+    Returns: The exact distances and positions of the k best candidates per query, in
+        the same convention as index.search.
+    """
+    valid = positions >= 0
+    candidates = vectors[np.where(valid, positions, 0).ravel()].reshape(*positions.shape, -1)
+    if metric == "cosine":
+        distances = np.einsum("qcd,qd->qc", candidates, queries)
+        distances[~valid] = -np.inf
+        top = np.argsort(-distances, axis=1, kind="stable")[:, :k]
+    else:
+        distances = np.square(candidates - queries[:, np.newaxis, :]).sum(axis=2)
+        distances[~valid] = np.inf
+        top = np.argsort(distances, axis=1, kind="stable")[:, :k]
+    return np.take_along_axis(distances, top, axis=1), np.take_along_axis(positions, top, axis=1)
@@ -0,0 +1,220 @@
+"""
+Process-wide registry of loaded FAISS indexes and their chunk stores.
+"""
+import os
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import faiss
+import streamlit as st
+from loguru import logger
+from utils.bm25_index import BM25Index
+from utils.chunk_store import ChunkStore
+from utils.generations import GenerationLease, GenerationStore
+from utils.index_factory import IndexSpec
+from utils.sharding import ShardLayout
+
+INDEX_FILE = "index.faiss"
+DOCS_FILE = "documents.npy"
+CHUNK_STORE = "chunks"
+MANIFEST_FILE = "manifest.json"
+SPEC_FILE = "index_spec.json"
+BM25_DIR = "bm25"
+
+
+class LoadedIndex:
+    """An index and its chunk store, loaded once and shared between queries."""
+
+    def __init__(
+        self,
+        index: faiss.Index,
+        store: ChunkStore,
+        spec: IndexSpec,
+        signature: Tuple,
+        bm25: Optional[BM25Index] = None,
+        lease: Optional[GenerationLease] = None
+    ):
+        """
+        Constructor for the LoadedIndex class.
+        param index: The FAISS index.
+        param store: The memory-mapped chunk store.
+        param spec: The spec the index was built with.
+        param signature: The on-disk state the handle was loaded from.
+        param bm25: The BM25 index over the chunk store, None for databases built without one.
+        param lease: Keeps the generation the files belong to from being deleted while
+            the handle is in use, None for databases without generations.
+        """
+        self.index = index
+        self.store = store
+        self.spec = spec
+        self.signature = signature
+        self.bm25 = bm25
+        self.lease = lease
+
+
+class IndexRegistry:
+    """
+    Caches one LoadedIndex per database directory and reloads it only when the
+    files on disk change. Handles are swapped atomically, so a query that is
+    already running keeps using the handle it started with. When a new generation
+    of a database is published, the handles of the previous one are dropped; their
+    lease is released once the last query using them finishes.
+    """
+
+    def __init__(
+        self,
+        index_file: str = INDEX_FILE,
+        chunk_store: str = CHUNK_STORE,
+        manifest_file: str = MANIFEST_FILE,
+        docs_file: str = DOCS_FILE,
+        spec_file: str = SPEC_FILE,
+        bm25_dir: str = BM25_DIR
+    ):
+        """
+        Constructor for the IndexRegistry class.
+        param index_file: File name of the FAISS index inside a database directory.
+        param chunk_store: Name of the chunk store directory inside a database directory.
+        param manifest_file: File name of the manifest inside a database directory.
+        param docs_file: File name of the legacy pickled documents, read when there is no chunk store.
+        param spec_file: File name of the index spec inside a database directory.
+        param bm25_dir: Name of the BM25 index directory inside a database directory.
+        """
+        self.index_file = index_file
+        self.chunk_store = chunk_store
+        self.docs_file = docs_file
+        self.manifest_file = manifest_file
+        self.spec_file = spec_file
+        self.bm25_dir = bm25_dir
+        self._handles: Dict[str, LoadedIndex] = {}
+        self._leases: Dict[str, GenerationLease] = {}
+        self._lock = threading.Lock()
+
+    def _signature(self, db_dir: Path) -> Tuple:
+        """Returns the mtime and size of each database file."""
+        index_path = db_dir / self.index_file
+        if not index_path.exists():
+            raise FileNotFoundError(f"FAISS index not found at {index_path}")
+        store_dir = db_dir / self.chunk_store
+        docs_path = db_dir / self.docs_file
+        if not store_dir.exists() and not docs_path.exists():
+            raise FileNotFoundError(f"Chunk store not found at {store_dir}")
+
+        signature = []
+        paths = (
+            index_path, store_dir / "meta.json", db_dir / self.spec_file, db_dir / self.manifest_file,
+            db_dir / self.bm25_dir / "meta.json", docs_path,
+        )
+        for path in paths:
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    def _load(self, db_dir: Path, lease: Optional[GenerationLease] = None) -> LoadedIndex:
+        """Load the index and chunk store, retrying if they change mid-load."""
+        while True:
+            signature = self._signature(db_dir)
+            index = faiss.read_index(str(db_dir / self.index_file))
+            if (db_dir / self.chunk_store).exists():
+                store = ChunkStore(db_dir / self.chunk_store)
+            else:
+                # Queries never write to a database; the next ingest converts it
+                logger.warning(f"Reading legacy document store {db_dir / self.docs_file}")
+                store = ChunkStore.from_documents_npy(db_dir / self.docs_file)
+            spec = IndexSpec.load(db_dir / self.spec_file)
+            bm25 = None
+            if (db_dir / self.bm25_dir / "meta.json").exists():
+                bm25 = BM25Index(db_dir / self.bm25_dir)
+            if self._signature(db_dir) == signature:
+                logger.info(f"Loaded {spec.index_type} FAISS database at {db_dir} ({index.ntotal} vectors)")
+                if bm25 is None:
+                    logger.warning(f"No BM25 index at {db_dir}, hybrid search will only use vector matches")
+                return LoadedIndex(index, store, spec, signature, bm25, lease)
+
+    def get(self, db_path: str, lease: Optional[GenerationLease] = None) -> LoadedIndex:
+        """
+        Returns the loaded index for a database directory, reloading it if the files changed.
+        param db_path: Path to the directory holding the index files.
+        param lease: The lease on the generation the directory belongs to.
+        """
+        db_dir = Path(db_path)
+        key = str(db_dir.resolve())
+        signature = self._signature(db_dir)
+        handle = self._handles.get(key)
+        if handle is not None and handle.signature == signature:
+            return handle
+
+        with self._lock:
+            handle = self._handles.get(key)
+            if handle is None or handle.signature != self._signature(db_dir):
+                handle = self._load(db_dir, lease)
+                self._handles[key] = handle
+        return handle
+
+    def get_shards(self, db_path: str) -> List[LoadedIndex]:
+        """
+        Returns the loaded index of every shard of the published generation of a
+        database. Shards left empty by an update have no files and are skipped, so a
+        generation published after every file was deleted has no shards at all.
+        param db_path: Path to the FAISS database directory.
+        Raises: FileNotFoundError: If a database without generations has no index.
+        """
+        generation_dir, lease = self._lease(db_path)
+        layout = ShardLayout.load(generation_dir)
+        if layout.shard_count == 1 and lease is None:
+            return [self.get(str(generation_dir))]
+        shard_dirs = [shard_dir for shard_dir in layout.shard_dirs() if (shard_dir / self.index_file).exists()]
+        if not shard_dirs and lease is None:
+            raise FileNotFoundError(f"No FAISS shards found in {db_path}")
+        return [self.get(str(shard_dir), lease) for shard_dir in shard_dirs]
+
+    def _lease(self, db_path: str) -> Tuple[Path, Optional[GenerationLease]]:
+        """
+        Returns the directory of the published generation of a database and a lease on it,
+        dropping the handles of any generation it replaced. Databases without generations
+        are read from their own directory, without a lease.
+        """
+        generations = GenerationStore(db_path)
+        generation_dir = generations.current()
+        if generation_dir is None:
+            return Path(db_path), None
+        db_key = str(Path(db_path).resolve())
+        lease = self._leases.get(db_key)
+        if lease is not None and lease.generation_dir == generation_dir:
+            return generation_dir, lease
+
+        with self._lock:
+            lease = self._leases.get(db_key)
+            if lease is None or lease.generation_dir != generation_dir:
+                lease = generations.lease_current()
+                if lease is None:
+                    return Path(db_path), None
+                self._leases[db_key] = lease
+                generation_key = str(lease.generation_dir.resolve())
+                for handle_key in [k for k in self._handles if k == db_key or k.startswith(db_key + os.sep)]:
+                    if handle_key != generation_key and not handle_key.startswith(generation_key + os.sep):
+                        del self._handles[handle_key]
+        return lease.generation_dir, lease
+
+    def invalidate(self, db_path: str = None) -> None:
+        """
+        Drop cached handles so they are reloaded on next use.
+        param db_path: The database to drop, with its shards, or None to drop all.
+        """
+        with self._lock:
+            if db_path is None:
+                self._handles.clear()
+                self._leases.clear()
+            else:
+                key = str(Path(db_path).resolve())
+                self._leases.pop(key, None)
+                for handle_key in [k for k in self._handles if k == key or k.startswith(key + os.sep)]:
+                    del self._handles[handle_key]
+
+
+@st.cache_resource
+def get_index_registry() -> IndexRegistry:
+    """Returns the registry shared by all queries and Streamlit sessions in this process."""
+    return IndexRegistry()
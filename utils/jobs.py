@@ -0,0 +1,176 @@
+"""
+Background ingest jobs that run in their own process, independent of any Streamlit session.
+
+Each job has a directory under the jobs folder holding job.json, which the
+worker process rewrites as it makes progress and the UI or CLI polls.
+"""
+import json
+import os
+import subprocess
+import sys
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional
+from loguru import logger
+from app_config import DEFAULT_CONFIG_FILE
+
+ACTIVE_STATES = ("queued", "running")
+
+
+def _pid_alive(pid: Optional[int]) -> bool:
+    """True when a process with this id is still running."""
+    if not pid:
+        return False
+    try:
+        # Reap the job if it is our own exited child, which would otherwise linger as a zombie
+        if os.waitpid(pid, os.WNOHANG)[0] == pid:
+            return False
+    except ChildProcessError:
+        pass
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobManager:
+    """Submits ingest jobs and reads their status."""
+
+    def __init__(self, jobs_folder: str, config_file: str = DEFAULT_CONFIG_FILE):
+        """
+        Constructor for the JobManager class.
+        param jobs_folder: Folder holding one directory per job.
+        param config_file: The config file passed to the job process.
+        """
+        self.jobs_folder = Path(jobs_folder)
+        self.jobs_folder.mkdir(parents=True, exist_ok=True)
+        self.config_file = config_file
+
+    def _status_path(self, job_id: str) -> Path:
+        """Returns the path of a job's status file."""
+        return self.jobs_folder / job_id / "job.json"
+
+    def status(self, job_id: str) -> Dict[str, any]:
+        """
+        Returns the status of a job. A job whose process died without
+        reporting an outcome is reported as failed.
+        param job_id: The job id.
+        Raises: FileNotFoundError: If there is no such job.
+        """
+        with open(self._status_path(job_id), "r", encoding="utf-8") as handle:
+            status = json.load(handle)
+        pid_path = self.jobs_folder / job_id / "pid"
+        if status.get("pid") is None and pid_path.exists():
+            status["pid"] = int(pid_path.read_text(encoding="utf-8"))
+        if status["state"] in ACTIVE_STATES and not _pid_alive(status.get("pid")):
+            status["state"] = "failed"
+            status["error"] = status.get("error") or "The job process exited unexpectedly."
+        return status
+
+    def list_jobs(self, limit: int = 10) -> List[Dict[str, any]]:
+        """
+        Returns the most recently submitted jobs, newest first.
+        param limit: Maximum number of jobs returned.
+        """
+        paths = sorted(self.jobs_folder.glob("*/job.json"), key=os.path.getmtime, reverse=True)
+        return [self.status(path.parent.name) for path in paths[:limit]]
+
+    def submit(
+        self,
+        folder_path: str,
+        db_path: str,
+        chunk_size: int,
+        chunk_overlap: int,
+        model_name: str,
+        incremental: bool = True
+    ) -> str:
+        """
+        Start an ingest job in a detached process running `cli.py ingest`.
+        param folder_path: Path to folder containing PDFs.
+        param db_path: Path where the FAISS database will be stored.
+        param chunk_size: Size of text chunks.
+        param chunk_overlap: Overlap between chunks.
+        param model_name: HuggingFace model name for embeddings.
+        param incremental: Only embed new or changed files.
+        Returns: The job id.
+        Raises: RuntimeError: If another job is already writing to db_path.
+        """
+        db_key = str(Path(db_path).resolve())
+        for job in self.list_jobs(limit=100):
+            if job["state"] in ACTIVE_STATES and job["db_path"] == db_key:
+                raise RuntimeError(f"Ingest job {job['id']} is already running for {db_path}")
+
+        job_id = time.strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:8]
+        job_dir = self.jobs_folder / job_id
+        job_dir.mkdir()
+        command = [
+            sys.executable, str(Path(__file__).resolve().parent.parent / "cli.py"),
+            "--config", self.config_file,
+            "ingest",
+            "--folder", folder_path,
+            "--db", db_path,
+            "--chunk-size", str(chunk_size),
+            "--chunk-overlap", str(chunk_overlap),
+            "--model", model_name,
+            "--job-id", job_id,
+        ]
+        if not incremental:
+            command.append("--full")
+
+        JobReporter(self.jobs_folder, job_id).update(
+            id=job_id, state="queued", folder_path=folder_path, db_path=db_key,
+            submitted=time.time(), files_done=0, files_total=None, error=None
+        )
+        # A new session keeps the job alive when the Streamlit server or session goes away
+        with open(job_dir / "output.log", "ab") as output:
+            process = subprocess.Popen(  # pylint: disable=R1732
+                command, stdout=output, stderr=subprocess.STDOUT, start_new_session=True, cwd=os.getcwd()
+            )
+        # Written separately so it cannot race with the job's own updates to job.json
+        (job_dir / "pid").write_text(str(process.pid), encoding="utf-8")
+        logger.info(f"Submitted ingest job {job_id} for {folder_path} (pid {process.pid})")
+        return job_id
+
+
+class JobReporter:
+    """Used by the job process to publish its progress to job.json."""
+
+    def __init__(self, jobs_folder: str, job_id: str):
+        """
+        Constructor for the JobReporter class.
+        param jobs_folder: Folder holding one directory per job.
+        param job_id: The job id.
+        """
+        self.status_path = Path(jobs_folder) / job_id / "job.json"
+        self._status: Dict[str, any] = {}
+        if self.status_path.exists():
+            with open(self.status_path, "r", encoding="utf-8") as handle:
+                self._status = json.load(handle)
+
+    def update(self, **fields) -> None:
+        """Merge fields into the status and atomically rewrite job.json."""
+        self._status.update(fields)
+        tmp_path = Path(f"{self.status_path}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as handle:
+            json.dump(self._status, handle, indent=2)
+        os.replace(tmp_path, self.status_path)
+
+    def start(self) -> None:
+        """Mark the job as running in this process."""
+        self.update(state="running", pid=os.getpid(), started=time.time())
+
+    def progress(self, files_done: int, files_total: int) -> None:
+        """Record how many files have been processed."""
+        self.update(files_done=files_done, files_total=files_total)
+
+    def succeed(self) -> None:
+        """Mark the job as finished."""
+        self.update(state="succeeded", finished=time.time())
+
+    def fail(self, error: str) -> None:
+        """Mark the job as failed."""
+        self.update(state="failed", finished=time.time(), error=error)
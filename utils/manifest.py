@@ -0,0 +1,214 @@
+"""
+Manifest of the files that make up a FAISS database, used for incremental indexing.
+"""
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Optional
+import numpy as np
+
+MANIFEST_VERSION = 1
+
+
+def file_sha256(file_path: Path, block_size: int = 1 << 20) -> str:
+    """
+    Compute the SHA-256 digest of a file without reading it into memory at once.
+    param file_path: Path to the file.
+    param block_size: Number of bytes read per iteration.
+    Returns: The hex digest of the file contents.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as handle:
+        for block in iter(lambda: handle.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ManifestDiff:
+    """The difference between the files on disk and the files recorded in a manifest."""
+
+    def __init__(self):
+        self.added: List[Path] = []
+        self.changed: List[Path] = []
+        self.deleted: List[str] = []
+        self.unchanged: List[Path] = []
+        self.hashes: Dict[str, str] = {}
+
+    @property
+    def to_embed(self) -> List[Path]:
+        """Files whose chunks need to be (re-)embedded."""
+        return self.added + self.changed
+
+    @property
+    def stale(self) -> List[str]:
+        """Manifest keys whose chunks must be removed from the index."""
+        return [IndexManifest.key(path) for path in self.changed] + self.deleted
+
+    @property
+    def has_changes(self) -> bool:
+        """True when the database is out of date with the folder."""
+        return bool(self.added or self.changed or self.deleted)
+
+    def reprocess(self, key: str, sha256: str) -> None:
+        """
+        Re-embed an unchanged file, e.g. because chunks it depends on are removed.
+        param key: The manifest key of the file.
+        param sha256: Its recorded content hash.
+        """
+        for position, path in enumerate(self.unchanged):
+            if IndexManifest.key(path) == key:
+                self.changed.append(self.unchanged.pop(position))
+                self.hashes[key] = sha256
+                return
+
+
+class IndexManifest:
+    """
+    Records, per source file, the content hash, mtime, size and the contiguous
+    range of chunk IDs it contributed to the index.
+    """
+
+    def __init__(self, settings: Dict[str, any], files: Dict[str, Dict[str, any]] = None, next_id: int = 0):
+        """
+        Constructor for the IndexManifest class.
+        param settings: The embedding settings the database was built with.
+        param files: Per-file records keyed by resolved file path.
+        param next_id: The next unused chunk ID.
+        """
+        self.settings = settings
+        self.files = files or {}
+        self.next_id = next_id
+
+    @staticmethod
+    def key(file_path: Path) -> str:
+        """Returns the manifest key for a file."""
+        return str(Path(file_path).resolve())
+
+    @classmethod
+    def load(cls, manifest_path: Path) -> Optional["IndexManifest"]:
+        """
+        Load a manifest from disk.
+        param manifest_path: Path to the manifest file.
+        Returns: The manifest, or None if it does not exist or is from another version.
+        """
+        if not Path(manifest_path).exists():
+            return None
+        with open(manifest_path, "r", encoding="utf-8") as handle:
+            data = json.load(handle)
+        if data.get("version") != MANIFEST_VERSION:
+            return None
+        return cls(data["settings"], data["files"], data["next_id"])
+
+    def save(self, manifest_path: Path) -> None:
+        """
+        Atomically write the manifest to disk.
+        param manifest_path: Path to the manifest file.
+        """
+        data = {
+            "version": MANIFEST_VERSION,
+            "settings": self.settings,
+            "next_id": self.next_id,
+            "files": self.files,
+        }
+        tmp_path = Path(f"{manifest_path}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as handle:
+            json.dump(data, handle, indent=2)
+        os.replace(tmp_path, manifest_path)
+
+    def matches(self, settings: Dict[str, any]) -> bool:
+        """True when the database was built with the given settings."""
+        return self.settings == settings
+
+    def changed_settings(self, settings: Dict[str, any]) -> List[str]:
+        """
+        Name the settings that differ from those the database was built with.
+        param settings: The current embedding settings.
+        Returns: The changed setting names, with sections as prefixes, e.g. 'index.metric'.
+        """
+        changed = []
+        for name in sorted(self.settings.keys() | settings.keys()):
+            old, new = self.settings.get(name), settings.get(name)
+            if isinstance(old, dict) and isinstance(new, dict):
+                changed += [f"{name}.{key}" for key in sorted(old.keys() | new.keys()) if old.get(key) != new.get(key)]
+            elif old != new:
+                changed.append(name)
+        return changed
+
+    def diff(self, pdf_files: List[Path]) -> ManifestDiff:
+        """
+        Compare the manifest against the files currently on disk.
+        Files whose size and mtime are unchanged are not re-hashed.
+        param pdf_files: The files that should be in the database.
+        Returns: The files to add, re-embed, remove and keep.
+        """
+        changes = ManifestDiff()
+        seen = set()
+        for pdf_file in pdf_files:
+            key = self.key(pdf_file)
+            seen.add(key)
+            stat = os.stat(pdf_file)
+            entry = self.files.get(key)
+            if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns:
+                changes.unchanged.append(pdf_file)
+                continue
+
+            sha256 = file_sha256(pdf_file)
+            changes.hashes[key] = sha256
+            if entry is None:
+                changes.added.append(pdf_file)
+            elif entry["sha256"] == sha256:
+                # Touched but not modified: refresh the stat fields only.
+                entry["size"], entry["mtime"] = stat.st_size, stat.st_mtime_ns
+                changes.unchanged.append(pdf_file)
+            else:
+                changes.changed.append(pdf_file)
+
+        changes.deleted = [key for key in self.files if key not in seen]
+        return changes
+
+    def ids_for(self, keys: List[str]) -> np.ndarray:
+        """
+        Returns the chunk IDs contributed by the given files.
+        param keys: Manifest keys of the files.
+        """
+        ranges = [
+            np.arange(self.files[key]["id_start"], self.files[key]["id_end"], dtype=np.int64)
+            for key in keys if key in self.files
+        ]
+        return np.concatenate(ranges) if ranges else np.empty(0, dtype=np.int64)
+
+    def keys_for(self, ids: np.ndarray) -> List[str]:
+        """
+        Returns the files that contributed any of the given chunk IDs.
+        param ids: Chunk IDs.
+        """
+        ids = np.sort(np.asarray(ids, dtype=np.int64))
+        return [
+            key for key, entry in self.files.items()
+            if np.searchsorted(ids, entry["id_start"]) < np.searchsorted(ids, entry["id_end"])
+        ]
+
+    def allocate(self, file_path: Path, sha256: str, chunk_count: int) -> int:
+        """
+        Record a file and reserve a contiguous range of chunk IDs for it.
+        param file_path: The source file.
+        param sha256: The content hash of the file.
+        param chunk_count: Number of chunks produced from the file.
+        Returns: The first chunk ID of the reserved range.
+        """
+        stat = os.stat(file_path)
+        id_start = self.next_id
+        self.next_id += chunk_count
+        self.files[self.key(file_path)] = {
+            "sha256": sha256,
+            "mtime": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "id_start": id_start,
+            "id_end": self.next_id,
+        }
+        return id_start
+
+    def remove(self, key: str) -> None:
+        """Forget a file."""
+        self.files.pop(key, None)
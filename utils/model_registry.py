@@ -0,0 +1,80 @@
+"""
+Process-wide registry of embedding models, so each model is loaded once per process.
+"""
+from typing import TYPE_CHECKING, Dict, Optional
+import streamlit as st
+from loguru import logger
+from utils.hash_embeddings import HashEmbeddings, is_hash_model
+
+if TYPE_CHECKING:
+    from langchain_huggingface import HuggingFaceEmbeddings
+
+EMBEDDING_BACKENDS = ("torch", "onnx")
+
+
+def backend_label(model_name: str, backend: str = "torch", onnx_cfg: Optional[Dict[str, any]] = None) -> str:
+    """
+    Names the runtime that produces a model's vectors: 'torch', 'onnx' or 'onnx-int8'.
+    The hashing stand-in has a single implementation and is always labelled 'torch'.
+    param model_name: The embedding model name.
+    param backend: One of EMBEDDING_BACKENDS.
+    param onnx_cfg: The [onnx] config section.
+    Raises: ValueError: If the backend is not supported.
+    """
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unsupported embedding backend {backend}, expected one of {EMBEDDING_BACKENDS}")
+    if backend == "torch" or is_hash_model(model_name):
+        return "torch"
+    return "onnx-int8" if (onnx_cfg or {}).get("quantize", True) else "onnx"
+
+
+def model_key(model_name: str, backend: str = "torch", onnx_cfg: Optional[Dict[str, any]] = None) -> str:
+    """
+    Identifies the vectors of a model run by a backend, for the embedding and query caches.
+    PyTorch vectors keep the bare model name, so caches filled before backends existed stay valid.
+    param model_name: The embedding model name.
+    param backend: One of EMBEDDING_BACKENDS.
+    param onnx_cfg: The [onnx] config section.
+    """
+    label = backend_label(model_name, backend, onnx_cfg)
+    return model_name if label == "torch" else f"{model_name}@{label}"
+
+
+@st.cache_resource(show_spinner="Loading embedding model...")
+def get_embedding_model(
+    model_name: str,
+    device: str = "cpu",
+    backend: str = "torch",
+    onnx_cfg: Optional[Dict[str, any]] = None
+) -> "HuggingFaceEmbeddings":
+    """
+    Returns the embedding model for a model name, device and backend, loading it on
+    first use. The instance is shared by every DocumentEmbedder, QueryMatcher and
+    Streamlit session in the process. The HuggingFace stack, which pulls in torch,
+    is only imported when the first PyTorch model is loaded.
+    param model_name: HuggingFace model name for embeddings, or hash:<dimension>
+        for the deterministic stand-in that needs no download.
+    param device: The torch device to run the model on.
+    param backend: 'torch', or 'onnx' to run the model in ONNX Runtime on the CPU.
+    param onnx_cfg: The [onnx] config section, used by the onnx backend.
+    Raises: ValueError: If the backend is not supported.
+    """
+    label = backend_label(model_name, backend, onnx_cfg)
+    if is_hash_model(model_name):
+        return HashEmbeddings.from_model_name(model_name)
+    if label != "torch":
+        # pylint: disable=import-outside-toplevel
+        from utils.onnx_embeddings import OnnxEmbeddings
+
+        if device != "cpu":
+            logger.warning(f"The ONNX embedding backend runs on the CPU, ignoring device {device}")
+        logger.info(f"Loading embedding model {model_name} in ONNX Runtime ({label})")
+        return OnnxEmbeddings(model_name, **(onnx_cfg or {}))
+    # pylint: disable=import-outside-toplevel
+    from langchain_huggingface import HuggingFaceEmbeddings
+
+    logger.info(f"Loading embedding model {model_name} on {device}")
+    return HuggingFaceEmbeddings(
+        model_name=model_name,
+        model_kwargs={'device': device}
+    )
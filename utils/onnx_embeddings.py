@@ -0,0 +1,313 @@
+"""
+Runs sentence-transformers embedding models with ONNX Runtime on the CPU.
+
+The first time a model is used it is exported to <folder>/<model>/model.onnx, next to
+its tokenizer and pooling settings, and optionally quantized to int8 as model.int8.onnx.
+Exporting needs torch and sentence-transformers, like the PyTorch backend does;
+running an exported model only needs onnxruntime and tokenizers.
+Texts are sorted by token count and batched so that little of each batch is padding.
+"""
+import inspect
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List
+import numpy as np
+from loguru import logger
+
+MODEL_FILE = "model.onnx"
+QUANTIZED_MODEL_FILE = "model.int8.onnx"
+TOKENIZER_FILE = "tokenizer.json"
+CONFIG_FILE = "embedding_config.json"
+POOLING_MODES = ("mean", "cls")
+
+
+def export_dir_for(folder: str, model_name: str) -> Path:
+    """Returns the folder a model is exported to."""
+    return Path(folder) / model_name.replace("/", "--")
+
+
+def export_model(model_name: str, export_dir: Path) -> None:
+    """
+    Export a sentence-transformers model to ONNX. The graph outputs the token
+    embeddings; pooling and normalization are read from the model and applied
+    by OnnxEmbeddings, so both backends produce the same vectors.
+    param model_name: HuggingFace model name.
+    param export_dir: The folder to write the model, tokenizer and settings to.
+    Raises: ValueError: If the model pools in a way OnnxEmbeddings does not support.
+    """
+    # pylint: disable=import-outside-toplevel
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers.models import Normalize, Pooling
+
+    logger.info(f"Exporting embedding model {model_name} to ONNX at {export_dir}")
+    model = SentenceTransformer(model_name, device="cpu")
+    transformer = model[0]
+    pooling = next(module for module in model if isinstance(module, Pooling)).get_config_dict()
+    # Recent sentence-transformers versions name the pooling mode, older ones set a flag per mode
+    flags = {"mean": pooling.get("pooling_mode_mean_tokens"), "cls": pooling.get("pooling_mode_cls_token")}
+    modes = [mode for mode, flag in flags.items() if flag]
+    pooling_mode = pooling.get("pooling_mode") or (modes[0] if len(modes) == 1 else None)
+    dimension = model.get_sentence_embedding_dimension()
+    if pooling_mode not in POOLING_MODES or dimension != transformer.auto_model.config.hidden_size:
+        raise ValueError(f"{model_name} pools token embeddings in a way the ONNX backend does not support")
+
+    class TokenEmbeddings(torch.nn.Module):
+        """The transformer of the model, returning its last hidden state."""
+
+        def __init__(self, auto_model: torch.nn.Module, input_names: List[str]):
+            super().__init__()
+            self.auto_model = auto_model
+            self.input_names = input_names
+
+        def forward(self, *inputs: torch.Tensor) -> torch.Tensor:  # pylint: disable=missing-function-docstring
+            return self.auto_model(**dict(zip(self.input_names, inputs)), return_dict=True).last_hidden_state
+
+    example = transformer.tokenizer(["An example sentence to trace the model with."], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in example]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names + ["token_embeddings"]}
+
+    # The TorchScript exporter handles dynamic axes; torch 2.9 and later default to the dynamo one
+    legacy_exporter = {"dynamo": False} if "dynamo" in inspect.signature(torch.onnx.export).parameters else {}
+    tmp_dir = Path(f"{export_dir}.tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+    with torch.no_grad():
+        torch.onnx.export(
+            TokenEmbeddings(transformer.auto_model.eval(), input_names),
+            tuple(example[name] for name in input_names),
+            str(tmp_dir / MODEL_FILE),
+            input_names=input_names,
+            output_names=["token_embeddings"],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+            do_constant_folding=True,
+            **legacy_exporter,
+        )
+    transformer.tokenizer.save_pretrained(str(tmp_dir))
+    settings = {
+        "model_name": model_name,
+        "inputs": input_names,
+        "pooling": pooling_mode,
+        "normalize": any(isinstance(module, Normalize) for module in model),
+        "max_length": model.get_max_seq_length(),
+        "pad_token_id": transformer.tokenizer.pad_token_id or 0,
+        "dimension": dimension,
+    }
+    with open(tmp_dir / CONFIG_FILE, "w", encoding="utf-8") as handle:
+        json.dump(settings, handle, indent=2)
+    shutil.rmtree(export_dir, ignore_errors=True)
+    os.replace(tmp_dir, export_dir)
+
+
+def quantize_model(export_dir: Path) -> None:
+    """
+    Quantize the weights of an exported model to int8. Activations are quantized
+    dynamically, per batch, so no calibration data is needed.
+    param export_dir: The folder the model was exported to.
+    """
+    # pylint: disable=import-outside-toplevel
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    logger.info(f"Quantizing the ONNX model at {export_dir} to int8")
+    tmp_path = export_dir / f"{QUANTIZED_MODEL_FILE}.tmp"
+    quantize_dynamic(str(export_dir / MODEL_FILE), str(tmp_path), weight_type=QuantType.QInt8)
+    os.replace(tmp_path, export_dir / QUANTIZED_MODEL_FILE)
+
+
+class OnnxEmbeddings:
+    """
+    Embeds text with an exported sentence-transformers model in ONNX Runtime.
+    Implements the embed_documents and embed_query methods of LangChain embeddings.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        folder: str = "database/onnx",
+        quantize: bool = True,
+        intra_op_threads: int = 0,
+        batch_size: int = 32,
+        max_batch_tokens: int = 2048
+    ):
+        """
+        Constructor for the OnnxEmbeddings class. Exports and quantizes the model if needed.
+        param model_name: HuggingFace model name.
+        param folder: The folder models are exported to.
+        param quantize: Run the int8 quantized model instead of the float32 one.
+        param intra_op_threads: Threads ONNX Runtime uses within an operator, 0 for one per core.
+        param batch_size: Most texts run through the model at once.
+        param max_batch_tokens: Most tokens in a batch, padding included; long texts get smaller batches.
+        """
+        # pylint: disable=import-outside-toplevel
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        export_dir = export_dir_for(folder, model_name)
+        if not (export_dir / CONFIG_FILE).exists():
+            export_model(model_name, export_dir)
+        if quantize and not (export_dir / QUANTIZED_MODEL_FILE).exists():
+            quantize_model(export_dir)
+        with open(export_dir / CONFIG_FILE, "r", encoding="utf-8") as handle:
+            self.settings: Dict[str, any] = json.load(handle)
+
+        self.tokenizer = Tokenizer.from_file(str(export_dir / TOKENIZER_FILE))
+        self.tokenizer.enable_truncation(self.settings["max_length"])
+        self.tokenizer.no_padding()
+        self.batch_size = batch_size
+        self.max_batch_tokens = max_batch_tokens
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        model_path = export_dir / (QUANTIZED_MODEL_FILE if quantize else MODEL_FILE)
+        self.session = ort.InferenceSession(str(model_path), options, providers=["CPUExecutionProvider"])
+        logger.info(f"Loaded ONNX embedding model {model_path} with {intra_op_threads or 'all'} intra-op threads")
+
+    def _batches(self, lengths: np.ndarray) -> Iterator[np.ndarray]:
+        """
+        Group texts of similar length, shortest first, so each batch is padded to
+        little more than its texts need and holds at most max_batch_tokens tokens.
+        param lengths: The token count of each text.
+        Returns: An iterator of arrays of text positions.
+        """
+        order = np.argsort(lengths, kind="stable")
+        start = 0
+        while start < len(order):
+            end = start + 1
+            # Sorted by length, so the last text of a batch is its longest
+            while (
+                end < len(order) and end - start < self.batch_size
+                and (end - start + 1) * lengths[order[end]] <= self.max_batch_tokens
+            ):
+                end += 1
+            yield order[start:end]
+            start = end
+
+    def _run(self, encodings: List[any]) -> np.ndarray:
+        """Returns the sentence embeddings of a batch of tokenized texts."""
+        length = max(len(encoding.ids) for encoding in encodings)
+        input_ids = np.full((len(encodings), length), self.settings["pad_token_id"], dtype=np.int64)
+        attention_mask = np.zeros((len(encodings), length), dtype=np.int64)
+        for row, encoding in enumerate(encodings):
+            input_ids[row, :len(encoding.ids)] = encoding.ids
+            attention_mask[row, :len(encoding.ids)] = 1
+        inputs = {"input_ids": input_ids, "attention_mask": attention_mask, "token_type_ids": np.zeros_like(input_ids)}
+        token_embeddings = self.session.run(None, {name: inputs[name] for name in self.settings["inputs"]})[0]
+
+        if self.settings["pooling"] == "cls":
+            vectors = token_embeddings[:, 0]
+        else:
+            mask = attention_mask[:, :, None].astype(np.float32)
+            vectors = (token_embeddings * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        if self.settings["normalize"]:
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return vectors
+
+    def embed_array(self, texts: List[str]) -> np.ndarray:
+        """
+        Embed a batch of texts.
+        param texts: The texts to embed.
+        Returns: A float32 array with one row per text, in the order of texts.
+        """
+        vectors = np.empty((len(texts), self.settings["dimension"]), dtype=np.float32)
+        if not texts:
+            return vectors
+        encodings = self.tokenizer.encode_batch(texts)
+        lengths = np.array([len(encoding.ids) for encoding in encodings])
+        for positions in self._batches(lengths):
+            vectors[positions] = self._run([encodings[position] for position in positions])
+        return vectors
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed a batch of texts.
+        param texts: The texts to embed.
+        """
+        return self.embed_array(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        """
+        Embed a query.
+        param text: The query text.
+        """
+        return self.embed_array([text])[0].tolist()
+
+
+def embedding_agreement(
+    reference: any,
+    candidate: any,
+    documents: List[str],
+    queries: List[str],
+    k: int = 5
+) -> Dict[str, any]:
+    """
+    Compare the embeddings of two backends of the same model, e.g. PyTorch and int8 ONNX.
+    param reference: The embeddings model whose vectors are trusted.
+    param candidate: The embeddings model being checked.
+    param documents: Texts embedded by both, typically chunks of the corpus.
+    param queries: Queries whose top-k documents are compared between the two.
+    param k: Matches compared per query.
+    Returns: The cosine similarity between the two vectors of each document, how many
+        of each query's top-k documents both find, and the time each backend took.
+    """
+    vectors, seconds = [], []
+    for model in (reference, candidate):
+        start = time.perf_counter()
+        document_vectors = np.asarray(model.embed_documents(documents), dtype=np.float32)
+        query_vectors = np.asarray([model.embed_query(query) for query in queries], dtype=np.float32)
+        seconds.append(time.perf_counter() - start)
+        # Compared by cosine similarity whether or not the model normalizes its vectors
+        document_vectors /= np.maximum(np.linalg.norm(document_vectors, axis=1, keepdims=True), 1e-12)
+        query_vectors /= np.maximum(np.linalg.norm(query_vectors, axis=1, keepdims=True), 1e-12)
+        vectors.append((document_vectors, query_vectors))
+
+    (reference_docs, reference_queries), (candidate_docs, candidate_queries) = vectors
+    cosine = np.sum(reference_docs * candidate_docs, axis=1)
+    k = min(k, len(documents))
+    reference_top = np.argsort(-(reference_queries @ reference_docs.T), axis=1)[:, :k]
+    candidate_top = np.argsort(-(candidate_queries @ candidate_docs.T), axis=1)[:, :k]
+    overlap = [len(set(ref) & set(cand)) / k for ref, cand in zip(reference_top, candidate_top)]
+    return {
+        "documents": len(documents),
+        "queries": len(queries),
+        "k": k,
+        "cosine": {
+            "mean": float(cosine.mean()),
+            "min": float(cosine.min()),
+            "p1": float(np.percentile(cosine, 1)),
+        },
+        "topk_overlap": float(np.mean(overlap)) if overlap else None,
+        "top1_agreement": float(np.mean(reference_top[:, 0] == candidate_top[:, 0])) if overlap else None,
+        "reference_s": seconds[0],
+        "candidate_s": seconds[1],
+        "speedup": seconds[0] / seconds[1] if seconds[1] else None,
+    }
+
+
+def format_agreement(report: Dict[str, any]) -> str:
+    """
+    Render an agreement report as plain text.
+    param report: The result of embedding_agreement, with the 'passed' verdict added.
+    """
+    lines = [
+        f"{report['documents']} documents, {report['queries']} queries",
+        f"cosine similarity   mean {report['cosine']['mean']:.5f}  p1 {report['cosine']['p1']:.5f}  "
+        f"min {report['cosine']['min']:.5f}",
+    ]
+    if report["topk_overlap"] is not None:
+        lines.append(
+            f"top-{report['k']} overlap       {report['topk_overlap']:.3f}  top-1 agreement {report['top1_agreement']:.3f}"
+        )
+    lines.append(
+        f"embedding time      reference {report['reference_s']:.2f} s  candidate {report['candidate_s']:.2f} s  "
+        f"speedup {report['speedup']:.2f}x"
+    )
+    if "passed" in report:
+        lines.append("PASS" if report["passed"] else "FAIL")
+    return "\n".join(lines)
@@ -0,0 +1,116 @@
+"""
+Pluggable PDF text extraction backends, selected by the [ingest] pdf_backend setting.
+
+Every backend yields one LangChain document per page, with the same metadata
+PyPDFLoader sets ('source', 0-based 'page' and 'total_pages'), so pages can be
+split as they are extracted and databases built with any backend look alike.
+    pypdf   - pure Python, always available; the text PyPDFLoader extracts
+    pymupdf - MuPDF, much faster on long documents; needs `pip install pymupdf`
+    pdfium  - PDFium, fast and tolerant of damaged files; needs `pip install pypdfium2`
+"""
+from abc import ABC, abstractmethod
+from typing import Dict, Iterator, Type
+from langchain_core.documents import Document
+
+
+class PdfExtractor(ABC):
+    """Abstract base class that all PDF extraction backends must inherit from."""
+
+    # The name the backend is selected by in config.toml
+    name: str = ""
+
+    @abstractmethod
+    def iter_pages(self, pdf_path: str) -> Iterator[Document]:
+        """
+        Extract the text of a PDF one page at a time.
+        param pdf_path: Path to the PDF file.
+        Returns: An iterator of page documents, in page order.
+        """
+
+    @staticmethod
+    def page_document(text: str, pdf_path: str, page: int, total_pages: int) -> Document:
+        """Returns the document of one page, with the metadata PyPDFLoader would give it."""
+        return Document(
+            page_content=text.strip(),
+            metadata={"source": pdf_path, "page": page, "total_pages": total_pages},
+        )
+
+
+class PyPdfExtractor(PdfExtractor):
+    """Extracts text with pypdf, page by page rather than loading every page first."""
+
+    name = "pypdf"
+
+    def iter_pages(self, pdf_path: str) -> Iterator[Document]:
+        # pylint: disable=import-outside-toplevel
+        from pypdf import PdfReader
+
+        reader = PdfReader(pdf_path)
+        total_pages = len(reader.pages)
+        for page_number, page in enumerate(reader.pages):
+            yield self.page_document(page.extract_text(), pdf_path, page_number, total_pages)
+
+
+class PyMuPdfExtractor(PdfExtractor):
+    """Extracts text with MuPDF through PyMuPDF."""
+
+    name = "pymupdf"
+
+    def iter_pages(self, pdf_path: str) -> Iterator[Document]:
+        # pylint: disable=import-outside-toplevel
+        import pymupdf
+
+        with pymupdf.open(pdf_path) as document:
+            for page_number, page in enumerate(document):
+                yield self.page_document(page.get_text(), pdf_path, page_number, document.page_count)
+
+
+class PdfiumExtractor(PdfExtractor):
+    """Extracts text with PDFium through pypdfium2."""
+
+    name = "pdfium"
+
+    def iter_pages(self, pdf_path: str) -> Iterator[Document]:
+        # pylint: disable=import-outside-toplevel
+        import pypdfium2
+
+        document = pypdfium2.PdfDocument(pdf_path)
+        try:
+            total_pages = len(document)
+            for page_number in range(total_pages):
+                page = document[page_number]
+                text_page = page.get_textpage()
+                try:
+                    # PDFium ends lines with CRLF; the other backends use LF
+                    text = text_page.get_text_range().replace("\r\n", "\n")
+                finally:
+                    text_page.close()
+                    page.close()
+                yield self.page_document(text, pdf_path, page_number, total_pages)
+        finally:
+            document.close()
+
+
+EXTRACTORS: Dict[str, Type[PdfExtractor]] = {
+    extractor.name: extractor for extractor in (PyPdfExtractor, PyMuPdfExtractor, PdfiumExtractor)
+}
+# The module each backend imports, to report a missing optional dependency clearly
+BACKEND_MODULES = {"pypdf": "pypdf", "pymupdf": "pymupdf", "pdfium": "pypdfium2"}
+
+
+def get_extractor(name: str) -> PdfExtractor:
+    """
+    Returns the extraction backend with a given name.
+    param name: One of the keys of EXTRACTORS.
+    Raises: ValueError: If there is no such backend.
+        ImportError: If the package the backend needs is not installed.
+    """
+    if name not in EXTRACTORS:
+        raise ValueError(f"Unsupported PDF backend {name}, expected one of {tuple(EXTRACTORS)}")
+    try:
+        __import__(BACKEND_MODULES[name])
+    except ImportError as e:
+        raise ImportError(
+            f"The {name} PDF backend needs the {BACKEND_MODULES[name]} package: pip install {BACKEND_MODULES[name]}"
+        ) from e
+    return EXTRACTORS[name]()
@@ -0,0 +1,138 @@
+"""
+Parallel PDF parsing and chunking for the ingestion pipeline.
+"""
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from utils.pdf_extraction import PdfExtractor, get_extractor
+
+# Set once per worker process by _init_worker
+_SPLITTER: Optional[RecursiveCharacterTextSplitter] = None
+_EXTRACTOR: Optional[PdfExtractor] = None
+# Files submitted to the pool per worker ahead of the one being consumed
+WINDOW_PER_WORKER = 2
+
+
+def _init_worker(chunk_size: int, chunk_overlap: int, backend: str = "pypdf") -> None:
+    """Create the text splitter and PDF extractor used by this worker process."""
+    global _SPLITTER, _EXTRACTOR  # pylint: disable=W0603
+    _SPLITTER = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap
+    )
+    _EXTRACTOR = get_extractor(backend)
+
+
+def split_pages(
+    extractor: PdfExtractor,
+    splitter: RecursiveCharacterTextSplitter,
+    pdf_path: str,
+    stats: Optional[Dict[str, float]] = None
+) -> List[any]:
+    """
+    Chunk a PDF page by page as the extractor yields pages, so only one page of
+    text is held besides the chunks. The splitter splits each page on its own,
+    so the chunks are the same as splitting the list of all pages.
+    param extractor: The PDF extraction backend.
+    param splitter: The text splitter.
+    param pdf_path: Path to the PDF file.
+    param stats: Updated with the page count and the seconds spent extracting and splitting.
+    Returns: The chunks, as LangChain documents.
+    """
+    chunks, page_count, load_s, split_s = [], 0, 0.0, 0.0
+    pages = extractor.iter_pages(pdf_path)
+    while True:
+        start = time.perf_counter()
+        page = next(pages, None)
+        extracted = time.perf_counter()
+        load_s += extracted - start
+        if page is None:
+            break
+        chunks.extend(splitter.split_documents([page]))
+        split_s += time.perf_counter() - extracted
+        page_count += 1
+    if stats is not None:
+        stats.update(pages=page_count, load_s=load_s, split_s=split_s)
+    return chunks
+
+
+def _parse_pdf(pdf_path: str) -> Tuple[str, List[any], Optional[str], Dict[str, float]]:
+    """
+    Load and chunk one PDF. Errors are returned rather than raised so that one
+    bad file does not abort the whole batch.
+    param pdf_path: Path to the PDF file.
+    Returns: The path, its chunks, an error message or None, and the file's size
+        in bytes, page count and seconds spent loading and splitting it.
+    """
+    stats = {"bytes": 0, "pages": 0, "load_s": 0.0, "split_s": 0.0}
+    try:
+        stats["bytes"] = os.path.getsize(pdf_path)
+        return pdf_path, split_pages(_EXTRACTOR, _SPLITTER, pdf_path, stats), None, stats
+    except Exception as e: # pylint: disable=W0718
+        return pdf_path, [], str(e), stats
+
+
+def resolve_workers(workers: int) -> int:
+    """
+    Returns the number of worker processes to use.
+    param workers: The configured worker count, 0 for one per CPU core.
+    """
+    return workers if workers > 0 else (os.cpu_count() or 1)
+
+
+def parse_pdfs(
+    pdf_files: List[Path],
+    chunk_size: int,
+    chunk_overlap: int,
+    workers: int = 1,
+    backend: str = "pypdf"
+) -> Iterator[Tuple[Path, List[any], Optional[str], Dict[str, float]]]:
+    """
+    Parse and chunk PDFs on a process pool.
+    Results are yielded in the order of pdf_files, whatever order the workers
+    finish in, so chunk IDs assigned from them are reproducible across runs.
+    At most WINDOW_PER_WORKER files per worker are parsed ahead of the consumer.
+    param pdf_files: The files to parse.
+    param chunk_size: Size of text chunks.
+    param chunk_overlap: Overlap between chunks.
+    param workers: Number of worker processes, 0 for one per CPU core.
+    param backend: The PDF extraction backend, see utils.pdf_extraction.
+    Returns: An iterator of (file, chunks, error message or None, stats), where stats
+        holds the file's bytes, pages, load_s and split_s.
+    """
+    paths = [str(pdf_file) for pdf_file in pdf_files]
+    workers = min(resolve_workers(workers), len(paths))
+
+    # Fail here, not in every worker, when the backend is unknown or not installed
+    get_extractor(backend)
+    if workers <= 1:
+        _init_worker(chunk_size, chunk_overlap, backend)
+        for path, chunks, error, stats in map(_parse_pdf, paths):
+            yield Path(path), chunks, error, stats
+        return
+
+    # Spawn rather than fork: the parent may already hold model threads
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=context,
+        initializer=_init_worker,
+        initargs=(chunk_size, chunk_overlap, backend)
+    ) as pool:
+        # Not Executor.map: it submits every file up front and keeps each parsed file until it
+        # is consumed, so parsing would run ahead of embedding with the whole corpus in memory
+        window = deque()
+        pending = iter(paths)
+        for path in islice(pending, WINDOW_PER_WORKER * workers):
+            window.append(pool.submit(_parse_pdf, path))
+        while window:
+            path, chunks, error, stats = window.popleft().result()
+            for next_path in islice(pending, 1):
+                window.append(pool.submit(_parse_pdf, next_path))
+            yield Path(path), chunks, error, stats
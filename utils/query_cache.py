@@ -0,0 +1,116 @@
+"""
+In-process LRU caches, with expiry, for query embeddings and top-k results.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional
+import streamlit as st
+
+
+class TTLCache:
+    """A thread-safe LRU cache whose entries also expire after a fixed time."""
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 3600):
+        """
+        Constructor for the TTLCache class.
+        param max_entries: Entries kept before the least recently used is dropped, 0 to disable caching.
+        param ttl_seconds: Seconds an entry stays valid, 0 for no expiry.
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[any]:
+        """
+        Returns the cached value, or None if it is missing or expired.
+        param key: The cache key.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl_seconds and time.monotonic() - entry[0] > self.ttl_seconds:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, value: any) -> None:
+        """
+        Store a value, dropping the least recently used entry if the cache is full.
+        param key: The cache key.
+        param value: The value to cache.
+        """
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Drop all entries."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, any]:
+        """Returns the hit and miss counters and the number of entries."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+        }
+
+
+class QueryCache:
+    """
+    Caches query embeddings by (model, normalized query) and top-k results by
+    (model, normalized query, k, search parameters, database, index generation).
+    Results are keyed by the generation of the index they came from, so a
+    rebuilt index never serves results cached from the previous one.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 3600, case_sensitive: bool = False):
+        """
+        Constructor for the QueryCache class.
+        param max_entries: Entries kept in each cache, 0 to disable caching.
+        param ttl_seconds: Seconds an entry stays valid, 0 for no expiry.
+        param case_sensitive: Treat queries differing only in case as different.
+        """
+        self.case_sensitive = case_sensitive
+        self.embeddings = TTLCache(max_entries, ttl_seconds)
+        self.results = TTLCache(max_entries, ttl_seconds)
+
+    def normalize(self, query: str) -> str:
+        """Returns the query with whitespace collapsed and, unless case sensitive, case folded."""
+        query = " ".join(query.split())
+        return query if self.case_sensitive else query.casefold()
+
+    def clear(self) -> None:
+        """Drop all cached embeddings and results."""
+        self.embeddings.clear()
+        self.results.clear()
+
+    def stats(self) -> Dict[str, Dict[str, any]]:
+        """Returns the counters of both caches."""
+        return {"embeddings": self.embeddings.stats(), "results": self.results.stats()}
+
+
+@st.cache_resource
+def get_query_cache(max_entries: int = 1024, ttl_seconds: float = 3600, case_sensitive: bool = False) -> QueryCache:
+    """
+    Returns the query cache shared by all Streamlit sessions in this process.
+    param max_entries: Entries kept in each cache, 0 to disable caching.
+    param ttl_seconds: Seconds an entry stays valid, 0 for no expiry.
+    param case_sensitive: Treat queries differing only in case as different.
+    """
+    return QueryCache(max_entries, ttl_seconds, case_sensitive)
@@ -1,12 +1,24 @@
 """
 Utility functions for matching queries against the FAISS database.
 """
-from typing import List, Tuple
+import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-import numpy as np
+from typing import Callable, Dict, List, Optional, Tuple
 import faiss
-from langchain_huggingface import HuggingFaceEmbeddings
+import numpy as np
+import streamlit as st
 from loguru import logger
+from utils.index_factory import rerank_exact, search_parameters, similarity_scores
+from utils.index_registry import IndexRegistry, LoadedIndex, get_index_registry
+from utils.model_registry import get_embedding_model, model_key
+from utils.query_cache import QueryCache, TTLCache, get_query_cache
+from utils.search_filter import SearchFilter
+from utils.telemetry import Telemetry, Trace, get_telemetry
+
+# Filters leaving at most this many chunks in a shard are scored exactly, which is
+# faster than a filtered index search and never returns fewer than k matches
+BRUTE_FORCE_ROWS = 4096
 
 
 class QueryMatcher:
@@ -15,7 +27,22 @@ class QueryMatcher:
     def __init__(
         self,
         model_name: str = "all-MiniLM-L6-v2",
-        k: int = 5
+        k: int = 5,
+        registry: IndexRegistry = None,
+        query_cache: QueryCache = None,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        device: str = "cpu",
+        rerank: Optional[int] = None,
+        min_score: float = 0.0,
+        score_margin: float = 0.0,
+        hybrid: bool = False,
+        hybrid_candidates: int = 50,
+        rrf_k: int = 60,
+        telemetry: Telemetry = None,
+        backend: str = "torch",
+        onnx_cfg: Optional[Dict[str, any]] = None,
+        executor: ThreadPoolExecutor = None
     ):
         """
         Initialize the query matcher.
@@ -23,55 +50,427 @@ class QueryMatcher:
         Args:
             model_name: HuggingFace model name for embeddings
             k: Number of matches to return
+            registry: Registry of loaded indexes, defaults to the process-wide one
+            query_cache: Cache of query embeddings and results, defaults to the process-wide one
+            nprobe: Inverted lists probed by IVF indexes, defaults to the value recorded at build time
+            ef_search: Candidate list size for HNSW indexes, defaults to the value recorded at build time
+            device: The device to run the embedding model on
+            rerank: Candidates re-scored exactly against the raw vectors kept on disk,
+                0 to disable; defaults to the value recorded at build time and is
+                ignored for databases built without raw vectors
+            min_score: Drop matches scoring below this, 0 to disable; meant for cosine
+                databases, whose scores are cosine similarities
+            score_margin: Dynamic k; drop matches scoring more than this below the best
+                match, so fewer than k are returned when only a few are relevant, 0 to disable
+            hybrid: Fuse BM25 keyword matches with vector matches by reciprocal-rank fusion.
+                Scores are then fused ranks, and min_score and score_margin do not apply
+            hybrid_candidates: Matches taken from each of the two searches before fusing
+            rrf_k: Rank constant of reciprocal-rank fusion
+            telemetry: Records stage timings of every batch of queries, defaults to the process-wide one
+            backend: The runtime of the embedding model, 'torch' or 'onnx'
+            onnx_cfg: The [onnx] config section, used by the onnx backend
+            executor: Thread pool searching shards in parallel, defaults to the process-wide one
         """
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name=model_name,
-            model_kwargs={'device': 'cpu'}
-        )
+        self.model_name = model_name
+        self.embeddings = get_embedding_model(model_name, device, backend, onnx_cfg)
+        # Query embeddings and results are cached per model and backend
+        self.model_key = model_key(model_name, backend, onnx_cfg)
         self.k = k
+        self.registry = registry or get_index_registry()
+        self.query_cache = query_cache or get_query_cache()
+        self.telemetry = telemetry or get_telemetry()
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.rerank = rerank
+        self.min_score = min_score
+        self.score_margin = score_margin
+        self.hybrid = hybrid
+        self.hybrid_candidates = hybrid_candidates
+        self.rrf_k = rrf_k
+        self._executor = executor or get_search_executor()
+        # Rows selected by recent filters, per shard generation
+        self._filter_rows = TTLCache(max_entries=64, ttl_seconds=0)
 
-    def match_query(self, query: str, db_path: str) -> List[Tuple[str, float]]:
+    @classmethod
+    def from_config(cls, cfg: Dict[str, any], **overrides: any) -> "QueryMatcher":
+        """
+        Create a matcher from the application configuration.
+        param cfg: The application configuration.
+        param overrides: Constructor arguments that take precedence over the config, e.g. k or
+            model_name. None values are ignored, so optional command-line flags can be passed as they are.
+        """
+        settings = {
+            "model_name": cfg["embeddings"]["model_name"],
+            "device": cfg["embeddings"]["device"],
+            "backend": cfg["embeddings"]["backend"],
+            "onnx_cfg": cfg["onnx"],
+            "nprobe": cfg["index"]["nprobe"],
+            "ef_search": cfg["index"]["ef_search"],
+            "rerank": cfg["index"]["rerank"],
+            "min_score": cfg["query"]["min_score"],
+            "score_margin": cfg["query"]["score_margin"],
+            "hybrid": cfg["query"]["hybrid"],
+            "hybrid_candidates": cfg["query"]["hybrid_candidates"],
+            "rrf_k": cfg["query"]["rrf_k"],
+        }
+        settings.update({name: value for name, value in overrides.items() if value is not None})
+        if "query_cache" not in settings:
+            settings["query_cache"] = get_query_cache(**cfg["query-cache"])
+        if "telemetry" not in settings:
+            settings["telemetry"] = get_telemetry(**cfg["telemetry"])
+        return cls(**settings)
+
+    def match_query(
+        self,
+        query: str,
+        db_path: str,
+        search_filter: Optional[SearchFilter] = None,
+        with_sources: bool = False
+    ) -> List[Tuple[str, float]]:
         """
         Match a query against the FAISS database.
         
         Args:
             query: The query string
             db_path: Path to the FAISS database directory
+            search_filter: Only match chunks from these files, pages or dates
+            with_sources: Also return where each match occurs, see match_queries
             
         Returns:
             List of tuples containing (chunk_text, similarity_score)
         """
+        return self.match_queries([query], db_path, search_filter=search_filter, with_sources=with_sources)[0]
+
+    def match_queries(
+        self,
+        queries: List[str],
+        db_path: str,
+        batch_size: int = 64,
+        search_filter: Optional[SearchFilter] = None,
+        with_sources: bool = False
+    ) -> List[List[Tuple[str, float]]]:
+        """
+        Match many queries against the FAISS database with one matrix search per shard.
+        Queries whose results are cached for the current index generation are
+        not embedded or searched again. A filter is applied inside the index
+        search, so it never uses up any of the k results. Stage timings and
+        cache hits are recorded as a 'query' trace.
+
+        Args:
+            queries: The query strings
+            db_path: Path to the FAISS database directory
+            batch_size: Number of queries embedded per call to the model
+            search_filter: Only match chunks from these files, pages or dates
+            with_sources: Add a third element to each match, the ChunkStore.references of
+                its chunk: its chunk ID, source and page, then those of the near-duplicates
+                merged into it at ingest
+
+        Returns:
+            For each query, a list of tuples containing (chunk_text, similarity_score)
+        """
         try:
-            # Load the FAISS index
-            index_path = Path(db_path) / "index.faiss"
-            if not index_path.exists():
-                raise FileNotFoundError(f"FAISS index not found at {index_path}")
-                
-            index = faiss.read_index(str(index_path))
-            
-            # Load the stored documents
-            docs_path = Path(db_path) / "documents.npy"
-            if not docs_path.exists():
-                raise FileNotFoundError(f"Document store not found at {docs_path}")
-                
-            stored_docs = np.load(str(docs_path), allow_pickle=True)
-            
-            # Generate embedding for the query
-            query_embedding = self.embeddings.embed_query(query)
-            query_embedding = np.array([query_embedding], dtype=np.float32)
-            
-            # Search the index
-            distances, indices = index.search(query_embedding, self.k)
-            
-            # Get matching chunks with their scores
-            results = []
-            for idx, dist in zip(indices[0], distances[0]):
-                if idx < len(stored_docs):  # Ensure index is valid
-                    similarity = 1 - dist  # Convert distance to similarity score
-                    results.append((stored_docs[idx].page_content, similarity))
-            
-            return results
-            
+            with self.telemetry.trace("query", db_path=str(db_path), hybrid=self.hybrid) as trace:
+                return self._match(queries, db_path, batch_size, search_filter, with_sources, trace)
         except Exception as e:
             logger.error(f"Error matching query: {str(e)}")
             raise RuntimeError(f"Failed to match query: {str(e)}")
+
+    def _match(
+        self,
+        queries: List[str],
+        db_path: str,
+        batch_size: int,
+        search_filter: Optional[SearchFilter],
+        with_sources: bool,
+        trace: Trace
+    ) -> List[List[Tuple]]:
+        """
+        Answer a batch of queries for match_queries, recording each stage in the trace.
+        Returns: For each query, tuples of (chunk_text, similarity_score), with the
+            references of the chunk as a third element when with_sources is set.
+        """
+        # The loaded shards are shared and only reloaded when their files change
+        with trace.span("load"):
+            shards = self.registry.get_shards(db_path)
+        if search_filter is not None and search_filter.is_empty:
+            search_filter = None
+        trace.count("queries", len(queries))
+        trace.count("filtered_queries", len(queries) if search_filter is not None else 0)
+        if not shards:
+            # Every file of the database was deleted
+            return [[] for _ in queries]
+
+        with trace.span("cache"):
+            normalized = [self.query_cache.normalize(query) for query in queries]
+            db_key = str(Path(db_path).resolve())
+            signature = tuple(shard.signature for shard in shards)
+            settings = (
+                self.k, self.nprobe, self.ef_search, self.rerank, self.hybrid, self.hybrid_candidates, self.rrf_k
+            )
+            # Results with sources are cached apart, so plain queries never look up references
+            result_keys = [
+                (self.model_key, text, settings, search_filter, with_sources, db_key, signature)
+                for text in normalized
+            ]
+            results = [self.query_cache.results.get(key) for key in result_keys]
+        pending = [position for position, result in enumerate(results) if result is None]
+        trace.count("result_cache_hits", len(queries) - len(pending))
+        if not pending:
+            return [self._prune(result) for result in results]
+
+        # Generate embeddings for the queries that were not cached; the model sees the
+        # query as typed, the normalized form only keys the caches
+        query_embeddings = self._embed_queries(
+            [queries[position] for position in pending], [normalized[position] for position in pending],
+            batch_size, trace
+        )
+
+        # Search every shard, then keep the k best scoring chunks across shards
+        trace.count("shards_searched", len(shards))
+        if self.hybrid:
+            depth = max(self.k, self.hybrid_candidates)
+            with trace.span("search"):
+                dense = self._search_shards(shards, query_embeddings, depth, search_filter)
+            texts = [queries[position] for position in pending]
+            with trace.span("bm25"):
+                sparse = self._search_sparse(shards, texts, depth, search_filter)
+            with trace.span("fuse"):
+                similarities, shard_numbers, positions = self._fuse(dense, sparse)
+        else:
+            with trace.span("search"):
+                similarities, shard_numbers, positions = self._search_shards(
+                    shards, query_embeddings, self.k, search_filter
+                )
+
+        # Get matching chunks with their scores
+        with trace.span("fetch"):
+            for query_position, row_shards, row_positions, row_similarities, valid in zip(
+                pending, shard_numbers, positions, similarities, positions >= 0
+            ):
+                matches = [
+                    (shards[shard].store.chunk_text(position), similarity, shards[shard].store.references(position))
+                    if with_sources else (shards[shard].store.chunk_text(position), similarity)
+                    for shard, position, similarity in zip(
+                        row_shards[valid], row_positions[valid], row_similarities[valid]
+                    )
+                ]
+                results[query_position] = matches
+                self.query_cache.results.put(result_keys[query_position], tuple(matches))
+        trace.count("matches", int(np.count_nonzero(positions >= 0)))
+
+        return [self._prune(result) for result in results]
+
+    def _search_shards(
+        self,
+        shards: List[LoadedIndex],
+        query_embeddings: np.ndarray,
+        depth: int,
+        search_filter: Optional[SearchFilter] = None
+    ) -> Tuple[np.ndarray, ...]:
+        """
+        Search the shards in parallel and merge their results by score.
+        FAISS releases the GIL while searching, so the shards are searched concurrently.
+        param shards: The loaded shards.
+        param query_embeddings: A float32 matrix with one row per query.
+        param depth: Number of results per query.
+        param search_filter: Restricts each search to the rows the filter selects.
+        Returns: The similarity scores, shard numbers and chunk store positions of the
+            depth best chunks for each query, with position -1 where there are fewer.
+        """
+        def search(shard: LoadedIndex) -> Tuple[np.ndarray, np.ndarray]:
+            queries = query_embeddings
+            if shard.spec.metric == "cosine":
+                queries = query_embeddings.copy()
+                faiss.normalize_L2(queries)
+
+            selector = None
+            if search_filter is not None:
+                mask, rows = self._filtered_rows(shard, search_filter)
+                # IVF indexes cannot return their vectors, so without raw vectors they always use a selector
+                exact = shard.store.vectors is not None or not shard.spec.is_ivf
+                if len(rows) == 0 or not shard.spec.supports_selector or (exact and len(rows) <= BRUTE_FORCE_ROWS):
+                    return self._brute_force(shard, queries, rows, depth)
+                if len(rows) < len(mask):
+                    selector = faiss.IDSelectorBatch(shard.store.ids[rows])
+            params = search_parameters(shard.spec, self.nprobe, self.ef_search, selector)
+            rerank = shard.spec.rerank if self.rerank is None else self.rerank
+            if rerank and shard.store.vectors is not None:
+                # Over-fetch from the compressed index, then keep the exact k best
+                _, indices = shard.index.search(queries, max(depth, rerank), params=params)
+                distances, positions = rerank_exact(
+                    shard.store.vectors, queries, shard.store.lookup(indices), depth, shard.spec.metric
+                )
+            else:
+                distances, indices = shard.index.search(queries, depth, params=params)
+                positions = shard.store.lookup(indices)  # -1 where the index is invalid
+            return similarity_scores(shard.spec, distances), positions
+
+        return self._merge(self._map_shards(search, shards), depth)
+
+    def _search_sparse(
+        self,
+        shards: List[LoadedIndex],
+        texts: List[str],
+        depth: int,
+        search_filter: Optional[SearchFilter] = None
+    ) -> Tuple[np.ndarray, ...]:
+        """
+        Search the BM25 index of every shard that has one and merge the results by score.
+        param shards: The loaded shards.
+        param texts: The queries; the BM25 tokenizer lowercases them.
+        param depth: Number of results per query.
+        param search_filter: Restricts each search to the rows the filter selects.
+        Returns: The BM25 scores, shard numbers and chunk store positions of the depth
+            best chunks for each query, with position -1 where there are fewer.
+        """
+        def search(shard: LoadedIndex) -> Tuple[np.ndarray, np.ndarray]:
+            scores = np.full((len(texts), depth), -np.inf, dtype=np.float32)
+            positions = np.full((len(texts), depth), -1, dtype=np.int64)
+            if shard.bm25 is not None:
+                mask = self._filtered_rows(shard, search_filter)[0] if search_filter is not None else None
+                for row, text in enumerate(texts):
+                    scores[row], positions[row] = shard.bm25.search(text, depth, mask)
+            return scores, positions
+
+        return self._merge(self._map_shards(search, shards), depth)
+
+    def _filtered_rows(self, shard: LoadedIndex, search_filter: SearchFilter) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the boolean row mask of a filter over a shard's chunk store and the
+        selected row positions, evaluated once per filter and shard generation.
+        """
+        key = (str(shard.store.store_dir), shard.signature, search_filter)
+        selected = self._filter_rows.get(key)
+        if selected is None:
+            mask = search_filter.row_mask(shard.store)
+            selected = (mask, np.flatnonzero(mask))
+            self._filter_rows.put(key, selected)
+        return selected
+
+    @staticmethod
+    def _brute_force(shard: LoadedIndex, queries: np.ndarray, rows: np.ndarray, depth: int) -> Tuple[np.ndarray, ...]:
+        """
+        Score the queries exactly against a few selected rows, using the raw vectors
+        when the database keeps them and the vectors stored in the index otherwise.
+        Returns: The similarity scores and positions of the depth best rows per query.
+        """
+        if len(rows) == 0:
+            return np.zeros((len(queries), 0), dtype=np.float32), np.zeros((len(queries), 0), dtype=np.int64)
+        if shard.store.vectors is not None:
+            vectors = np.asarray(shard.store.vectors[rows])
+        else:
+            vectors = shard.index.reconstruct_batch(shard.store.ids[rows])
+        distances, local = faiss.knn(queries, vectors, min(depth, len(rows)), metric=shard.spec.faiss_metric)
+        return similarity_scores(shard.spec, distances), np.where(local >= 0, rows[local], -1)
+
+    def _map_shards(self, search: Callable, shards: List[LoadedIndex]) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Run a search on every shard, in parallel when there are several."""
+        if len(shards) == 1:
+            return [search(shards[0])]
+        return list(self._executor.map(search, shards))
+
+    @staticmethod
+    def _merge(searched: List[Tuple[np.ndarray, np.ndarray]], depth: int) -> Tuple[np.ndarray, ...]:
+        """
+        Merge per-shard (scores, positions) results, keeping the depth best per query.
+        Returns: The scores, shard numbers and positions of the merged results.
+        """
+        if len(searched) == 1:
+            scores, positions = searched[0]
+            return scores, np.zeros_like(positions), positions
+
+        scores = np.hstack([shard_scores for shard_scores, _ in searched])
+        positions = np.hstack([shard_positions for _, shard_positions in searched])
+        shard_numbers = np.hstack([
+            np.full_like(shard_positions, shard) for shard, (_, shard_positions) in enumerate(searched)
+        ])
+
+        scores[positions < 0] = -np.inf
+        top = np.argsort(-scores, axis=1, kind="stable")[:, :depth]
+        return (
+            np.take_along_axis(scores, top, axis=1),
+            np.take_along_axis(shard_numbers, top, axis=1),
+            np.take_along_axis(positions, top, axis=1),
+        )
+
+    def _fuse(self, dense: Tuple[np.ndarray, ...], sparse: Tuple[np.ndarray, ...]) -> Tuple[np.ndarray, ...]:
+        """
+        Combine vector and BM25 results by reciprocal-rank fusion: each chunk scores
+        the sum of 1 / (rrf_k + rank) over the result lists it appears in.
+        param dense: Scores, shard numbers and positions from _search_shards.
+        param sparse: Scores, shard numbers and positions from _search_sparse.
+        Returns: The fused scores, shard numbers and positions of the k best chunks per query.
+        """
+        query_count = len(dense[2])
+        scores = np.zeros((query_count, self.k), dtype=np.float32)
+        shard_numbers = np.zeros((query_count, self.k), dtype=np.int64)
+        positions = np.full((query_count, self.k), -1, dtype=np.int64)
+        for row in range(query_count):
+            fused: Dict[Tuple[int, int], float] = {}
+            for _, row_shards, row_positions in (dense, sparse):
+                for rank, (shard, position) in enumerate(zip(row_shards[row], row_positions[row])):
+                    if position >= 0:
+                        key = (int(shard), int(position))
+                        fused[key] = fused.get(key, 0.0) + 1 / (self.rrf_k + rank + 1)
+            best = sorted(fused.items(), key=lambda item: -item[1])[:self.k]
+            for column, ((shard, position), score) in enumerate(best):
+                scores[row, column] = score
+                shard_numbers[row, column] = shard
+                positions[row, column] = position
+        return scores, shard_numbers, positions
+
+    def _prune(self, matches: Tuple[Tuple[str, float], ...]) -> List[Tuple[str, float]]:
+        """
+        Apply min_score and score_margin to matches sorted best first. Cached
+        results are stored unpruned, so changing the thresholds needs no new search.
+        """
+        matches = list(matches)
+        if self.hybrid:
+            return matches
+        if self.min_score:
+            matches = [match for match in matches if match[1] >= self.min_score]
+        if self.score_margin and matches:
+            cutoff = matches[0][1] - self.score_margin
+            matches = [match for match in matches if match[1] >= cutoff]
+        return matches
+
+    def _embed_queries(
+        self,
+        texts: List[str],
+        keys: List[str],
+        batch_size: int,
+        trace: Optional[Trace] = None
+    ) -> np.ndarray:
+        """
+        Embed query texts as given, using and filling the query embedding cache.
+        param texts: The queries, passed to the model unchanged.
+        param keys: Their normalized forms, which key the cache; queries with the
+            same key share the embedding of the first of them.
+        param batch_size: Number of queries embedded per call to the model.
+        param trace: Records the time spent in the model and the embedding cache hits.
+        Returns: A float32 matrix with one row per text.
+        """
+        trace = trace or Trace(None, "query")
+        vectors = {key: self.query_cache.embeddings.get((self.model_key, key)) for key in keys}
+        # The first text of each missing key, in order of appearance
+        missing = {}
+        for text, key in zip(texts, keys):
+            if vectors[key] is None:
+                missing.setdefault(key, text)
+        trace.count("embedding_cache_hits", len(vectors) - len(missing))
+        trace.count("embedded", len(missing))
+        missing_keys = list(missing)
+        for start in range(0, len(missing_keys), batch_size):
+            batch = missing_keys[start:start + batch_size]
+            with trace.span("embed"):
+                embedded = self.embeddings.embed_documents([missing[key] for key in batch])
+            for key, vector in zip(batch, embedded):
+                vectors[key] = np.asarray(vector, dtype=np.float32)
+                self.query_cache.embeddings.put((self.model_key, key), vectors[key])
+        return np.array([vectors[key] for key in keys], dtype=np.float32)
+
+
+@st.cache_resource
+def get_search_executor() -> ThreadPoolExecutor:
+    """Returns the thread pool shared by all matchers in this process to search shards in parallel."""
+    return ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="shard-search")
@@ -0,0 +1,277 @@
+"""
+Asyncio query service that coalesces concurrent queries into batched embed and search calls.
+
+Queries arriving within max_wait_ms of each other are answered by a single
+QueryMatcher.match_queries call, so the model runs with batch sizes above one
+under concurrent load. The service speaks JSON over HTTP so several app
+processes can share one loaded model and index:
+
+    POST /query    {"query": "...", "k": 3}         -> {"results": [{"text": ..., "score": ..., "sources": [...]}]}
+    POST /queries  {"queries": ["...", "..."]}      -> {"results": [[...], [...]]}
+
+Both POST routes accept an optional "filter" expression, see utils.search_filter.
+    GET  /health                                     -> {"status": "ok", "stats": {...}}
+    GET  /metrics                                    -> stage timings and counters, Prometheus text format
+"""
+import asyncio
+import json
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple, Union
+from loguru import logger
+from utils.search_filter import SearchFilter
+
+if TYPE_CHECKING:
+    # Only for type hints, so that clients of a remote service need not import FAISS
+    from utils.query_matching import QueryMatcher
+
+MAX_BODY_BYTES = 1 << 20
+
+
+class MicroBatcher:
+    """Collects queries for up to max_wait_ms, then matches them in one batch."""
+
+    def __init__(self, matcher: "QueryMatcher", db_path: str, max_batch_size: int = 32, max_wait_ms: float = 5):
+        """
+        Constructor for the MicroBatcher class.
+        param matcher: The query matcher that runs each batch.
+        param db_path: Path to the FAISS database directory.
+        param max_batch_size: Most queries matched in one batch.
+        param max_wait_ms: Longest time the first query of a batch waits for others.
+        """
+        self.matcher = matcher
+        self.db_path = db_path
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.batches = 0
+        self.queries = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        # One batch at a time; queries that arrive meanwhile form the next batch
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="query-batch")
+
+    def start(self) -> None:
+        """Start the batching loop on the running event loop."""
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the batching loop."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._executor.shutdown(wait=False)
+
+    async def match(
+        self, query: str, search_filter: Optional[SearchFilter] = None
+    ) -> List[Tuple[str, float, List[Dict[str, any]]]]:
+        """
+        Match one query as part of the next batch.
+        param query: The query string.
+        param search_filter: Only match chunks from these files, pages or dates.
+        Returns: A list of tuples containing (chunk_text, similarity_score, references),
+            see QueryMatcher.match_queries.
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((query, search_filter, future))
+        return await future
+
+    async def _next_batch(self) -> List[Tuple[str, Optional[SearchFilter], asyncio.Future]]:
+        """Wait for a query, then for more until the batch is full or max_wait has passed."""
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        """Match batches until cancelled. Queries with different filters are matched separately."""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            groups: Dict[Optional[SearchFilter], List[Tuple[str, asyncio.Future]]] = {}
+            for query, search_filter, future in batch:
+                groups.setdefault(search_filter, []).append((query, future))
+
+            for search_filter, group in groups.items():
+                queries = [query for query, _ in group]
+                try:
+                    results = await loop.run_in_executor(
+                        self._executor,
+                        partial(self.matcher.match_queries, with_sources=True),
+                        queries, self.db_path, self.max_batch_size, search_filter
+                    )
+                except Exception as e: # pylint: disable=W0718
+                    for _, future in group:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+
+                self.batches += 1
+                self.queries += len(group)
+                for (_, future), result in zip(group, results):
+                    if not future.done():
+                        future.set_result(result)
+
+    def stats(self) -> Dict[str, any]:
+        """Returns the number of batches and queries served and the mean batch size."""
+        return {
+            "batches": self.batches,
+            "queries": self.queries,
+            "mean_batch_size": self.queries / self.batches if self.batches else 0.0,
+        }
+
+
+class QueryService:
+    """Minimal HTTP/JSON front end for a MicroBatcher."""
+
+    def __init__(self, batcher: MicroBatcher, host: str = "127.0.0.1", port: int = 8765):
+        """
+        Constructor for the QueryService class.
+        param batcher: The batcher queries are sent to.
+        param host: The interface to listen on.
+        param port: The port to listen on.
+        """
+        self.batcher = batcher
+        self.host = host
+        self.port = port
+
+    async def serve_forever(self) -> None:
+        """Start the batcher and serve HTTP requests until cancelled."""
+        self.batcher.start()
+        server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        logger.info(f"Query service listening on http://{self.host}:{self.port}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.batcher.stop()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Serve requests on one connection, keeping it open unless the client asks to close."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get("content-length", 0))
+                if length > MAX_BODY_BYTES:
+                    await self._respond(writer, 413, {"error": "Request body too large"}, close=True)
+                    break
+                body = await reader.readexactly(length) if length else b""
+
+                status, payload = await self._route(method, path, body)
+                close = headers.get("connection", "").lower() == "close"
+                await self._respond(writer, status, payload, close)
+                if close:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, method: str, path: str, body: bytes) -> Tuple[int, Union[Dict[str, any], str]]:
+        """Dispatch a request and return the status code and the JSON payload or plain text."""
+        try:
+            if method == "GET" and path == "/health":
+                return 200, {"status": "ok", "stats": self.batcher.stats()}
+            if method == "GET" and path == "/metrics":
+                return 200, self.batcher.matcher.telemetry.to_prometheus()
+            if method != "POST" or path not in ("/query", "/queries"):
+                return 404, {"error": f"No route for {method} {path}"}
+
+            request = json.loads(body or b"{}")
+            k = request.get("k")
+            search_filter = SearchFilter.parse(request["filter"]) if request.get("filter") else None
+            if path == "/query":
+                matches = await self.batcher.match(str(request["query"]), search_filter)
+                return 200, {"results": self._serialize(matches, k)}
+            matches = await asyncio.gather(
+                *(self.batcher.match(str(query), search_filter) for query in request["queries"])
+            )
+            return 200, {"results": [self._serialize(result, k) for result in matches]}
+        except (KeyError, TypeError, ValueError) as e:
+            return 400, {"error": f"Invalid request: {str(e)}"}
+        except RuntimeError as e:
+            return 500, {"error": str(e)}
+
+    @staticmethod
+    def _serialize(matches: List[Tuple[str, float, List[Dict[str, any]]]], k: Optional[int]) -> List[Dict[str, any]]:
+        """Convert matches to JSON, keeping at most k of them."""
+        return [
+            {"text": text, "score": float(score), "sources": sources} for text, score, sources in matches[:k]
+        ]
+
+    @staticmethod
+    async def _respond(
+        writer: asyncio.StreamWriter, status: int, payload: Union[Dict[str, any], str], close: bool
+    ) -> None:
+        """Write a JSON response, or a plain text one for a string payload."""
+        if isinstance(payload, str):
+            body, content_type = payload.encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            body, content_type = json.dumps(payload).encode("utf-8"), "application/json"
+        reason = {200: "OK", 400: "Bad Request", 404: "Not Found", 413: "Payload Too Large"}.get(status, "Error")
+        head = (
+            f"HTTP/1.1 {status} {reason}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'close' if close else 'keep-alive'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+
+
+class QueryServiceClient:
+    """Sends queries to a running QueryService."""
+
+    def __init__(self, url: str, timeout: float = 30):
+        """
+        Constructor for the QueryServiceClient class.
+        param url: Base URL of the service, e.g. http://127.0.0.1:8765.
+        param timeout: Seconds to wait for a response.
+        """
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def match_query(
+        self,
+        query: str,
+        k: Optional[int] = None,
+        filter_expression: Optional[str] = None
+    ) -> List[Tuple[str, float, List[Dict[str, any]]]]:
+        """
+        Match a query through the service.
+        param query: The query string.
+        param k: Number of matches to return, at most the service's k.
+        param filter_expression: Only match chunks from these files, pages or dates.
+        Returns: A list of tuples containing (chunk_text, similarity_score, references),
+            with no references from services that do not send them.
+        Raises: RuntimeError: If the service cannot be reached or reports an error.
+        """
+        request = urllib.request.Request(
+            f"{self.url}/query",
+            data=json.dumps({"query": query, "k": k, "filter": filter_expression}).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                payload = json.load(response)
+        except OSError as e:
+            raise RuntimeError(f"Failed to match query: {str(e)}") from e
+        return [(match["text"], match["score"], match.get("sources", [])) for match in payload["results"]]
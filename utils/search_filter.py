@@ -0,0 +1,95 @@
+"""
+Metadata filters restricting a search to chunks from given files, pages or modification dates.
+
+Filters are written as space-separated terms, all of which must match:
+    file:<glob>[,<glob>...]   source file path or name, e.g. file:manual*.pdf
+    page:<n> or page:<a>-<b>  1-based page number or inclusive range
+    after:<YYYY-MM-DD>        source file modified on or after this date
+    before:<YYYY-MM-DD>       source file modified before this date
+"""
+import fnmatch
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Optional, Tuple
+import numpy as np
+from utils.chunk_store import ChunkStore
+
+
+@dataclass(frozen=True)
+class SearchFilter:
+    """A parsed filter expression. Frozen so it can be part of cache keys."""
+
+    files: Tuple[str, ...] = ()
+    pages: Optional[Tuple[int, int]] = None
+    modified_after: Optional[float] = None
+    modified_before: Optional[float] = None
+
+    @classmethod
+    def parse(cls, expression: str) -> "SearchFilter":
+        """
+        Parse a filter expression.
+        param expression: The expression, empty for no filter.
+        Raises: ValueError: If a term is not understood.
+        """
+        files, pages, after, before = [], None, None, None
+        for term in expression.split():
+            name, _, value = term.partition(":")
+            try:
+                if name == "file" and value:
+                    files.extend(pattern for pattern in value.split(",") if pattern)
+                elif name == "page":
+                    first, _, last = value.partition("-")
+                    pages = (int(first), int(last or first))
+                elif name == "after":
+                    after = datetime.fromisoformat(value).timestamp()
+                elif name == "before":
+                    before = datetime.fromisoformat(value).timestamp()
+                else:
+                    raise ValueError(f"unknown term {term}")
+            except ValueError as e:
+                raise ValueError(f"Invalid filter '{term}': {str(e)}") from e
+        return cls(tuple(files), pages, after, before)
+
+    @property
+    def is_empty(self) -> bool:
+        """True when the filter matches every chunk."""
+        return self == SearchFilter()
+
+    def row_mask(self, store: ChunkStore) -> np.ndarray:
+        """
+        Evaluate the filter over the columns of a chunk store.
+        File and date terms are resolved once per source, then expanded to rows
+        through the source code column. A row also matches when a near-duplicate
+        merged into it at ingest does.
+        param store: The chunk store.
+        Returns: A boolean array with one entry per row.
+        """
+        allowed_sources = np.ones(len(store.sources), dtype=bool)
+        for code, source in enumerate(store.sources):
+            mtime = store.source_mtimes[code]
+            if self.files and not any(
+                fnmatch.fnmatch(source, pattern) or fnmatch.fnmatch(Path(source).name, pattern)
+                for pattern in self.files
+            ):
+                allowed_sources[code] = False
+            if self.modified_after is not None and (mtime is None or mtime < self.modified_after):
+                allowed_sources[code] = False
+            if self.modified_before is not None and (mtime is None or mtime >= self.modified_before):
+                allowed_sources[code] = False
+
+        mask = self._matches(allowed_sources, store.source_codes, store.pages)
+        if store.duplicate_count:
+            duplicates = self._matches(allowed_sources, store.duplicate_source_codes, store.duplicate_pages)
+            positions = store.lookup(store.canonical_ids[duplicates])
+            mask[positions[positions >= 0]] = True
+        return mask
+
+    def _matches(self, allowed_sources: np.ndarray, source_codes: np.ndarray, pages: np.ndarray) -> np.ndarray:
+        """Returns which of the given rows have an allowed source and a page in range."""
+        mask = allowed_sources[source_codes] if len(source_codes) else np.zeros(0, dtype=bool)
+        if self.pages is not None:
+            # Pages are stored 0-based, -1 when unknown
+            first, last = self.pages
+            mask &= (pages >= first - 1) & (pages <= last - 1)
+        return mask
@@ -0,0 +1,107 @@
+"""
+Splits a FAISS database into shards, each with its own index, chunk store and manifest.
+"""
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Dict, List
+
+SHARDS_FILE = "shards.json"
+SHARD_BY = ("path_hash", "folder")
+
+
+class ShardLayout:
+    """
+    Maps source files to shards and shards to directories. A database with one
+    shard keeps its files directly in the database directory, as databases
+    built before sharding did.
+    """
+
+    def __init__(self, db_path: str, shard_count: int = 1, shard_by: str = "path_hash"):
+        """
+        Constructor for the ShardLayout class.
+        param db_path: Path to the FAISS database directory.
+        param shard_count: Number of shards.
+        param shard_by: 'path_hash' to spread files by the hash of their path, or
+            'folder' to keep the files of each source folder in the same shard.
+        """
+        if shard_count < 1:
+            raise ValueError(f"The shard count must be at least 1, got {shard_count}")
+        if shard_by not in SHARD_BY:
+            raise ValueError(f"Unsupported shard_by {shard_by}, expected one of {SHARD_BY}")
+        self.db_path = Path(db_path)
+        self.shard_count = shard_count
+        self.shard_by = shard_by
+
+    @classmethod
+    def load(cls, db_path: str) -> "ShardLayout":
+        """
+        Load the layout recorded in a database directory, defaulting to a single shard.
+        param db_path: Path to the FAISS database directory.
+        """
+        layout_path = Path(db_path) / SHARDS_FILE
+        if not layout_path.exists():
+            return cls(db_path)
+        with open(layout_path, "r", encoding="utf-8") as handle:
+            data = json.load(handle)
+        return cls(db_path, data["shard_count"], data["shard_by"])
+
+    def save(self) -> None:
+        """Atomically record the layout in the database directory."""
+        self.db_path.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.db_path / f"{SHARDS_FILE}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as handle:
+            json.dump({"shard_count": self.shard_count, "shard_by": self.shard_by}, handle)
+        os.replace(tmp_path, self.db_path / SHARDS_FILE)
+
+    def matches(self, other: "ShardLayout") -> bool:
+        """True when both layouts put every file in the same shard."""
+        return (self.shard_count, self.shard_by) == (other.shard_count, other.shard_by)
+
+    def shard_dir(self, shard: int) -> Path:
+        """Returns the directory of a shard."""
+        if self.shard_count == 1:
+            return self.db_path
+        return self.db_path / f"shard-{shard:03d}"
+
+    def shard_dirs(self) -> List[Path]:
+        """Returns the directories of all shards."""
+        return [self.shard_dir(shard) for shard in range(self.shard_count)]
+
+    def shard_of(self, file_path: Path, folder_path: Path) -> int:
+        """
+        Returns the shard a file belongs to. The assignment only depends on the
+        path relative to the ingested folder, so it is stable across runs and hosts.
+        param file_path: The source file.
+        param folder_path: The folder being ingested.
+        """
+        if self.shard_count == 1:
+            return 0
+        relative = Path(file_path).relative_to(folder_path)
+        key = relative.parent if self.shard_by == "folder" else relative
+        digest = hashlib.sha1(key.as_posix().encode("utf-8")).digest()
+        return int.from_bytes(digest[:8], "big") % self.shard_count
+
+    def spreads(self, file_pattern: str) -> bool:
+        """
+        True unless every file matched by a glob pattern is bound to land in the same
+        shard. Folder sharding needs a pattern that reaches into subfolders, such as
+        '**/*.pdf': '*.pdf' only matches files directly in the ingested folder.
+        param file_pattern: The glob pattern selecting the files to ingest.
+        """
+        if self.shard_count == 1 or self.shard_by != "folder":
+            return True
+        return "**" in file_pattern or len(Path(file_pattern).parts) > 1
+
+    def partition(self, pdf_files: List[Path], folder_path: str) -> Dict[int, List[Path]]:
+        """
+        Group files by shard, keeping their order within each shard.
+        param pdf_files: The source files.
+        param folder_path: The folder being ingested.
+        Returns: The files of every shard, including empty ones.
+        """
+        shards: Dict[int, List[Path]] = {shard: [] for shard in range(self.shard_count)}
+        for pdf_file in pdf_files:
+            shards[self.shard_of(pdf_file, Path(folder_path))].append(pdf_file)
+        return shards
@@ -0,0 +1,244 @@
+"""
+Low-overhead timing spans and counters for the ingest and query paths.
+
+Each operation, such as an ingest run, a parsed file or a batch of queries, is
+recorded as a Trace: the time spent in each of its stages plus its counters.
+When a trace ends it is added to the process-wide totals and, when enabled,
+logged to the loguru sinks as one JSON line, e.g.
+    {"event": "query", "duration_ms": 3.1, "stages_ms": {"embed": 2.2, "search": 0.8}, "counters": {"queries": 1}}
+The totals can be exported in the Prometheus text format and are shown on the Diagnostics page.
+"""
+import json
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+import streamlit as st
+from loguru import logger
+
+METRIC_PREFIX = "rag"
+
+
+class _Span:
+    """Times a with block into a stage of a trace; a plain class is cheaper than a generator context manager."""
+
+    __slots__ = ("trace", "stage", "start")
+
+    def __init__(self, trace: "Trace", stage: str):
+        self.trace = trace
+        self.stage = stage
+        self.start = 0.0
+
+    def __enter__(self) -> None:
+        self.start = time.perf_counter()
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.trace.add_time(self.stage, time.perf_counter() - self.start)
+
+
+class Trace:
+    """
+    The stage durations and counters of one operation. Stages may be entered
+    several times, and from several threads; their durations add up.
+    """
+
+    def __init__(self, telemetry: Optional["Telemetry"], event: str, **fields: any):
+        """
+        Constructor for the Trace class.
+        param telemetry: Receives the trace when it ends, or None to record nothing.
+        param event: The kind of operation, e.g. 'ingest' or 'query'.
+        param fields: Attributes of the operation logged with it, e.g. the database path.
+        """
+        self.telemetry = telemetry
+        self.event = event
+        self.fields = fields
+        self.stages: Dict[str, float] = defaultdict(float)
+        self.counters: Dict[str, float] = defaultdict(int)
+        self.seconds = 0.0
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def span(self, stage: str) -> _Span:
+        """
+        Time the enclosed with block as part of a stage.
+        param stage: The stage name, e.g. 'embed'.
+        """
+        return _Span(self, stage)
+
+    def add_time(self, stage: str, seconds: float) -> None:
+        """
+        Add a duration measured elsewhere, such as in a worker process, to a stage.
+        param stage: The stage name.
+        param seconds: The duration.
+        """
+        with self._lock:
+            self.stages[stage] += seconds
+
+    def count(self, name: str, value: float = 1) -> None:
+        """
+        Increment a counter.
+        param name: The counter name, e.g. 'cache_hits'.
+        param value: The amount to add.
+        """
+        with self._lock:
+            self.counters[name] += value
+
+    def end(self, **fields: any) -> None:
+        """
+        Finish the trace and hand it to the telemetry.
+        param fields: More attributes of the operation, e.g. an error message.
+        """
+        self.seconds = time.perf_counter() - self._start
+        self.fields.update(fields)
+        if self.telemetry is not None:
+            self.telemetry.record(self)
+
+    def to_dict(self) -> Dict[str, any]:
+        """Returns the finished trace as a JSON-serializable event."""
+        return {
+            "event": self.event,
+            **self.fields,
+            "duration_ms": round(1000 * self.seconds, 3),
+            "stages_ms": {stage: round(1000 * seconds, 3) for stage, seconds in self.stages.items()},
+            "counters": dict(self.counters),
+        }
+
+    def __enter__(self) -> "Trace":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.end(**({"error": str(exc_value)} if exc_value is not None else {}))
+
+
+class Telemetry:
+    """
+    Process-wide totals of every trace: per event, the number of operations and
+    their time; per stage, the total and maximum time; and the sum of every counter.
+    """
+
+    def __init__(self, enabled: bool = True, log_level: str = "INFO", prometheus_file: str = ""):
+        """
+        Constructor for the Telemetry class.
+        param enabled: Log each trace as a JSON line; totals are kept either way.
+        param log_level: The loguru level traces are logged at.
+        param prometheus_file: Rewrite the totals in the Prometheus text format to this
+            file after each trace, e.g. for the node_exporter textfile collector, '' to disable.
+        """
+        self.enabled = enabled
+        self.log_level = log_level.upper()
+        self.prometheus_file = prometheus_file
+        self._events: Dict[str, list] = defaultdict(lambda: [0, 0.0])
+        self._stages: Dict[Tuple[str, str], list] = defaultdict(lambda: [0, 0.0, 0.0])
+        self._counters: Dict[Tuple[str, str], float] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def trace(self, event: str, **fields: any) -> Trace:
+        """
+        Start a trace recorded by this telemetry.
+        param event: The kind of operation.
+        param fields: Attributes of the operation logged with it.
+        """
+        return Trace(self, event, **fields)
+
+    def record(self, trace: Trace) -> None:
+        """
+        Add a finished trace to the totals and log it.
+        param trace: The trace.
+        """
+        with self._lock:
+            totals = self._events[trace.event]
+            totals[0] += 1
+            totals[1] += trace.seconds
+            for stage, seconds in trace.stages.items():
+                stage_totals = self._stages[(trace.event, stage)]
+                stage_totals[0] += 1
+                stage_totals[1] += seconds
+                stage_totals[2] = max(stage_totals[2], seconds)
+            for name, value in trace.counters.items():
+                self._counters[(trace.event, name)] += value
+        if self.enabled:
+            logger.log(self.log_level, json.dumps(trace.to_dict(), default=str))
+        if self.prometheus_file:
+            self.write_prometheus(self.prometheus_file)
+
+    def snapshot(self) -> Dict[str, any]:
+        """Returns a copy of the totals as events, stages and counters."""
+        with self._lock:
+            return {
+                "events": {
+                    event: {"count": count, "seconds": seconds} for event, (count, seconds) in self._events.items()
+                },
+                "stages": [
+                    {"event": event, "stage": stage, "count": count, "seconds": seconds, "max_seconds": longest}
+                    for (event, stage), (count, seconds, longest) in self._stages.items()
+                ],
+                "counters": [
+                    {"event": event, "name": name, "value": value}
+                    for (event, name), value in self._counters.items()
+                ],
+            }
+
+    def reset(self) -> None:
+        """Drop all totals."""
+        with self._lock:
+            self._events.clear()
+            self._stages.clear()
+            self._counters.clear()
+
+    def to_prometheus(self) -> str:
+        """Returns the totals in the Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        lines = [
+            f"# HELP {METRIC_PREFIX}_operations_total Operations completed, by event.",
+            f"# TYPE {METRIC_PREFIX}_operations_total counter",
+        ]
+        lines += [
+            f'{METRIC_PREFIX}_operations_total{{event="{event}"}} {totals["count"]}'
+            for event, totals in snapshot["events"].items()
+        ]
+        lines += [
+            f"# HELP {METRIC_PREFIX}_operation_seconds Time spent in operations, by event.",
+            f"# TYPE {METRIC_PREFIX}_operation_seconds summary",
+        ]
+        for event, totals in snapshot["events"].items():
+            lines.append(f'{METRIC_PREFIX}_operation_seconds_sum{{event="{event}"}} {totals["seconds"]:.6f}')
+            lines.append(f'{METRIC_PREFIX}_operation_seconds_count{{event="{event}"}} {totals["count"]}')
+        lines += [
+            f"# HELP {METRIC_PREFIX}_stage_seconds Time spent in each stage of an operation.",
+            f"# TYPE {METRIC_PREFIX}_stage_seconds summary",
+        ]
+        for row in snapshot["stages"]:
+            labels = f'event="{row["event"]}",stage="{row["stage"]}"'
+            lines.append(f"{METRIC_PREFIX}_stage_seconds_sum{{{labels}}} {row['seconds']:.6f}")
+            lines.append(f"{METRIC_PREFIX}_stage_seconds_count{{{labels}}} {row['count']}")
+        counters = defaultdict(list)
+        for row in snapshot["counters"]:
+            counters[re.sub(r"[^a-zA-Z0-9_]", "_", row["name"])].append(row)
+        for name, rows in sorted(counters.items()):
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name}_total counter")
+            lines += [f'{METRIC_PREFIX}_{name}_total{{event="{row["event"]}"}} {row["value"]:g}' for row in rows]
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, file_path: str) -> None:
+        """
+        Atomically write the totals in the Prometheus text format.
+        param file_path: The file to write.
+        """
+        tmp_path = Path(f"{file_path}.tmp")
+        tmp_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path.write_text(self.to_prometheus(), encoding="utf-8")
+        os.replace(tmp_path, file_path)
+
+
+@st.cache_resource
+def get_telemetry(enabled: bool = True, log_level: str = "INFO", prometheus_file: str = "") -> Telemetry:
+    """
+    Returns the telemetry shared by all Streamlit sessions in this process.
+    param enabled: Log each trace as a JSON line.
+    param log_level: The loguru level traces are logged at.
+    param prometheus_file: File the totals are written to in the Prometheus text format, '' to disable.
+    """
+    return Telemetry(enabled, log_level, prometheus_file)